@@ -0,0 +1,318 @@
+# ------------------------------------------------------------------------------
+# End-to-end latency of the response path, from releasing the talk button to the
+# first sample arriving at Audio2Face:
+#   stopConvai -> final gRPC write -> first audio_response -> onDataReceived
+#   -> playout to the audio socket -> A2F bridge -> PushAudioStream
+# Runs the real client against the local Convai stand-in (in process) and the
+# headless A2F bridge with its Audio2Face stand-in (a subprocess), talking into
+# an injected microphone. Run from app/src:
+#   python -m bench.e2e run [--iterations 20] [--audio a.wav,b.wav] [--mode asyncio]
+#                           [--first-delay-ms 300] [--delay-ms 80] [--jitter-ms 40] [--out e2e.json]
+#   python -m bench.e2e compare base.json new.json [--threshold-pct 10] [--floor-ms 5]
+# compare exits with 1 if any stage got slower, so it can gate a commit.
+# The bridge's times are perf_counter times of another process, which is only
+# comparable because perf_counter is the system wide monotonic clock on Linux,
+# macOS and Windows.
+# ------------------------------------------------------------------------------
+
+import argparse, json, os, signal, socket, subprocess, sys, tempfile, time
+import numpy as np
+from common import trace
+from convai import standin
+from convai.convai import ConvaiBackend, RATE
+from convai.a2fconnection import A2FConnection
+
+BRIDGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', '..', '..', 'omni', 'shakespeare-ai', 'exts', 'shakespeare.ai', 'shakespeare', 'ai')
+
+# stage -> (from mark, to mark)
+STAGES = {
+    'upload': ('micRelease', 'finalWrite'),             # last mic read until the final request is written
+    'convai': ('finalWrite', 'firstResponse'),          # the service's time to first audio, the stand-in's delay here
+    'responseStage': ('firstResponse', 'dataReceived'), # handing the chunk off the gRPC thread
+    'jitterBuffer': ('dataReceived', 'playout'),        # decoding and buffering before playout
+    'bridge': ('playout', 'a2fStreamStart'),            # audio socket and bridge until the stream to A2F opens
+    'a2fChunking': ('a2fStreamStart', 'a2fFirstAudio'), # the bridge collecting its first chunk for A2F
+    'total': ('micRelease', 'a2fFirstAudio')
+}
+
+def log(text: str, warning: bool = False):
+    print(f"[e2e] {'[Warning]' if warning else ''} {text}")
+
+class InjectedMic:
+    '''
+    Stands in for the PyAudio input stream, playing an utterance into the client
+    in real time, followed by silence.
+    '''
+    def __init__(self, pcm: bytes, sampleRate: int = RATE):
+        self.pcm = pcm
+        self.sampleRate = sampleRate
+        self.startTime = time.perf_counter()
+        self.position = 0 # in frames
+
+    def read(self, frames, exception_on_overflow=True):
+        available = self.startTime + (self.position + frames) / self.sampleRate - time.perf_counter()
+        if available > 0: # blocks like a real mic until the frames were spoken
+            time.sleep(available)
+        data = self.pcm[self.position * 2:(self.position + frames) * 2]
+        self.position += frames
+        return data + bytes(frames * 2 - len(data))
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+def loadUtterances(paths):
+    '''
+    Reads the utterances to talk into the client, resampled to the mic rate.
+
+    Args:
+        paths (list[str]): 16 bit mono WAV files, a synthesized one if empty
+
+    Returns:
+        list[bytes]: PCM of every utterance
+    '''
+    if not paths:
+        return [standin.synthesizeSpeech(1.5, RATE)]
+    utterances = []
+    for path in paths:
+        pcm, sampleRate = standin.readWav(path)
+        samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32)
+        if sampleRate != RATE:
+            times = np.arange(int(len(samples) * RATE / sampleRate)) / RATE
+            samples = np.interp(times, np.arange(len(samples)) / sampleRate, samples)
+        utterances.append(samples.astype('<i2').tobytes())
+    return utterances
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def waitForPort(port, timeout=10.):
+    '''
+    Waits until something listens on the port, the bridge needs a moment to start.
+    '''
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(.1)
+
+def percentiles(values):
+    '''
+    Returns:
+        dict: p50 / p95 / p99 / mean / max of the values, None if there are none
+    '''
+    if not values:
+        return None
+    ordered = sorted(values)
+    percentile = lambda p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+    return {'n': len(ordered), 'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99),
+            'mean': sum(ordered) / len(ordered), 'max': ordered[-1]}
+
+def stageTimes(marks):
+    '''
+    Returns:
+        dict: Stage -> milliseconds, for the stages both of whose marks were recorded
+    '''
+    return {stage: (marks[end] - marks[begin]) * 1000
+            for stage, (begin, end) in STAGES.items() if begin in marks and end in marks}
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def startBridge(args, recordPath):
+    '''
+    Starts the headless A2F bridge with its Audio2Face stand-in.
+
+    Returns:
+        tuple[subprocess.Popen, int, int]: The bridge process, its audio and control port
+    '''
+    audioPort, controlPort = freePort(), freePort()
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    process = subprocess.Popen([args.bridge_python, '-m', 'a2f', '--mode', args.mode, '--standin',
+                                '--a2f-url', f'localhost:{freePort()}', '--audio-port', str(audioPort),
+                                '--control-port', str(controlPort), '--record', recordPath],
+                               cwd=args.bridge_dir, env=env, stdout=None if args.verbose else subprocess.DEVNULL)
+    return process, audioPort, controlPort
+
+def stopBridge(process):
+    '''
+    Stops the bridge, which makes it write its record.
+    '''
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        log('Bridge did not exit, killing it', warning=True)
+        process.kill()
+        process.wait()
+
+def runIteration(backend, utterance, args):
+    '''
+    Talks one utterance into the client and waits until the reply was played out.
+
+    Returns:
+        dict: The trace marks, start and end bounding the iteration
+    '''
+    current = trace.start()
+    current.mark('start')
+    backend.openInputStream = lambda: InjectedMic(utterance)
+    backend.startConvaiThread()
+    time.sleep(len(utterance) / 2 / RATE)
+    backend.stopConvai()
+    if current.waitFor('playoutFinal', args.timeout) is None:
+        log('No reply played out in time', warning=True)
+    time.sleep(args.settle) # lets the bridge push the rest to A2F
+    backend.a2f.stop() # ends the stream to A2F, like interrupting would
+    trace.stop()
+    marks = dict(current.marks)
+    marks['end'] = time.perf_counter()
+    return marks
+
+def addBridgeMarks(iterations, streams):
+    '''
+    Adds the A2F stand-in's stream start and first audio to the iteration whose window they fall into.
+    '''
+    for stream in streams:
+        for marks in iterations:
+            if marks['start'] <= stream['startTime'] <= marks['end']:
+                marks.setdefault('a2fStreamStart', stream['startTime'])
+                if stream['arrivals']:
+                    marks.setdefault('a2fFirstAudio', stream['startTime'] + stream['arrivals'][0]['ms'] / 1000)
+                break
+
+def run(args):
+    utterances = loadUtterances(args.audio.split(',') if args.audio else [])
+    reply = standin.readWav(args.reply) if args.reply else (None, standin.DEFAULT_SAMPLE_RATE)
+    convaiStandIn = standin.ConvaiStandIn(reply[0], reply[1], chunkMs=[float(ms) for ms in args.chunk_ms.split(',')],
+                                          firstDelayMs=args.first_delay_ms, delayMs=args.delay_ms,
+                                          jitterMs=args.jitter_ms, seed=args.seed)
+    grpcServer, _, convaiPort = standin.serveStandIn('localhost:0', convaiStandIn)
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        recordPath = os.path.join(tmpDir, 'streams.json')
+        bridge, audioPort, controlPort = startBridge(args, recordPath)
+        try:
+            backend = ConvaiBackend()
+            backend.channelAddress = f'localhost:{convaiPort}'
+            backend.isChannelInsecure = True
+            backend.apiKey = backend.apiKey or 'bench'
+            backend.charId = backend.charId or 'bench'
+            backend.a2fPrt, backend.cntrlPrt = audioPort, controlPort
+            backend.a2f = A2FConnection(backend.a2fHst, audioPort, controlPort)
+            waitForPort(controlPort) # warmUp connects once and leaves the rest to the supervisor
+            backend.warmUp()
+            backend.readyEvent.wait()
+
+            iterations = []
+            for index in range(args.warmup + args.iterations):
+                marks = runIteration(backend, utterances[index % len(utterances)], args)
+                if index >= args.warmup:
+                    iterations.append(marks)
+                log(f"{'warm up ' if index < args.warmup else ''}iteration {index + 1}: "
+                    + ', '.join(f'{stage} {ms:.1f}ms' for stage, ms in stageTimes(marks).items()))
+            backend.a2f.close()
+        finally:
+            stopBridge(bridge)
+            grpcServer.stop(0)
+
+        with open(recordPath, 'r', encoding='utf-8') as f:
+            addBridgeMarks(iterations, json.load(f))
+
+    perIteration = [stageTimes(marks) for marks in iterations]
+    stages = {stage: percentiles([times[stage] for times in perIteration if stage in times]) for stage in STAGES}
+    report(stages)
+    results = {
+        'meta': {'commit': gitCommit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'mode': args.mode,
+                 'iterations': args.iterations, 'warmup': args.warmup, 'audio': args.audio,
+                 'chunkMs': args.chunk_ms, 'firstDelayMs': args.first_delay_ms,
+                 'delayMs': args.delay_ms, 'jitterMs': args.jitter_ms, 'python': sys.version.split()[0]},
+        'stages': stages,
+        'iterations': perIteration
+    }
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        log(f'Wrote {args.out}')
+
+def report(stages):
+    print(f"{'stage':<14} {'n':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for stage, stats in stages.items():
+        if not stats:
+            print(f'{stage:<14} {0:>4} not recorded')
+            continue
+        print(f"{stage:<14} {stats['n']:>4} {stats['p50']:>9.1f} {stats['p95']:>9.1f} "
+              f"{stats['p99']:>9.1f} {stats['mean']:>9.1f}")
+
+def compare(args):
+    '''
+    Compares the p50 and p95 of every stage between two runs.
+    A stage regressed if it got slower by more than the threshold and the floor both.
+    '''
+    with open(args.base, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"{base['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    print(f"{'stage':<14} {'':>4} {'base ms':>9} {'new ms':>9} {'change':>8}")
+    regressions = []
+    for stage in STAGES:
+        baseStats, newStats = base['stages'].get(stage), new['stages'].get(stage)
+        if not baseStats or not newStats:
+            continue
+        for key in ('p50', 'p95'):
+            before, after = baseStats[key], newStats[key]
+            change = (after - before) / before * 100 if before else 0.
+            isRegression = after - before > args.floor_ms and change > args.threshold_pct
+            if isRegression:
+                regressions.append(f'{stage} {key}')
+            print(f"{stage:<14} {key:>4} {before:>9.1f} {after:>9.1f} {change:>+7.1f}%{'  slower' if isRegression else ''}")
+    if regressions:
+        print(f"regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench.e2e', description='End-to-end latency from mic release to audio at A2F')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    runParser = commands.add_parser('run', help='Measure the response path against the local stand-ins')
+    runParser.add_argument('--iterations', type=int, default=20)
+    runParser.add_argument('--warmup', type=int, default=2, help='iterations run first and left out of the results')
+    runParser.add_argument('--audio', help='comma separated 16 bit mono WAV files to talk into the mic, cycled through')
+    runParser.add_argument('--reply', help='16 bit mono WAV file the Convai stand-in replies with')
+    runParser.add_argument('--mode', choices=('threads', 'asyncio'), default='asyncio', help='A2F bridge mode')
+    runParser.add_argument('--chunk-ms', default='500', help='reply chunk durations, see convai.standin')
+    runParser.add_argument('--first-delay-ms', type=float, default=0.)
+    runParser.add_argument('--delay-ms', type=float, default=0.)
+    runParser.add_argument('--jitter-ms', type=float, default=0.)
+    runParser.add_argument('--seed', type=int, default=0)
+    runParser.add_argument('--settle', type=float, default=.5, help='seconds to wait after the reply played out')
+    runParser.add_argument('--timeout', type=float, default=30., help='seconds to wait for a reply')
+    runParser.add_argument('--bridge-dir', default=BRIDGE_DIR, help='shakespeare/ai directory of the extension')
+    runParser.add_argument('--bridge-python', default=sys.executable, help='interpreter to run the bridge with')
+    runParser.add_argument('--verbose', action='store_true', help='show the bridge output')
+    runParser.add_argument('--out', help='write the results as JSON to this file')
+
+    compareParser = commands.add_parser('compare', help='Compare two result files, exit with 1 on regressions')
+    compareParser.add_argument('base')
+    compareParser.add_argument('new')
+    compareParser.add_argument('--threshold-pct', type=float, default=10.)
+    compareParser.add_argument('--floor-ms', type=float, default=5., help='ignore changes smaller than this')
+
+    args = parser.parse_args()
+    run(args) if args.command == 'run' else compare(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+# ------------------------------------------------------------------------------
+# Micro-benchmarks of the audio hot paths, checked against stored baselines:
+#   appendAudData  A2FClient.appendAudData, fading a chunk into the bridge's buffer
+#   a2fChunks      taking an A2F chunk off that buffer and converting it to float32,
+#                  what generateAudChunks does for every request
+#   framing        handleAudClient reading and parsing a framed message off the audio socket
+#   onDataReceived ConvaiBackend.onDataReceived, WAV decoding into the jitter buffer
+#   encodeImg      ImageHandler.encodeImg on photo sized files
+# Run from app/src:
+#   python -m bench.micro [--rounds 50] [--only framing,a2fChunks] [--threshold-pct 20]
+#   python -m bench.micro --update-baseline
+# Exits with 1 if a case got slower than its baseline by more than the threshold.
+# Baselines are machine specific, so none is shipped. Create one with
+# --update-baseline on the machine the checks run on, using Python 3.12+ with
+# the pinned requirements.txt, before comparing against it.
+# ------------------------------------------------------------------------------
+
+import argparse, contextlib, json, os, platform, socket, statistics, struct, sys, tempfile, threading, time
+import numpy as np
+from convai.standin import toWav
+from .e2e import BRIDGE_DIR, gitCommit
+
+sys.path.append(BRIDGE_DIR)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'microbaseline.json')
+CHUNK_SECONDS = (.1, .5, 2.) # Convai sends 0.1 - 2s chunks
+A2F_CHUNK_SECONDS = (.1, .3, .5) # A2FClient.chunkDuration is 0.3s
+SAMPLE_RATES = (22050, 44100)
+IMAGE_BYTES = (200_000, 2_000_000, 8_000_000) # screenshot to phone photo
+BUFFERED_SECONDS = 2. # audio waiting in the bridge when chunks are taken off it
+
+def log(text: str, warning: bool = False):
+    print(f"[micro] {'[Warning]' if warning else ''} {text}")
+
+def makePcm(seconds, sampleRate):
+    '''
+    Returns:
+        bytes: 16 bit mono white noise
+    '''
+    return (np.random.default_rng(0).standard_normal(int(seconds * sampleRate)) * 3000).astype('<i2').tobytes()
+
+def measure(fn, rounds, setup=None):
+    '''
+    Times every call on its own, so the state can be reset in between untimed.
+
+    Returns:
+        dict: Median and min time per call in microseconds
+    '''
+    times = []
+    for _ in range(rounds):
+        if setup:
+            setup()
+        start = time.perf_counter_ns()
+        fn()
+        times.append((time.perf_counter_ns() - start) / 1000)
+    return {'medianUs': statistics.median(times), 'minUs': min(times)}
+
+def benchAppendAudData(rounds):
+    from a2f.server import A2FClient, A2F_URL, A2F_INSTANCE
+    client = A2FClient(A2F_URL, A2F_INSTANCE) # the channel only connects on the first call
+    client.isStreaming = True # keeps the stream thread from starting
+    for seconds in CHUNK_SECONDS:
+        for sampleRate in SAMPLE_RATES:
+            pcm = makePcm(seconds, sampleRate)
+            yield f'{seconds}s@{sampleRate}', measure(lambda: client.appendAudData(pcm, sampleRate), rounds, client.accAud.clear)
+
+def benchA2FChunks(rounds):
+    from a2f.server import A2FClient, A2F_URL, A2F_INSTANCE
+    import audio2face_pb2
+    client = A2FClient(A2F_URL, A2F_INSTANCE)
+
+    def takeAndConvert():
+        with client.lock:
+            audChunk = client.takeChunk()
+        audio2face_pb2.PushAudioStreamRequest(audio_data=client.toA2FAudio(audChunk))
+
+    for seconds in A2F_CHUNK_SECONDS:
+        for sampleRate in SAMPLE_RATES:
+            buffered = makePcm(BUFFERED_SECONDS, sampleRate)
+            def refill():
+                client.accAud = bytearray(buffered)
+            client.sampleRate, client.chunkDuration = sampleRate, seconds
+            yield f'{seconds}s@{sampleRate}', measure(takeAndConvert, rounds, refill)
+
+def benchFraming(rounds):
+    '''
+    Reads frames the way handleAudClient does, from a socket pair another thread keeps writing to.
+    '''
+    from a2f.server import StopSignal, recvExactly, parseAudMessage
+    stopEvent = StopSignal()
+    try:
+        for seconds in CHUNK_SECONDS:
+            for sampleRate in SAMPLE_RATES:
+                message = struct.pack('>i', sampleRate) + b'|' + makePcm(seconds, sampleRate)
+                frame = struct.pack('>i', len(message)) + message
+                reader, writer = socket.socketpair()
+                def send():
+                    for _ in range(rounds):
+                        writer.sendall(frame)
+                sender = threading.Thread(target=send, daemon=True)
+                sender.start()
+
+                def readFrame():
+                    msgLen = struct.unpack('>i', recvExactly(reader, 4, stopEvent))[0]
+                    parseAudMessage(recvExactly(reader, msgLen, stopEvent))
+
+                yield f'{seconds}s@{sampleRate}', measure(readFrame, rounds)
+                sender.join()
+                reader.close()
+                writer.close()
+    finally:
+        stopEvent.close()
+
+def benchOnDataReceived(rounds):
+    from convai.convai import ConvaiBackend
+    backend = ConvaiBackend.getInstance() # no A2F and no speaker, playout just drains the jitter buffer
+    try:
+        for seconds in CHUNK_SECONDS:
+            for sampleRate in SAMPLE_RATES:
+                data = toWav(makePcm(seconds, sampleRate), sampleRate)
+                yield f'{seconds}s@{sampleRate}', measure(lambda: backend.onDataReceived('', data, sampleRate, False),
+                                                          rounds, backend.jitterBuffer.flush)
+    finally:
+        backend.jitterBuffer.flush()
+
+def benchEncodeImg(rounds):
+    from gemini.image import ImageHandler
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for size in IMAGE_BYTES:
+            imgPath = os.path.join(tmpDir, f'{size}.jpg')
+            with open(imgPath, 'wb') as imgFile:
+                imgFile.write(np.random.default_rng(0).bytes(size))
+            yield f'{size // 1000}kB', measure(lambda: ImageHandler.encodeImg(imgPath), rounds)
+
+BENCHMARKS = {
+    'appendAudData': benchAppendAudData,
+    'a2fChunks': benchA2FChunks,
+    'framing': benchFraming,
+    'onDataReceived': benchOnDataReceived,
+    'encodeImg': benchEncodeImg
+}
+
+def runBenchmarks(names, rounds):
+    '''
+    Returns:
+        dict: Case name (benchmark/params) -> measure() result
+    '''
+    results = {}
+    for name in names:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull): # the paths log every chunk
+            cases = list(BENCHMARKS[name](rounds))
+        for params, stats in cases:
+            results[f'{name}/{params}'] = stats
+            print(f"{name + '/' + params:<32} {stats['medianUs']:>11.1f} {stats['minUs']:>11.1f}")
+    return results
+
+def compare(results, baseline, thresholdPct, floorUs):
+    '''
+    Checks the medians against the baseline. A case regressed if it got slower
+    by more than the threshold and the floor both.
+
+    Returns:
+        list[str]: The cases that regressed
+    '''
+    print(f"{'case':<32} {'base us':>11} {'new us':>11} {'change':>8}")
+    regressions = []
+    for case, stats in results.items():
+        before = baseline['cases'].get(case)
+        if before is None:
+            continue
+        after = stats['medianUs']
+        change = (after - before) / before * 100 if before else 0.
+        isRegression = after - before > floorUs and change > thresholdPct
+        if isRegression:
+            regressions.append(case)
+        print(f"{case:<32} {before:>11.1f} {after:>11.1f} {change:>+7.1f}%{'  slower' if isRegression else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench.micro', description='Micro-benchmarks of the audio hot paths')
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--only', help=f"comma separated benchmarks out of {', '.join(BENCHMARKS)}")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--threshold-pct', type=float, default=20.)
+    parser.add_argument('--floor-us', type=float, default=5., help='ignore changes smaller than this')
+    parser.add_argument('--out', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    print(f"{'case':<32} {'median us':>11} {'min us':>11}")
+    results = runBenchmarks(names, args.rounds)
+    meta = {'commit': gitCommit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'rounds': args.rounds,
+            'machine': platform.machine(), 'processor': platform.processor(), 'python': sys.version.split()[0]}
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'cases': results}, f, indent=2)
+
+    if args.update_baseline:
+        baseline = {'meta': meta, 'cases': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline['cases'] = json.load(f)['cases'] # keeps the cases that weren't run
+        baseline['cases'].update({case: round(stats['medianUs'], 1) for case, stats in results.items()})
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+        log(f'Updated {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        log(f'No baseline at {args.baseline}, store one with --update-baseline', warning=True)
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['meta'].get('python') != meta['python'] or baseline['meta'].get('machine') != meta['machine']:
+        log(f"Baseline was taken on {baseline['meta'].get('machine')} / Python {baseline['meta'].get('python')}", warning=True)
+    regressions = compare(results, baseline, args.threshold_pct, args.floor_us)
+    if regressions:
+        print(f"regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# ------------------------------------------------------------------------------
+# Startup profiling for the Qt client.
+# In process, through main.py (run from app/src):
+#   python main.py --profile-startup [--profile-out startup.json]
+# reports the import time of every module and the time to first paint, then quits.
+# Cold starts in fresh processes, checked against a budget:
+#   python -m bench.startup [--runs 5] [--budget-ms 1500]
+# ------------------------------------------------------------------------------
+
+import sys, os, time, json, argparse, subprocess, tempfile, statistics
+
+def log(text: str, warning: bool = False):
+    print(f"[startup] {'[Warning]' if warning else ''} {text}")
+
+class TimedLoader:
+    '''
+    Wraps a module loader to time the creation and execution of the module
+    (single phase extension modules do all their work in create_module).
+    Everything else is passed through to the wrapped loader.
+    '''
+    def __init__(self, loader, profiler, name):
+        self.loader = loader
+        self.profiler = profiler
+        self.name = name
+
+    def create_module(self, spec):
+        self.profiler.enter(self.name)
+        try:
+            return self.loader.create_module(spec)
+        finally:
+            self.profiler.exit(self.name)
+
+    def exec_module(self, module):
+        self.profiler.enter(self.name)
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profiler.exit(self.name)
+
+    def __getattr__(self, attr):
+        return getattr(self.loader, attr)
+
+class StartupProfiler:
+    '''
+    Meta path finder that times every module imported while it's installed,
+    and an event filter that notes the first paint of the window.
+    '''
+    def __init__(self, startTime, outPath=None):
+        '''
+        Args:
+            startTime (float): perf_counter time at which main.py started
+            outPath (str): Optional JSON file the report is written to
+        '''
+        self.startTime = startTime
+        self.outPath = outPath
+        self.imports = {} # name -> [total s, self s]
+        self.stack = [] # [name, start, time spent in nested imports]
+        self.marks = {}
+        self.active = False
+
+    @classmethod
+    def fromArgs(cls, argv, startTime):
+        '''
+        Creates the profiler if --profile-startup is given, removing its flags from argv.
+
+        Returns:
+            StartupProfiler | None: The profiler
+        '''
+        if '--profile-startup' not in argv:
+            return None
+        argv.remove('--profile-startup')
+        outPath = None
+        if '--profile-out' in argv:
+            index = argv.index('--profile-out')
+            outPath = argv[index + 1]
+            del argv[index:index + 2]
+        return cls(startTime, outPath)
+
+    def install(self):
+        self.active = True
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        self.active = False
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = TimedLoader(spec.loader, self, fullname)
+                return spec
+        return None
+
+    def enter(self, name):
+        if self.active:
+            self.stack.append([name, time.perf_counter(), 0.])
+
+    def exit(self, name):
+        if not self.active or not self.stack or self.stack[-1][0] != name:
+            return
+        _, start, nested = self.stack.pop()
+        total = time.perf_counter() - start
+        times = self.imports.setdefault(name, [0., 0.])
+        times[0] += total
+        times[1] += total - nested
+        if self.stack:
+            self.stack[-1][2] += total
+
+    def mark(self, name):
+        '''
+        Records the time since main.py started under the given name.
+        '''
+        self.marks[name] = time.perf_counter() - self.startTime
+
+    def watchFirstPaint(self, app):
+        '''
+        Reports and quits once the first widget got painted.
+        '''
+        from PyQt5 import QtCore
+
+        profiler = self
+        class FirstPaintFilter(QtCore.QObject):
+            def eventFilter(self, obj, event):
+                if event.type() == QtCore.QEvent.Paint and 'firstPaint' not in profiler.marks:
+                    profiler.mark('firstPaint')
+                    QtCore.QTimer.singleShot(0, lambda: app.exit(profiler.report()))
+                return False
+
+        self.paintFilter = FirstPaintFilter()
+        app.installEventFilter(self.paintFilter)
+
+    def report(self, top=25):
+        '''
+        Prints the slowest imports and the marks, and writes the JSON report if asked to.
+
+        Returns:
+            int: 0, used as the exit code
+        '''
+        self.uninstall()
+        importTime = sum(own for _, own in self.imports.values())
+        log(f'{len(self.imports)} modules imported, {importTime * 1000:.0f}ms in total')
+        log(f"{'module':<48} {'self ms':>9} {'total ms':>9}")
+        for name, (total, own) in sorted(self.imports.items(), key=lambda item: -item[1][1])[:top]:
+            log(f'{name:<48} {own * 1000:>9.1f} {total * 1000:>9.1f}')
+        for name, seconds in self.marks.items():
+            log(f'{name}: {seconds * 1000:.0f}ms after main.py started')
+
+        if self.outPath:
+            with open(self.outPath, 'w', encoding='utf-8') as f:
+                json.dump({'marks': {name: seconds * 1000 for name, seconds in self.marks.items()},
+                           'importMs': {name: {'totalMs': total * 1000, 'selfMs': own * 1000}
+                                        for name, (total, own) in self.imports.items()},
+                           'importTotalMs': importTime * 1000}, f, indent=2)
+        return 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark of the Qt client')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=None, help='Fail if the median time to first paint exceeds this')
+    args = parser.parse_args()
+
+    mainPath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+    wallTimes, paintTimes = [], []
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            outPath = os.path.join(tmpDir, 'startup.json')
+            start = time.perf_counter()
+            subprocess.run([sys.executable, mainPath, '--profile-startup', '--profile-out', outPath],
+                           cwd=os.path.dirname(mainPath), check=True, stdout=subprocess.DEVNULL)
+            wallTimes.append((time.perf_counter() - start) * 1000)
+            with open(outPath, 'r', encoding='utf-8') as f:
+                paintTimes.append(json.load(f)['marks']['firstPaint'])
+        print(f'run {run + 1}: first paint {paintTimes[-1]:.0f}ms after main.py, process {wallTimes[-1]:.0f}ms')
+
+    median = statistics.median(paintTimes)
+    print(f'median first paint {median:.0f}ms, median process {statistics.median(wallTimes):.0f}ms')
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f'over the {args.budget_ms:.0f}ms budget')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
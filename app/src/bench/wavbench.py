@@ -0,0 +1,62 @@
+# ------------------------------------------------------------------------------
+# Benchmarks the response path WAV handling: convai.wavreader vs pydub.
+# Run from app/src:
+#   python -m bench.wavbench [--rounds 200]
+# ------------------------------------------------------------------------------
+
+import argparse, timeit, wave
+import numpy as np
+from io import BytesIO
+from pydub import AudioSegment
+from convai import wavreader
+
+CHUNK_SECONDS = (.1, .5, 2.)
+SAMPLE_RATES = (22050, 44100)
+
+def makeWav(seconds, sampleRate):
+    '''
+    Builds a mono 16 bit WAV chunk of white noise, shaped like a Convai response chunk.
+    '''
+    samples = (np.random.default_rng(0).standard_normal(int(seconds * sampleRate)) * 3000).astype('<i2')
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wavFile:
+        wavFile.setnchannels(1)
+        wavFile.setsampwidth(2)
+        wavFile.setframerate(sampleRate)
+        wavFile.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+def pydubPath(data):
+    '''
+    What onDataReceived used to do for every chunk.
+    '''
+    segment = AudioSegment.from_wav(BytesIO(data)).fade_in(10).fade_out(10)
+    wavBuffer = BytesIO()
+    segment.export(wavBuffer, format='wav')
+    return wavBuffer.getvalue()
+
+def wavreaderPath(data):
+    fmt, pcm = wavreader.readPcm(data, 0)
+    return wavreader.fadeEdges(pcm, fmt, 10)
+
+def parseOnly(data):
+    return wavreader.parseWav(data)
+
+def main():
+    parser = argparse.ArgumentParser(description='WAV parsing benchmark')
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'chunk':>8} {'rate':>6} {'pydub us':>10} {'wavreader us':>13} {'parse us':>9} {'speedup':>8}")
+    for seconds in CHUNK_SECONDS:
+        for sampleRate in SAMPLE_RATES:
+            data = makeWav(seconds, sampleRate)
+            timings = []
+            for fn in (pydubPath, wavreaderPath, parseOnly):
+                best = min(timeit.repeat(lambda: fn(data), number=args.rounds, repeat=3))
+                timings.append(best / args.rounds * 1e6)
+            print(f'{seconds:>7}s {sampleRate:>6} {timings[0]:>10.1f} {timings[1]:>13.1f} '
+                  f'{timings[2]:>9.2f} {timings[0] / timings[1]:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+from .configcache import *
+from .lazyimport import *
+# httpclient pulls in requests, import it explicitly where it's used:
+#   from common import httpclient
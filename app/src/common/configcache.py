@@ -0,0 +1,45 @@
+# ------------------------------------------------------------------------------
+# Parsed-once config files. A file is only parsed again when its mtime changes,
+# so the env files can still be edited while the app is running.
+# ------------------------------------------------------------------------------
+
+import os, threading, configparser
+
+_cache = {}
+_cacheLock = threading.Lock()
+
+def loadConfig(path: str, parse=None):
+    '''
+    Loads an ini style config file, reusing the previous result if the file is unchanged.
+
+    Args:
+        path (str): The path to the config file
+        parse (callable): Optional fn turning the ConfigParser into the value to cache
+
+    Returns:
+        The ConfigParser, or what parse returned for it
+    '''
+    stat = os.stat(path)
+    key = (os.path.abspath(path), parse)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    with _cacheLock:
+        cached = _cache.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+    config = configparser.ConfigParser()
+    with open(path, encoding='utf-8') as configFile:
+        config.read_file(configFile)
+    value = parse(config) if parse else config
+
+    with _cacheLock:
+        _cache[key] = (version, value)
+    return value
+
+def clearConfigCache():
+    '''
+    Forgets all cached configs, forcing them to be parsed again.
+    '''
+    with _cacheLock:
+        _cache.clear()
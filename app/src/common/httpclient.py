@@ -0,0 +1,74 @@
+# ------------------------------------------------------------------------------
+# Shared HTTP client layer for the Gemini and Convai REST calls.
+# One keep-alive requests.Session per service, so repeated calls reuse
+# pooled TLS connections, with default timeouts and retry with backoff.
+# ------------------------------------------------------------------------------
+
+import threading, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (5, 60) # connect, read in seconds
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessionsLock = threading.Lock()
+
+class PooledSession(requests.Session):
+    '''
+    requests.Session that applies a default timeout to every request.
+    '''
+    def __init__(self, timeout):
+        super().__init__()
+        self.defaultTimeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.defaultTimeout)
+        return super().request(method, url, **kwargs)
+
+def getSession(name: str, retries: int = 3, backoff: float = .5, retryStatuses=RETRY_STATUSES,
+               timeout=DEFAULT_TIMEOUT, poolSize: int = 4, respectRetryAfter: bool = True, retryPost: bool = False):
+    '''
+    Gets the shared session for a service, creating it on first use.
+    The retry / pool settings only apply when the session is created.
+
+    Args:
+        name (str): Name of the service, e.g. 'gemini' or 'convai'
+        retries (int): Retries for connection errors and retryStatuses
+        backoff (float): Exponential backoff factor in seconds between retries
+        retryStatuses (tuple[int]): HTTP statuses that are retried, Retry-After is respected
+        timeout (tuple[float, float]): Default (connect, read) timeout
+        poolSize (int): Connections kept alive per host
+        respectRetryAfter (bool): Whether urllib3 itself sleeps and retries on a Retry-After header,
+                                  disable it when the caller handles rate limiting
+        retryPost (bool): Whether POSTs are retried on retryStatuses and read errors too, only for
+                          idempotent calls. Otherwise they're only retried when they couldn't connect,
+                          a 5xx after the server did the work would be billed again
+
+    Returns:
+        PooledSession: The shared session
+    '''
+    with _sessionsLock:
+        session = _sessions.get(name)
+        if session is None:
+            retry = Retry(total=retries,
+                          backoff_factor=backoff,
+                          status_forcelist=retryStatuses,
+                          allowed_methods=frozenset(['GET', 'POST'] if retryPost else ['GET']),
+                          respect_retry_after_header=respectRetryAfter,
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=retry)
+            session = PooledSession(timeout)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[name] = session
+        return session
+
+def closeSessions():
+    '''
+    Closes all shared sessions and their pooled connections.
+    '''
+    with _sessionsLock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,64 @@
+# ------------------------------------------------------------------------------
+# Lazy module imports, so that heavy modules (pyaudio, grpc, numpy, Pillow, ...)
+# are only loaded when they're first used instead of when the app starts.
+# ------------------------------------------------------------------------------
+
+import importlib, importlib.util, threading
+
+class LazyModule:
+    '''
+    Stand-in for a module that imports it on first attribute access.
+    Thread safe, attributes are cached on the stand-in once looked up.
+    '''
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def load(self):
+        '''
+        Imports the module if that didn't happen yet.
+
+        Returns:
+            module: The imported module
+        '''
+        module = self.__dict__['_module']
+        if module is None:
+            with self.__dict__['_lock']:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_name'])
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr): # only called for attributes that aren't cached yet
+        value = getattr(self.load(), attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+        self.__dict__[attr] = value
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+def lazyImport(name: str, optional: bool = False):
+    '''
+    Gets a module that is imported on first use.
+
+    Args:
+        name (str): Absolute name of the module, e.g. 'pyaudio' or 'convai.rpc.service_pb2'
+        optional (bool): Return None instead of a stand-in if the module isn't installed
+
+    Returns:
+        LazyModule | None: The stand-in for the module
+    '''
+    if optional:
+        try:
+            if importlib.util.find_spec(name) is None:
+                return None
+        except ImportError: # the parent package is missing
+            return None
+    return LazyModule(name)
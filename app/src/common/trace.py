@@ -0,0 +1,64 @@
+# ------------------------------------------------------------------------------
+# Named trace marks along the response path (mic release -> audio at A2F),
+# recorded by the end-to-end benchmark. Nothing is recorded unless a trace is
+# active, so mark() is a single global lookup in normal use.
+# ------------------------------------------------------------------------------
+
+import threading, time
+
+active = None # the Trace being recorded, if any
+
+class Trace:
+    '''
+    perf_counter times of the first occurrence of every mark.
+    '''
+    def __init__(self):
+        self.marks = {}
+        self.cond = threading.Condition()
+
+    def mark(self, name: str):
+        with self.cond:
+            if name not in self.marks:
+                self.marks[name] = time.perf_counter()
+                self.cond.notify_all()
+
+    def waitFor(self, name: str, timeout: float = None):
+        '''
+        Blocks until the mark got recorded.
+
+        Returns:
+            float | None: Its time, None if it didn't happen in time
+        '''
+        with self.cond:
+            self.cond.wait_for(lambda: name in self.marks, timeout)
+            return self.marks.get(name)
+
+def start():
+    '''
+    Starts recording a new trace, replacing the active one.
+
+    Returns:
+        Trace: The trace
+    '''
+    global active
+    active = Trace()
+    return active
+
+def stop():
+    '''
+    Stops recording.
+
+    Returns:
+        Trace | None: The trace that was active
+    '''
+    global active
+    trace, active = active, None
+    return trace
+
+def mark(name: str):
+    '''
+    Records the current time under the name, if a trace is active and it wasn't recorded yet.
+    '''
+    trace = active
+    if trace is not None:
+        trace.mark(name)
@@ -1 +1,9 @@
-from .convai import *
+# The backend's names are loaded on first access, it pulls in PyQt5 and requests.
+# That keeps the pure modules (jitterbuffer, wavreader, a2fconnection, ...)
+# importable on their own, e.g. from convai.jitterbuffer import JitterBuffer
+import importlib, importlib.util
+
+def __getattr__(name):
+    if name.startswith('__') or importlib.util.find_spec(f'{__name__}.{name}') is not None:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'") # submodules are left to the import system
+    return getattr(importlib.import_module('.convai', __name__), name)
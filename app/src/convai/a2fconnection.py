@@ -0,0 +1,357 @@
+# ------------------------------------------------------------------------------
+# Connection manager for the A2F socket server running in the Omniverse extension.
+# Owns the audio and control sockets, pings the server over the control socket
+# to measure the round trip time and notice when it went away, and reconnects
+# both sockets with exponential backoff. Audio of the utterance in flight is kept
+# so whatever the server hadn't played yet is sent again after a reconnect.
+# ------------------------------------------------------------------------------
+
+import threading, time, random
+from socket import socket, AF_INET, SOCK_STREAM, SHUT_RDWR
+from struct import pack
+
+SAMPLE_WIDTH = 2 # 16 bit mono PCM
+
+def log(text: str, warning: bool = False):
+    print(f"[A2FConnection] {'[Warning]' if warning else ''} {text}")
+
+class A2FConnection:
+    '''
+    Supervised audio + control connection to the A2F socket server.
+    '''
+    def __init__(self, host='localhost', audioPort=65432, controlPort=65433, pingInterval=2.,
+                 pingTimeout=1., minBackoff=.5, maxBackoff=10., graceSeconds=15., connectTimeout=1., sendTimeout=2.):
+        '''
+        Args:
+            host (str): Host of the A2F socket server
+            audioPort (int): Port the audio is sent to
+            controlPort (int): Port for the stop / ping commands
+            pingInterval (float): Seconds between pings while connected
+            pingTimeout (float): Seconds to wait for a pong before the connection counts as lost
+            minBackoff (float): First wait in seconds before reconnecting
+            maxBackoff (float): Longest wait in seconds between reconnect attempts
+            graceSeconds (float): How long after losing the connection audio is still held for A2F
+            connectTimeout (float): Timeout in seconds for connecting a socket
+            sendTimeout (float): Seconds an audio send may block before the connection counts as lost,
+                                 a server that stops reading would hold the playout thread forever otherwise
+        '''
+        self.host = host
+        self.audioPort = audioPort
+        self.controlPort = controlPort
+        self.pingInterval = pingInterval
+        self.pingTimeout = pingTimeout
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+        self.graceSeconds = graceSeconds
+        self.connectTimeout = connectTimeout
+        self.sendTimeout = sendTimeout
+
+        self.audSocket = None
+        self.cntrlSocket = None
+        self.sendLock = threading.Lock() # audio socket and utterance
+        self.cntrlLock = threading.Lock() # one command / reply at a time on the control socket
+        self.wakeEvent = threading.Event()
+        self.closeEvent = threading.Event()
+        self.supervisorThread = None
+        self.wasConnected = False
+        self.lostAt = None
+
+        self.utterance = [] # (pcm, sampleRate) of the utterance in flight
+        self.sentChunks = 0 # how many of them reached the server
+        self.utteranceStart = None # perf_counter time the server got the first chunk
+        self.isUtteranceFinal = False
+
+        self.stats = {'pings': 0, 'lostPings': 0, 'reconnects': 0, 'replayedMs': 0.,
+                      'lastRttMs': None, 'meanRttMs': None, 'maxRttMs': None}
+
+    @property
+    def isConnected(self):
+        return self.audSocket is not None and self.cntrlSocket is not None
+
+    @property
+    def isAvailable(self):
+        '''
+        Whether audio should go to A2F: connected, or lost recently enough
+        that it's held for a reconnect rather than played locally.
+        '''
+        if self.isConnected:
+            return True
+        return self.wasConnected and self.lostAt is not None and time.monotonic() - self.lostAt < self.graceSeconds
+
+    def start(self):
+        '''
+        Starts the supervisor thread that keeps the connection up, if not already running.
+        '''
+        if self.supervisorThread and self.supervisorThread.is_alive():
+            return
+        self.closeEvent.clear()
+        self.supervisorThread = threading.Thread(target=self.supervisorLoop, daemon=True)
+        self.supervisorThread.start()
+
+    def close(self):
+        '''
+        Stops the supervisor and closes both sockets.
+        '''
+        self.closeEvent.set()
+        self.wakeEvent.set()
+        self.disconnect()
+
+    def connect(self, verbose=True):
+        '''
+        Connects both sockets once.
+
+        Args:
+            verbose (bool): Log why connecting failed
+
+        Returns:
+            bool: Whether both sockets connected
+        '''
+        try:
+            audSocket = self.openSocket(self.audioPort, self.sendTimeout)
+        except OSError as e:
+            if verbose:
+                log(f'Could not connect the audio socket: {e}', warning=True)
+            return False
+        try:
+            cntrlSocket = self.openSocket(self.controlPort, None) # command sets its own timeouts
+        except OSError as e:
+            if verbose:
+                log(f'Could not connect the control socket: {e}', warning=True)
+            audSocket.close()
+            return False
+
+        with self.sendLock:
+            self.audSocket = audSocket
+            with self.cntrlLock:
+                self.cntrlSocket = cntrlSocket
+            if self.wasConnected:
+                self.stats['reconnects'] += 1
+                if self.lostAt is not None and time.monotonic() - self.lostAt >= self.graceSeconds:
+                    self.clearUtterance() # played locally in the meantime
+            self.wasConnected = True
+            self.lostAt = None
+            self.replay()
+        log(f'Connected to A2F on {self.host}:{self.audioPort}/{self.controlPort}')
+        return True
+
+    def openSocket(self, port, timeout):
+        '''
+        Connects a socket within connectTimeout.
+
+        Args:
+            port (int): Port to connect to
+            timeout (float | None): Timeout for blocking calls on the connected socket
+
+        Returns:
+            socket: The connected socket
+        '''
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.settimeout(self.connectTimeout)
+        try:
+            sock.connect((self.host, port))
+        except OSError:
+            sock.close()
+            raise
+        sock.settimeout(timeout)
+        return sock
+
+    def disconnect(self):
+        '''
+        Closes both sockets, the supervisor reconnects unless closed.
+        '''
+        for sock in (self.audSocket, self.cntrlSocket): # wakes a sender blocked on them, which holds sendLock
+            if sock:
+                try:
+                    sock.shutdown(SHUT_RDWR)
+                except OSError:
+                    pass
+        with self.sendLock:
+            wasConnected = self.isConnected
+            for sock in (self.audSocket, self.cntrlSocket):
+                if sock:
+                    try:
+                        sock.close()
+                    except OSError:
+                        pass
+            self.audSocket = None
+            self.cntrlSocket = None
+            if wasConnected:
+                self.lostAt = time.monotonic()
+        if wasConnected:
+            self.wakeEvent.set()
+
+    def onLost(self, reason):
+        if self.isConnected:
+            log(f'Lost the A2F connection: {reason}', warning=True)
+        self.disconnect()
+
+    def supervisorLoop(self):
+        '''
+        Reconnects with exponential backoff while disconnected, pings while connected.
+        '''
+        backoff = self.minBackoff
+        while not self.closeEvent.is_set():
+            if not self.isConnected:
+                if self.connect(verbose=backoff == self.minBackoff): # only log the first failure in a row
+                    backoff = self.minBackoff
+                    continue
+                delay = backoff * random.uniform(.8, 1.2) # jitter, so restarts don't synchronize
+                backoff = min(self.maxBackoff, backoff * 2)
+                self.wakeEvent.wait(delay)
+                self.wakeEvent.clear()
+                continue
+
+            self.wakeEvent.wait(self.pingInterval)
+            self.wakeEvent.clear()
+            if self.isConnected and not self.closeEvent.is_set():
+                self.ping()
+
+    def command(self, request: bytes, replyLength: int, timeout):
+        '''
+        Sends a command over the control socket and reads its fixed length reply.
+
+        Returns:
+            bytes | None: The reply, None if the connection was lost
+        '''
+        with self.cntrlLock:
+            sock = self.cntrlSocket
+            if sock is None:
+                return None
+            try:
+                sock.settimeout(timeout)
+                sock.sendall(request)
+                reply = b''
+                while len(reply) < replyLength:
+                    chunk = sock.recv(replyLength - len(reply))
+                    if not chunk:
+                        raise ConnectionResetError('closed by the server')
+                    reply += chunk
+                sock.settimeout(None)
+                return reply
+            except OSError as e: # socket timeouts included
+                reason = str(e) or type(e).__name__
+        self.onLost(f'{request.decode()} failed: {reason}')
+        return None
+
+    def ping(self):
+        '''
+        Measures the round trip time over the control socket.
+
+        Returns:
+            float | None: RTT in seconds, None if the server didn't answer in time
+        '''
+        start = time.perf_counter()
+        reply = self.command(b'ping', 4, self.pingTimeout)
+        self.stats['pings'] += 1
+        if reply != b'pong':
+            self.stats['lostPings'] += 1
+            if reply is not None:
+                self.onLost(f'unexpected reply to ping: {reply!r}')
+            return None
+
+        rtt = (time.perf_counter() - start) * 1000
+        stats = self.stats
+        stats['lastRttMs'] = rtt
+        stats['meanRttMs'] = rtt if stats['meanRttMs'] is None else stats['meanRttMs'] + (rtt - stats['meanRttMs']) / 8
+        stats['maxRttMs'] = max(rtt, stats['maxRttMs'] or 0.)
+        return rtt / 1000
+
+    def stop(self, timeout=2.):
+        '''
+        Tells the server to stop streaming and forgets the utterance in flight.
+
+        Returns:
+            bool: Whether the server confirmed the stop
+        '''
+        self.clearUtterance()
+        reply = self.command(b'stop', 7, timeout)
+        if reply == b'stopped':
+            log('Received confirmation of stop from A2F')
+            return True
+        return False
+
+    def sendAudio(self, pcm, sampleRate: int, isFinal: bool = False):
+        '''
+        Sends 16 bit mono PCM to the server. The chunk is kept with the rest of
+        the utterance, so it's sent again after a reconnect if it wasn't played.
+
+        Returns:
+            bool: Whether the chunk reached the server now
+        '''
+        with self.sendLock:
+            if self.isUtteranceFinal: # previous utterance is done, start a new one
+                self.clearUtterance()
+            self.utterance.append((bytes(pcm), sampleRate))
+            self.isUtteranceFinal = isFinal
+            if self.audSocket is None:
+                return False
+            if not self.sendChunk(pcm, sampleRate):
+                return False
+            self.sentChunks = len(self.utterance)
+            return True
+
+    def sendChunk(self, pcm, sampleRate):
+        '''
+        Writes one framed chunk to the audio socket, called with sendLock held.
+        '''
+        message = pack('>i', sampleRate) + b'|' + bytes(pcm)
+        try:
+            self.audSocket.sendall(pack('>i', len(message)) + message)
+        except OSError as e: # socket timeouts included, the server stopped reading
+            reason = str(e) or type(e).__name__
+            threading.Thread(target=self.onLost, args=(f'audio send failed: {reason}',), daemon=True).start()
+            return False
+        if self.utteranceStart is None:
+            self.utteranceStart = time.perf_counter()
+        return True
+
+    def clearUtterance(self):
+        self.utterance = []
+        self.sentChunks = 0
+        self.utteranceStart = None
+        self.isUtteranceFinal = False
+
+    def replay(self):
+        '''
+        Sends the part of the utterance in flight the old connection didn't get to play,
+        called with sendLock held right after connecting.
+        '''
+        if not self.utterance:
+            return
+        played = 0.
+        if self.utteranceStart is not None: # the server can't have played more than it got
+            sent = sum(len(pcm) / (SAMPLE_WIDTH * sampleRate) for pcm, sampleRate in self.utterance[:self.sentChunks])
+            played = min(sent, time.perf_counter() - self.utteranceStart)
+
+        remaining = []
+        for pcm, sampleRate in self.utterance:
+            duration = len(pcm) / (SAMPLE_WIDTH * sampleRate)
+            if played >= duration:
+                played -= duration
+                continue
+            skip = int(played * sampleRate) * SAMPLE_WIDTH
+            remaining.append((pcm[skip:], sampleRate))
+            played = 0.
+
+        self.utteranceStart = None
+        self.utterance = remaining
+        self.sentChunks = 0
+        if not remaining:
+            return
+
+        replayed = sum(len(pcm) / (SAMPLE_WIDTH * sampleRate) for pcm, sampleRate in remaining)
+        log(f'Replaying the last {replayed * 1000:.0f}ms of the interrupted utterance')
+        for pcm, sampleRate in remaining:
+            if not self.sendChunk(pcm, sampleRate):
+                return
+            self.sentChunks += 1
+        self.stats['replayedMs'] += replayed * 1000
+
+    def getStats(self):
+        '''
+        Returns:
+            dict: Connection state, ping / RTT and reconnect counters
+        '''
+        stats = dict(self.stats)
+        stats['connected'] = self.isConnected
+        return stats
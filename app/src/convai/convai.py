@@ -7,23 +7,31 @@
 # A2F uses grpcio==1.51.3 & protobuf==3.17.3
 # ------------------------------------------------------------------------------
 
-import os, configparser, pyaudio, grpc, requests, json, threading, time
+import os, configparser, json, threading, time, hashlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Generator
 from collections import deque
 from PyQt5.QtCore import pyqtSignal, QObject
-from .rpc import service_pb2 as convaiServiceMsg, service_pb2_grpc as convaiService
-from pydub import AudioSegment, playback
-from io import BytesIO
-from socket import socket, AF_INET, SOCK_STREAM
-from struct import pack
 from .localaudioplayer import LocalAudioPlayer
+from .a2fconnection import A2FConnection
+from .responsestage import ResponseStage
+from .jitterbuffer import JitterBuffer
+from . import wavreader
+from common import httpclient, configcache, lazyImport, trace
+
+# loaded on first use, keeps them off the startup path
+pyaudio = lazyImport('pyaudio')
+grpc = lazyImport('grpc')
+convaiServiceMsg = lazyImport('convai.rpc.service_pb2')
+convaiService = lazyImport('convai.rpc.service_pb2_grpc')
 
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__))) # current file's directory
 
 CHUNK = 1024 # audio chunk size
-FORMAT = pyaudio.paInt16 # 16 bit int audio format
+FORMAT = 8 # pyaudio.paInt16, 16 bit int audio format, spelled out so pyaudio isn't loaded here
 CHANNELS = 1
 RATE = 6000 # 6kHz sample rate
+CHANNEL_READY_TIMEOUT = 5 # seconds given to the gRPC channel to connect during warm up
 
 def log(text: str, warning: bool = False):
     print(f'[convai] {'[Warning]' if warning else ''} {text}')
@@ -31,6 +39,7 @@ def log(text: str, warning: bool = False):
 def loadConvaiConfig():
     ''''
     Load the Convai configuration from the convai.env file.
+    The file is only parsed again when it changes.
 
     Returns:
         dict: The Convai configuration data
@@ -39,25 +48,36 @@ def loadConvaiConfig():
     if not os.path.exists(configPath):
         raise FileNotFoundError('Convai configuration file not found.')
 
-    config = configparser.ConfigParser()
-    config.read(configPath)
+    try:
+        return configcache.loadConfig(configPath, parseConvaiConfig)
+    except KeyError:
+        raise
+    except Exception as e:
+        log(f"An error occurred while loading the Convai configuration: {e}", warning=True)
+        return {}
+
+def parseConvaiConfig(config):
+    '''
+    Picks the Convai settings out of the parsed convai.env file.
+
+    Args:
+        config (configparser.ConfigParser): The parsed file
 
+    Returns:
+        dict: The Convai configuration data
+    '''
     try:
-        convaiConfig = {
+        return {
             'apiKey': config.get('CONVAI', 'API_KEY'),
             'characterId': config.get('CONVAI', 'CHARACTER_ID'),
             'channel': config.get('CONVAI', 'CHANNEL'),
             'actions': config.get('CONVAI', 'ACTIONS'),
             'sessionId': config.get('CONVAI', 'SESSION_ID'),
-            'baseBackstory': config.get('CONVAI', 'BASE_BACKSTORY').replace('\\n', '\n')
+            'baseBackstory': config.get('CONVAI', 'BASE_BACKSTORY').replace('\\n', '\n'),
+            'backstoryDebounceMs': config.getint('CONVAI', 'BACKSTORY_DEBOUNCE_MS', fallback=750)
         }
     except configparser.NoOptionError as e:
         raise KeyError(f'Missing configuration key in convai.env: {e}')
-    except Exception as e:
-        log(f"An error occurred while loading the Convai configuration: {e}", warning=True)
-        return {}
-
-    return convaiConfig
 
 def updateCharBackstory(newBackstory):
     '''
@@ -65,6 +85,9 @@ def updateCharBackstory(newBackstory):
 
     Args:
         newBackstory (str): The new backstory to update
+
+    Returns:
+        bool: True if Convai accepted the update
     '''
     try:
         config = loadConvaiConfig()
@@ -78,30 +101,122 @@ def updateCharBackstory(newBackstory):
             'Content-Type': 'application/json'
         }
 
-        response = requests.post(url, headers=headers, data=payload)
+        response = httpclient.getSession('convai', retryPost=True).post(url, headers=headers, data=payload) # idempotent
         if response.status_code == 200:
             log('Character updated successfully.')
-        else:
-            log(f'Failed to update character: {response.status_code} - {response.text}')
+            return True
+        log(f'Failed to update character: {response.status_code} - {response.text}')
     except Exception as e:
         log(f"An error occurred while updating the character backstory: {e}", warning=True)
+    return False
 
-def appendToCharBackstory(backstoryUpdate):
+def buildBackstory(backstoryUpdate):
     '''
-    Appends text recieved from gemini to the current backstory.
+    Appends text recieved from gemini to the base backstory.
 
-    Args:
-        backstoryUpdate (str): The text to append to the backstory,
-                               recieved from gemini.
+    Returns:
+        str: The full backstory, empty if there is no base backstory
     '''
-    try:
-        config = loadConvaiConfig()
-        currBackstory = config['baseBackstory']
-        if currBackstory:
-            newBackstory = f'{currBackstory}\n{backstoryUpdate}'
-            updateCharBackstory(newBackstory)
-    except Exception as e:
-        log(f"An error occurred while appending to the character backstory: {e}", warning=True)
+    currBackstory = loadConvaiConfig()['baseBackstory']
+    return f'{currBackstory}\n{backstoryUpdate}' if currBackstory else ''
+
+# ------------------------------------------------------------------------------------
+# BackstorySync pushes backstory updates to Convai in the background.
+# Bursts of updates are debounced into one request, updates identical to
+# what was last pushed are skipped, and the latest update always wins.
+# ------------------------------------------------------------------------------------
+
+class BackstorySync:
+    '''
+    Debounced, deduplicated, asynchronous backstory updates.
+    This class is a singleton, ensuring only one instance exists.
+    '''
+    _instance = None
+
+    @staticmethod
+    def getInstance():
+        '''
+        Get the singleton instance of the BackstorySync class.
+        '''
+        if BackstorySync._instance is None:
+            BackstorySync._instance = BackstorySync()
+        return BackstorySync._instance
+
+    def __init__(self):
+        '''
+        Initializes the sync state, the worker thread is started on the first submit.
+        '''
+        self.cond = threading.Condition()
+        self.pending = None # latest update that hasn't been pushed yet
+        self.deadline = 0.
+        self.isPushing = False
+        self.lastPushedHash = None
+        self.workerThread = None
+
+    def submit(self, backstoryUpdate):
+        '''
+        Schedules the text recieved from gemini to be appended to the backstory.
+        Replaces any update that is still waiting, and restarts the debounce window.
+
+        Args:
+            backstoryUpdate (str): The text to append to the backstory
+        '''
+        debounce = loadConvaiConfig().get('backstoryDebounceMs', 750) / 1000
+        with self.cond:
+            if self.pending is not None:
+                log('Superseding a backstory update that was not pushed yet')
+            self.pending = backstoryUpdate
+            self.deadline = time.monotonic() + debounce
+            self.cond.notify_all()
+            if not self.workerThread or not self.workerThread.is_alive():
+                self.workerThread = threading.Thread(target=self.syncLoop, daemon=True)
+                self.workerThread.start()
+
+    def syncLoop(self):
+        '''
+        Waits for the debounce window of the latest update to pass, then pushes it.
+        Pushes are serialized, so a newer update is always pushed after an older one.
+        '''
+        while True:
+            with self.cond:
+                while self.pending is None or time.monotonic() < self.deadline:
+                    self.cond.wait(None if self.pending is None else self.deadline - time.monotonic())
+                backstoryUpdate = self.pending
+                self.pending = None
+                self.isPushing = True
+
+            try:
+                self.push(backstoryUpdate)
+            except Exception as e:
+                log(f"An error occurred while syncing the character backstory: {e}", warning=True)
+            finally:
+                with self.cond:
+                    self.isPushing = False
+                    self.cond.notify_all()
+
+    def push(self, backstoryUpdate):
+        '''
+        Pushes the backstory unless it matches what was last pushed.
+        '''
+        newBackstory = buildBackstory(backstoryUpdate)
+        if not newBackstory:
+            return
+        backstoryHash = hashlib.sha256(newBackstory.encode('utf-8')).hexdigest()
+        if backstoryHash == self.lastPushedHash:
+            log('Backstory unchanged, skipping update')
+            return
+        if updateCharBackstory(newBackstory):
+            self.lastPushedHash = backstoryHash
+
+    def waitIdle(self, timeout=None):
+        '''
+        Waits until nothing is pending or being pushed.
+
+        Returns:
+            bool: False on timeout
+        '''
+        with self.cond:
+            return self.cond.wait_for(lambda: self.pending is None and not self.isPushing, timeout)
 
 # ------------------------------------------------------------------------------------
 # ConvaiBackend class is a singleton class that derives from PyQt5.QtCore.QObject.
@@ -120,6 +235,7 @@ class ConvaiBackend(QObject):
     updateBtnTextSignal = pyqtSignal(str)  
     setBtnEnabledSignal = pyqtSignal(bool)
     isSendingAudSignal = pyqtSignal(bool)
+    readySignal = pyqtSignal(dict) # warm up results, see warmUp
 
     @staticmethod
     def getInstance():
@@ -134,6 +250,8 @@ class ConvaiBackend(QObject):
         '''
         Initializes the ConvaiBackend class.
         Enforces the singleton pattern.
+        Only cheap setup happens here, audio devices, A2F and the gRPC channel
+        are brought up in the background by warmUp.
         '''
         super().__init__()
         if ConvaiBackend._instance is not None:
@@ -143,24 +261,123 @@ class ConvaiBackend(QObject):
         
         self.initVars()
         self.readConfig()
-        self.createChannel()
 
         log('ConvaiBackend initialized')
 
+    def warmUp(self):
+        '''
+        Starts bringing up PyAudio, the A2F connection and the gRPC channel
+        concurrently on background threads, if that didn't happen yet.
+        readySignal is emitted and readyEvent set once all of them are done.
+        '''
+        with self.warmUpLock:
+            if self.warmUpThread is not None:
+                return
+            self.warmUpThread = threading.Thread(target=self.warmUpLoop, daemon=True)
+            self.warmUpThread.start()
+
+    def warmUpLoop(self):
+        '''
+        Runs the warm up tasks concurrently and reports how they went.
+        '''
+        start = time.perf_counter()
+        tasks = {'audio': self.ensureAudio, 'a2f': self.checkA2FConnection, 'channel': self.prepareChannel}
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix='convai-warmup') as executor:
+            futures = {name: executor.submit(task) for name, task in tasks.items()}
+            for name, future in futures.items():
+                try:
+                    results[name] = bool(future.result())
+                except Exception as e:
+                    log(f'Warm up of {name} failed: {e}', 1)
+                    results[name] = False
+
+        if results['audio']:
+            self.initLocalAudPlayer()
+        results['ms'] = (time.perf_counter() - start) * 1000
+        log(f"Warmed up in {results['ms']:.0f}ms: {results}")
+        self.readyEvent.set()
+        self.readySignal.emit(results)
+
+    def ensureAudio(self):
+        '''
+        Brings up audio if that didn't work yet, during warm up and again on the next start
+        if it failed then, e.g. because the device was busy or unplugged.
+
+        Returns:
+            bool: Whether there's an input device to talk into
+        '''
+        if self.isAudioReady:
+            return True
+        if self.pyAudio: # from a try that found no microphone
+            self.pyAudio.terminate()
+            self.pyAudio = None
+        try:
+            self.isAudioReady = bool(self.initAudio())
+        except Exception as e:
+            log(f'Audio could not be initialized: {e}', 1)
+            self.errorSignal.emit(f'Audio could not be initialized: {e}')
+        return self.isAudioReady
+
+    def initAudio(self):
+        '''
+        Creates the PyAudio instance and looks up the default audio devices.
+
+        Returns:
+            bool: Whether there's an input device to talk into
+        '''
+        self.pyAudio = pyaudio.PyAudio()
+        try:
+            inputInfo = self.pyAudio.get_default_input_device_info()
+            log(f"Microphone: {inputInfo['name']}")
+        except IOError:
+            log('No microphone found', 1)
+            self.errorSignal.emit('No microphone found')
+            return False
+        try:
+            log(f"Speaker: {self.pyAudio.get_default_output_device_info()['name']}")
+        except IOError:
+            log('No speaker found, audio only plays through A2F', 1)
+        return True
+
+    def prepareChannel(self):
+        '''
+        Creates the gRPC channel and starts connecting it ahead of the first request.
+        Readiness doesn't wait for the connection, see waitForChannel.
+
+        Returns:
+            bool: Whether the channel was created
+        '''
+        self.createChannel()
+        threading.Thread(target=self.waitForChannel, args=(self.channel,), daemon=True).start()
+        return True
+
+    def waitForChannel(self, channel):
+        '''
+        Makes the channel connect (TLS handshake included) and logs the outcome.
+        '''
+        start = time.perf_counter()
+        readyFuture = grpc.channel_ready_future(channel)
+        try:
+            readyFuture.result(timeout=CHANNEL_READY_TIMEOUT)
+            log(f'gRPC channel connected in {(time.perf_counter() - start) * 1000:.0f}ms')
+        except grpc.FutureTimeoutError:
+            readyFuture.cancel()
+            log(f'gRPC channel not connected after {CHANNEL_READY_TIMEOUT}s, it connects on the first request', 1)
+
     def initVars(self):
         '''
         Initializes the class variables.
         '''
         self.localAudPlayer = None
+        self.responseStage = ResponseStage(self.onDataReceived) # decoding & queueing off the gRPC thread
 
-        self.audQueue = deque(maxlen=4096 * 8)
-        self.audSocket = None
-        self.cntrlSocket = None
-        self.audSocketThread = None
+        self.jitterBuffer = JitterBuffer() # configured in readConfig
+        self.playoutThread = None
         self.a2fHst = 'localhost'
         self.a2fPrt = 65432 # port for audio data
-        self.cntrlPrt = 65433 # port to stop the stream
-        self.audQueueCondition = threading.Condition()
+        self.cntrlPrt = 65433 # port to stop the stream & ping
+        self.a2f = A2FConnection(self.a2fHst, self.a2fPrt, self.cntrlPrt) # connected in warmUp
 
         self.isCapturingAudio = False
         self.channelAddress = None
@@ -168,113 +385,113 @@ class ConvaiBackend(QObject):
         self.sessionId = None
         self.client = None
         self.convaiGRPCGetResponseProxy = None
-        self.pyAudio = pyaudio.PyAudio()
+        self.pyAudio = None # created in warmUp
+        self.isAudioReady = False # set once there's a microphone to talk into, see ensureAudio
         self.stream = None
         self.tick = False
         self.tickThread = None
         self.ResponseTextBuffer = ''
+        self.isInterrupted = False # set when the user stops shakespeare mid response
         self.OldCharacterID = ''
 
         self.uiLock = threading.Lock()
         self.micLock = threading.Lock()    
 
-        self.isA2fConnected = self.checkA2FConnection()
+        self.warmUpThread = None
+        self.warmUpLock = threading.Lock()
+        self.readyEvent = threading.Event()
 
     def initLocalAudPlayer(self):
         '''
         Initializes the LocalAudioPlayer object.
         '''
         if not self.localAudPlayer:
-            self.localAudPlayer = LocalAudioPlayer()
+            self.localAudPlayer = LocalAudioPlayer(self.pyAudio)
     
     def destroyLocalAudPlayer(self):
         '''
         Destroys the LocalAudioPlayer object.
         '''
         if self.localAudPlayer:
-            self.localAudPlayer.isPlaying = False
+            elapsed = self.localAudPlayer.stop()
+            log(f'Local audio stopped in {elapsed * 1000:.1f}ms')
             self.localAudPlayer = None
 
     def checkA2FConnection(self):
         '''
         Checks if the A2F server is running and can be connected to.
+        Either way the connection manager keeps (re)connecting in the background from here on.
         '''
-        try:
-            self.connectToA2F()
-            self.connectCntrlSocket()
+        isConnected = self.a2f.connect()
+        self.a2f.start()
+        if isConnected:
             log('A2F connection successful')
-            self.initLocalAudPlayer()
-            return True
-        except Exception as e:
-            log(f'Failed to connect to A2F: {e}', 1)
-            return False
+        else:
+            log('A2F not reachable, playing audio locally until it is', 1)
+        return isConnected
 
-    def connectToA2F(self):
+    @property
+    def isA2fConnected(self):
         '''
-        Connects to the Audio2Face server's audio socket.
-        Raises an exception if the connection fails.
+        Whether audio goes to A2F, which stays the case for a short while after
+        losing the connection so the utterance can be replayed on reconnect.
         '''
-        try:
-            self.audSocket = socket(AF_INET, SOCK_STREAM)
-            self.audSocket.connect((self.a2fHst, self.a2fPrt))
-            self.audSocketThread = threading.Thread(target=self.audioSocketLoop)
-            self.audSocketThread.daemon = True
-            self.audSocketThread.start()
-            log('Connected to A2F audio socket')
-        except Exception as e:
-            self.audSocket = None
-            raise Exception(f'Error connecting to A2F: {e}')
+        return self.a2f.isAvailable
 
-    def connectCntrlSocket(self):
+    def startPlayout(self):
         '''
-        Connects to the Audio2Face server's control socket.
-        Meant to send control signals to the A2F server.
+        Starts the playout thread that drains the jitter buffer, if not already running.
         '''
-        try:
-            self.cntrlSocket = socket(AF_INET, SOCK_STREAM)
-            self.cntrlSocket.connect((self.a2fHst, self.cntrlPrt))
-            log('Connected to control socket')
-        except Exception as e:
-            log(f'Error connecting to control socket: {e}', 1)
-            self.cntrlSocket = None
+        if self.playoutThread and self.playoutThread.is_alive():
+            return
+        self.playoutThread = threading.Thread(target=self.playoutLoop, daemon=True)
+        self.playoutThread.start()
 
-    def audioSocketLoop(self):
+    def playoutLoop(self):
         '''
-        Main loop to send audio data to the A2F server.
-        Uses struct.pack to pack the audio data with the sample rate.
+        Main loop that takes audio released by the jitter buffer,
+        and sends it to A2F or plays it locally.
         '''
         while True:
-            try:
-                with self.audQueueCondition:
-                    while not self.audQueue:
-                        log('Waiting for audio data...')
-                        self.audQueueCondition.wait()
-
-                    while self.audQueue:
-                        wavData, sampleRate = self.audQueue.popleft()
-                        message = pack('>i', sampleRate) + b'|' + wavData
-                        message_length = len(message)
-                        
-                        log(f'Sending message length: {message_length}')
-                        self.audSocket.sendall(pack('>i', message_length) + message)
-                        log('Audio chunk sent')
+            pcmData, sampleRate, isFinal = self.jitterBuffer.get()
 
-            except Exception as e:
-                log(f'Error sending audio data: {e}', 1)
-                self.audSocket.close()
-                self.audSocket = None 
-                break 
+            if self.isInterrupted:
+                continue
+            elif self.isA2fConnected:
+                if not self.a2f.sendAudio(pcmData, sampleRate, isFinal):
+                    log('A2F is reconnecting, holding the audio chunk for replay', 1)
+            elif self.localAudPlayer:
+                self.localAudPlayer.addAudio(pcmData, sampleRate)
+            trace.mark('playout')
+
+            if isFinal:
+                trace.mark('playoutFinal')
+                log(f'Jitter buffer stats: {self.jitterBuffer.getStats()}')
+
+    def getAudioStats(self):
+        '''
+        Returns:
+            dict: Response stage timings, jitter buffer, A2F connection and local playback statistics
+        '''
+        return {
+            'stages': self.responseStage.timer.summary(),
+            'jitterBuffer': self.jitterBuffer.getStats(),
+            'a2f': self.a2f.getStats(),
+            'localSlowFlushes': self.localAudPlayer.slowFlushes if self.localAudPlayer else 0
+        }
 
     def readConfig(self):
         '''
         Again, reads the API configuration.
         '''
-        config = configparser.ConfigParser()
-        config.read(os.path.join(__location__, 'convai.env'))
+        config = configcache.loadConfig(os.path.join(__location__, 'convai.env'))
 
         self.apiKey = config.get('CONVAI', 'API_KEY')
         self.charId = config.get('CONVAI', 'CHARACTER_ID')
         self.channelAddress = config.get('CONVAI', 'CHANNEL')
+        self.isChannelInsecure = config.getboolean('CONVAI', 'INSECURE', fallback=False) # e.g. for the local stand-in
+        self.jitterBuffer.configure(config.getint('CONVAI', 'JITTER_MIN_START_MS', fallback=150),
+                                    config.getint('CONVAI', 'JITTER_MAX_TARGET_MS', fallback=1000))
 
     def createChannel(self):
         '''
@@ -284,8 +501,12 @@ class ConvaiBackend(QObject):
             log('gRPC channel already created')
             return
 
-        self.channel = grpc.secure_channel(self.channelAddress, grpc.ssl_channel_credentials())
-        log('Created gRPC channel')
+        if self.isChannelInsecure:
+            self.channel = grpc.insecure_channel(self.channelAddress)
+            log(f'Created insecure gRPC channel to {self.channelAddress}')
+        else:
+            self.channel = grpc.secure_channel(self.channelAddress, grpc.ssl_channel_credentials())
+            log('Created gRPC channel')
 
     def closeChannel(self):
         '''
@@ -311,29 +532,24 @@ class ConvaiBackend(QObject):
         Starts the Convai conversation in a separate thread.
         '''
         self.updateBtnText('Stop')
+        self.isInterrupted = False
+        self.warmUp() # no-op if it already ran at app start
+        if not self.readyEvent.is_set():
+            log('Waiting for the backend to warm up')
+            self.readyEvent.wait()
+        if not self.ensureAudio(): # errorSignal told the user why
+            self.updateBtnText('Start Talking')
+            return
         self.initLocalAudPlayer()
         
         self.startMic()
         self.convaiGRPCGetResponseProxy = ConvaiGRPCGetResponseProxy(self)
-        
-        if not self.audSocket:
-            try:
-                self.connectToA2F()
-            except Exception as e:
-                log(f'Failed to connect to A2F: {e}. Will play audio locally.', 1)
-        
-        if not self.cntrlSocket:
-            try:
-                self.connectCntrlSocket()
-            except Exception as e:
-                log(f'Failed to connect control socket: {e}', 1)
-
-        
 
     def stopConvai(self):
         '''
         Stops the Convai conversation and audio streaming.
         '''
+        trace.mark('micRelease')
         self.updateBtnText('Processing...')
         self.setBtnEnabled(False)
         self.isSendingAudSignal.emit(True)
@@ -342,35 +558,48 @@ class ConvaiBackend(QObject):
 
     def stopShakespeare(self):
         '''
-        Sends a stop signal to the A2F server through the control socket.
+        Interrupts the current response, drops everything still in flight
+        and sends a stop signal to the A2F server through the control socket.
         '''
+        self.isInterrupted = True
+        dropped = self.responseStage.flush() + self.jitterBuffer.flush()
+        log(f'Dropped {dropped} pending audio chunks')
+
         if self.isA2fConnected:
             threading.Thread(target=self.stopShakespeareThreadA2F, daemon=True).start()
         else:
             log('A2F connection not established. Stopping audio locally.')
-            self.destroyLocalAudPlayer()
-            self.isSendingAudSignal.emit(False)   
+            threading.Thread(target=self.stopShakespeareThreadLocal, daemon=True).start()
+
+    def flushLocalAudPlayer(self):
+        '''
+        Silences the LocalAudioPlayer while keeping its output streams open.
+
+        Returns:
+            float: Seconds it took until the output went silent
+        '''
+        if not self.localAudPlayer:
+            return 0.
+        elapsed = self.localAudPlayer.flush()
+        log(f'Local audio stopped in {elapsed * 1000:.1f}ms')
+        return elapsed
+
+    def stopShakespeareThreadLocal(self):
+        '''
+        Flushes the LocalAudioPlayer in a separate thread, it waits on the output device.
+        '''
+        self.flushLocalAudPlayer()
+        self.isSendingAudSignal.emit(False)
 
     def stopShakespeareThreadA2F(self):
         '''
         Starts the stop shakespeare method in a separate thread for A2F.
         '''
-        try:
-            if self.cntrlSocket:
-                self.cntrlSocket.sendall(b'stop')
-                log('Sent stop signal to A2F')
-                response = self.cntrlSocket.recv(7) # waiting for 'stopped' 
-                if response == b'stopped':          # from A2F
-                    log('Received confirmation of stop from A2F')
-            if self.audSocket:
-                self.audSocket.close()
-                self.audSocket = None
-                log('Closed audio socket')
-            self.isSendingAudSignal.emit(False)
-        except Exception as e:
-            log(f'Error sending stop signal to A2F: {e}', 1)
-        finally:
-            self.cntrlSocket = None
+        if self.a2f.stop():
+            log('A2F stopped')
+        else:
+            log('A2F did not confirm the stop', 1)
+        self.isSendingAudSignal.emit(False)
 
     def startMic(self):
         '''
@@ -380,15 +609,24 @@ class ConvaiBackend(QObject):
             log('startMic - mic is already capturing audio', 1)
             return
 
-        self.stream = self.pyAudio.open(format=FORMAT,
-                                        channels=CHANNELS,
-                                        rate=RATE,
-                                        input=True,
-                                        frames_per_buffer=CHUNK)
+        self.stream = self.openInputStream()
         self.isCapturingAudio = True
         self.startTick()
         log('startMic - Started Recording')
 
+    def openInputStream(self):
+        '''
+        Opens the microphone, anything with read / stop_stream / close works in its place.
+
+        Returns:
+            pyaudio.Stream: The input stream
+        '''
+        return self.pyAudio.open(format=FORMAT,
+                                 channels=CHANNELS,
+                                 rate=RATE,
+                                 input=True,
+                                 frames_per_buffer=CHUNK)
+
     def stopMic(self):
         '''
         Stops capturing audio from the microphone.
@@ -421,26 +659,24 @@ class ConvaiBackend(QObject):
     def onDataReceived(self, receivedText: str, receivedAudio: bytes, SampleRate: int, isFinal: bool):
         '''
         Handles the received audio data from the Convai server.
-        Streams to A2F if connected, otherwise plays locally using LocalAudioPlayer.
+        Decodes it and hands it to the jitter buffer, the playout loop then
+        streams it to A2F if connected, otherwise plays it locally using LocalAudioPlayer.
+        Runs on the response stage's worker thread, not on the gRPC thread.
         '''
         try:
+            if self.isInterrupted:
+                log('Dropping audio data, response was interrupted')
+                return
+            trace.mark('dataReceived')
             log(f'Received audio data: length={len(receivedAudio)}, sample_rate={SampleRate}')
-            if self.audSocket:
-                segment = AudioSegment.from_wav(BytesIO(receivedAudio)).fade_in(10).fade_out(10)
-                
-                wavBuffer = BytesIO()
-                segment.export(wavBuffer, format='wav')
-                wavData = wavBuffer.getvalue()
-                
-                with self.audQueueCondition:
-                    self.audQueue.append((wavData, SampleRate))
-                    log(f'Added audio chunk to queue. Queue size: {len(self.audQueue)}')
-                    self.audQueueCondition.notify()
-                log(f'Processed audio: length={len(segment)}, channels={segment.channels}, sample_width={segment.sample_width}, frame_rate={segment.frame_rate}')
-            elif not self.isA2fConnected:
-                log('A2F connection not established. Playing audio locally.')
-                if self.localAudPlayer:                            
-                    self.localAudPlayer.addAudio(receivedAudio, SampleRate)
+            fmt, pcm = wavreader.readPcm(receivedAudio, SampleRate)
+            if fmt.sampleRate != SampleRate:
+                log(f'WAV header sample rate {fmt.sampleRate} differs from reported {SampleRate}', 1)
+
+            pcmData = bytes(wavreader.fadeEdges(pcm, fmt, 10))
+            self.jitterBuffer.put(pcmData, fmt.sampleRate, isFinal)
+            self.startPlayout()
+            log(f'Processed audio: length={len(pcmData)}, channels={fmt.channels}, sample_width={fmt.sampleWidth}, frame_rate={fmt.sampleRate}')
         
         except Exception as e:
             log(f'Error in onDataReceived: {e}', 1)  
@@ -585,17 +821,20 @@ class ConvaiGRPCGetResponseProxy:
         try:
             for response in self.client.GetResponse(self.createGetResponseRequests()):
                 if response.HasField('audio_response'):
+                    trace.mark('firstResponse')
                     log(
                         'gRPC - audio_response: {} {} {}'.format(response.audio_response.audio_config,
                                                                 response.audio_response.text_data,
                                                                 response.audio_response.end_of_response))
                     log('gRPC - session_id: {}'.format(response.session_id))
+                    receiveStart = time.perf_counter()
                     self.parent.onSessionIdReceived(response.session_id)
-                    self.parent.onDataReceived(
+                    self.parent.responseStage.submit(
                         response.audio_response.text_data,
                         response.audio_response.audio_data,
                         response.audio_response.audio_config.sample_rate_hertz,
                         response.audio_response.end_of_response)
+                    self.parent.responseStage.timer.add('receive', time.perf_counter() - receiveStart)
                     
                     log('Received sample rate: ', response.audio_response.audio_config.sample_rate_hertz)
                 else:
@@ -608,7 +847,7 @@ class ConvaiGRPCGetResponseProxy:
         self.parent.onFin()
 
 
-    def createInitGetResponseRequest(self) -> convaiServiceMsg.GetResponseRequest:
+    def createInitGetResponseRequest(self) -> 'convaiServiceMsg.GetResponseRequest':
         '''
         Intializes the GetResponse request with the config data.
 
@@ -628,7 +867,7 @@ class ConvaiGRPCGetResponseProxy:
         
         return convaiServiceMsg.GetResponseRequest(get_response_config=getResponseConfig) # req object
 
-    def createGetResponseRequests(self) -> Generator[convaiServiceMsg.GetResponseRequest, None, None]:
+    def createGetResponseRequests(self) -> Generator['convaiServiceMsg.GetResponseRequest', None, None]:
         '''
         Generator fn to yield GetResponseRequest for the gRPC stream.
         '''
@@ -646,6 +885,8 @@ class ConvaiGRPCGetResponseProxy:
             GetResponseData = convaiServiceMsg.GetResponseRequest.GetResponseData(audio_data=data)
 
             req = convaiServiceMsg.GetResponseRequest(get_response_data=GetResponseData)
+            if isThisTheFinalWrite:
+                trace.mark('finalWrite')
             yield req
 
             if isThisTheFinalWrite:
@@ -0,0 +1,191 @@
+# ------------------------------------------------------------------------------
+# Jitter buffer for the audio streamed back by Convai.
+# Holds back the start of every utterance until a target depth is buffered,
+# then releases chunks to the sink (A2F socket or local player) as they come.
+# A virtual playout clock tracks when the sink would run dry, so chunks that
+# arrive after that point are counted as underruns and the target depth grows.
+# ------------------------------------------------------------------------------
+
+import threading, time
+from collections import deque
+
+def log(text: str, warning: bool = False):
+    print(f"[JitterBuffer] {'[Warning]' if warning else ''} {text}")
+
+class JitterBuffer:
+    '''
+    Thread safe jitter buffer for 16 bit PCM chunks with a fast-start threshold
+    and an adaptive target depth.
+    '''
+    def __init__(self, minStartMs=150, maxTargetMs=1000, lateMarginMs=50):
+        '''
+        Args:
+            minStartMs (int): Audio buffered before an utterance starts playing
+            maxTargetMs (int): Upper bound for the adaptive target depth
+            lateMarginMs (int): Chunks arriving closer than this to their deadline count as late
+        '''
+        self.minStart = minStartMs / 1000
+        self.maxTarget = max(maxTargetMs, minStartMs) / 1000
+        self.lateMargin = lateMarginMs / 1000
+        self.target = self.minStart
+
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.bufferedSec = 0.
+        self.isBuffering = True
+        self.hasFinal = False
+        self.playoutEnd = None # perf_counter time at which the sink runs out of audio
+        self.firstArrival = None
+        self.lastArrival = None
+        self.lastDuration = 0.
+        self.jitter = 0.
+        self.hadUnderrun = False
+        self.resetStats()
+
+    def resetStats(self):
+        '''
+        Clears the accumulated statistics.
+        '''
+        self.stats = {
+            'chunks': 0,
+            'utterances': 0,
+            'lateChunks': 0,
+            'underruns': 0,
+            'underrunMs': 0.,
+            'maxDepthMs': 0.,
+            'lastStartDelayMs': 0.
+        }
+
+    def configure(self, minStartMs, maxTargetMs):
+        '''
+        Updates the start threshold and the target bound, e.g. after reading the config.
+        '''
+        with self.cond:
+            self.minStart = minStartMs / 1000
+            self.maxTarget = max(maxTargetMs, minStartMs) / 1000
+            self.target = min(max(self.target, self.minStart), self.maxTarget)
+
+    def put(self, pcm: bytes, sampleRate: int, isFinal: bool):
+        '''
+        Adds a chunk of 16 bit mono PCM.
+
+        Args:
+            pcm (bytes): The PCM data
+            sampleRate (int): Sample rate of the chunk
+            isFinal (bool): Whether this is the last chunk of the utterance
+        '''
+        now = time.perf_counter()
+        duration = len(pcm) / (2 * sampleRate) if sampleRate else 0.
+
+        with self.cond:
+            if self.lastArrival is not None: # RFC 3550 style interarrival jitter
+                deviation = abs((now - self.lastArrival) - self.lastDuration)
+                self.jitter += (deviation - self.jitter) / 16
+            else:
+                self.firstArrival = now
+            self.lastArrival = now
+            self.lastDuration = duration
+
+            if not self.isBuffering and self.playoutEnd is not None and duration:
+                slack = self.playoutEnd - now
+                if slack < self.lateMargin:
+                    self.stats['lateChunks'] += 1
+                if slack < 0 and not self.items: # sink ran dry, this gap was audible
+                    self.stats['underruns'] += 1
+                    self.stats['underrunMs'] += -slack * 1000
+                    self.hadUnderrun = True
+                    self.target = min(self.maxTarget, self.target - slack + self.jitter)
+                    self.isBuffering = True # rebuffer up to the new target
+                    self.bufferedSec = 0.
+                    log(f'Underrun of {-slack * 1000:.0f}ms, target depth now {self.target * 1000:.0f}ms', warning=True)
+
+            self.items.append((pcm, sampleRate, isFinal, duration))
+            self.bufferedSec += duration
+            self.hasFinal = self.hasFinal or isFinal
+            self.stats['chunks'] += 1
+            self.stats['maxDepthMs'] = max(self.stats['maxDepthMs'], self.bufferedSec * 1000)
+
+            if self.isBuffering and (self.bufferedSec >= self.currentTarget() or self.hasFinal):
+                self.isBuffering = False
+                if self.playoutEnd is None:
+                    self.stats['lastStartDelayMs'] = (now - self.firstArrival) * 1000
+            self.cond.notify_all()
+
+    def currentTarget(self):
+        '''
+        Target depth, never below the start threshold plus twice the measured jitter.
+        '''
+        return min(self.maxTarget, max(self.target, self.minStart + 2 * self.jitter))
+
+    def get(self, timeout=None):
+        '''
+        Blocks until a chunk may be played.
+
+        Args:
+            timeout (float): Seconds to wait, None waits forever
+
+        Returns:
+            tuple[bytes, int, bool] | None: (pcm, sampleRate, isFinal) or None on timeout
+        '''
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items and not self.isBuffering, timeout):
+                return None
+
+            pcm, sampleRate, isFinal, duration = self.items.popleft()
+            self.bufferedSec = self.bufferedSec - duration if self.items else 0.
+
+            now = time.perf_counter()
+            if self.playoutEnd is None or self.playoutEnd < now:
+                self.playoutEnd = now
+            self.playoutEnd += duration
+
+            if isFinal:
+                self.endUtterance()
+            return pcm, sampleRate, isFinal
+
+    def endUtterance(self):
+        '''
+        Resets the per-utterance state and relaxes the target depth
+        if the utterance played without gaps. The next utterance fills up to
+        the target again, chunks of it that are already queued count towards it.
+        '''
+        if not self.hadUnderrun:
+            self.target = max(self.minStart, self.target * .9)
+        self.stats['utterances'] += 1
+        self.hasFinal = any(item[2] for item in self.items)
+        self.playoutEnd = None # the sink runs dry between utterances
+        self.firstArrival = None
+        self.lastArrival = None
+        self.hadUnderrun = False
+        self.isBuffering = not (self.items and (self.bufferedSec >= self.currentTarget() or self.hasFinal))
+
+    def flush(self):
+        '''
+        Drops everything that is buffered and resets the utterance state.
+
+        Returns:
+            int: Number of dropped chunks
+        '''
+        with self.cond:
+            dropped = len(self.items)
+            self.items.clear()
+            self.bufferedSec = 0.
+            self.isBuffering = True
+            self.hasFinal = False
+            self.playoutEnd = None
+            self.firstArrival = None
+            self.lastArrival = None
+            self.hadUnderrun = False
+            return dropped
+
+    def getStats(self):
+        '''
+        Returns:
+            dict: Late chunk / underrun counters and the current depth, target and jitter
+        '''
+        with self.cond:
+            stats = dict(self.stats)
+            stats['depthMs'] = self.bufferedSec * 1000
+            stats['targetMs'] = self.currentTarget() * 1000
+            stats['jitterMs'] = self.jitter * 1000
+            return stats
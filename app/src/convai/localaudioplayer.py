@@ -1,46 +1,209 @@
-import threading
-from queue import Queue
-from pydub import AudioSegment, playback
-from io import BytesIO
+# ------------------------------------------------------------------------------
+# Local fallback player, used when Audio2Face isn't reachable.
+# Keeps one long-lived PyAudio output stream per sample rate, fed from a
+# ring buffer through the stream callback, so consecutive chunks play
+# back to back without spawning a player or reopening the device per chunk.
+# ------------------------------------------------------------------------------
+
+import threading, time
+from common import lazyImport
+
+pyaudio = lazyImport('pyaudio')
+
+SAMPLE_WIDTH = 2 # 16 bit mono PCM
+FRAMES_PER_BUFFER = 1024
+BUFFER_SECONDS = 30
+
+def log(text: str, warning: bool = False):
+    print(f"[LocalAudioPlayer] {'[Warning]' if warning else ''} {text}")
+
+class RingBuffer:
+    '''
+    Fixed size byte ring buffer for one producer and one consumer.
+    Writes block while the buffer is full, reads never block.
+    Every clear starts a new generation, so that a pending write is abandoned
+    and the clearing thread can wait for the reader to have seen the clear.
+    '''
+    def __init__(self, capacity: int):
+        self.buffer = bytearray(capacity)
+        self.capacity = capacity
+        self.readPos = 0
+        self.size = 0
+        self.generation = 0
+        self.readGeneration = 0
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        return self.size
+
+    def write(self, data, timeout=None):
+        '''
+        Writes all of data, waiting for the reader to make room if needed.
+
+        Returns:
+            int: Number of bytes written, less than len(data) on timeout or clear
+        '''
+        data = memoryview(data)
+        written = 0
+        with self.cond:
+            generation = self.generation
+            while written < len(data):
+                if not self.cond.wait_for(lambda: self.size < self.capacity or self.generation != generation, timeout):
+                    break
+                if self.generation != generation: # cleared while waiting for room
+                    break
+                writePos = (self.readPos + self.size) % self.capacity
+                count = min(len(data) - written, self.capacity - self.size, self.capacity - writePos)
+                self.buffer[writePos:writePos + count] = data[written:written + count]
+                self.size += count
+                written += count
+        return written
+
+    def read(self, count: int):
+        '''
+        Reads up to count bytes.
+        '''
+        with self.cond:
+            count = min(count, self.size)
+            end = self.readPos + count
+            if end <= self.capacity:
+                data = bytes(self.buffer[self.readPos:end])
+            else:
+                data = bytes(self.buffer[self.readPos:]) + bytes(self.buffer[:end - self.capacity])
+            self.readPos = end % self.capacity
+            self.size -= count
+            self.readGeneration = self.generation
+            self.cond.notify_all()
+            return data
+
+    def clear(self):
+        '''
+        Drops all buffered data.
+        '''
+        with self.cond:
+            self.readPos = 0
+            self.size = 0
+            self.generation += 1
+            self.cond.notify_all()
+
+    def waitForReader(self, timeout):
+        '''
+        Waits until the reader has read since the last clear.
+
+        Returns:
+            bool: False if the reader didn't show up within the timeout
+        '''
+        with self.cond:
+            return self.cond.wait_for(lambda: self.readGeneration == self.generation, timeout)
 
 class LocalAudioPlayer:
-    def __init__(self):
-        self.audioQueue = Queue()
-        self.playThread = None
-        self.isPlaying = False
-        self.currentAudio = None
-
-    def start(self):
-        if not self.playThread or not self.playThread.is_alive():
-            self.isPlaying = True
-            self.playThread = threading.Thread(target=self._playAudioLoop)
-            self.playThread.daemon = True
-            self.playThread.start()
-
-    def addAudio(self, audioData: bytes, sampleRate: int):
-        audio = AudioSegment(
-            audioData,
-            sample_width=2,
-            channels=1,
-            frame_rate=sampleRate
-        )
-        audio = audio.fade_in(25).fade_out(25)
-        self.audioQueue.put(audio)
-        
-        if not self.isPlaying:
-            self.start()
-
-    def _playAudioLoop(self):
-        while self.isPlaying:
-            try:
-                if self.currentAudio is None:
-                    self.currentAudio = self.audioQueue.get(timeout=1)
-                
-                if self.currentAudio:
-                    playback.play(self.currentAudio)
-                    self.currentAudio = None
-                
-            except Queue.empty:
-                continue
-            except Exception as e:
-                print(f"Error playing audio: {e}")
\ No newline at end of file
+    '''
+    Gapless local playback of 16 bit mono PCM.
+    '''
+    def __init__(self, pyAudio=None):
+        '''
+        Args:
+            pyAudio (pyaudio.PyAudio): Shared PyAudio instance, a new one is created if None
+        '''
+        self.ownsPyAudio = pyAudio is None
+        self.pyAudio = pyAudio or pyaudio.PyAudio()
+        self.streams = {} # sample rate -> (output stream, ring buffer)
+        self.lock = threading.Lock()
+        self.slowFlushes = 0 # flushes a device callback took longer than two buffer periods to pick up
+
+    @property
+    def isPlaying(self):
+        '''
+        Whether any audio is still waiting to be played.
+        '''
+        return any(len(ring) for _, ring in self.streams.values())
+
+    def getRing(self, sampleRate: int):
+        '''
+        Gets the ring buffer for the sample rate, opening its output stream on first use.
+        '''
+        with self.lock:
+            if sampleRate not in self.streams:
+                ring = RingBuffer(sampleRate * SAMPLE_WIDTH * BUFFER_SECONDS)
+                stream = self.pyAudio.open(format=pyaudio.paInt16,
+                                           channels=1,
+                                           rate=sampleRate,
+                                           output=True,
+                                           frames_per_buffer=FRAMES_PER_BUFFER,
+                                           stream_callback=self.makeCallback(ring))
+                stream.start_stream()
+                self.streams[sampleRate] = (stream, ring)
+                log(f'Opened output stream at {sampleRate} Hz')
+            return self.streams[sampleRate][1]
+
+    def makeCallback(self, ring: RingBuffer):
+        '''
+        Creates the PyAudio callback that pulls from the ring buffer,
+        padding with silence when it runs dry so the stream never stops.
+        '''
+        def callback(inData, frameCount, timeInfo, status):
+            needed = frameCount * SAMPLE_WIDTH
+            data = ring.read(needed)
+            if len(data) < needed:
+                data += bytes(needed - len(data))
+            return data, pyaudio.paContinue
+        return callback
+
+    def addAudio(self, audioData, sampleRate: int):
+        '''
+        Queues 16 bit mono PCM for playback.
+        The RIFF header must already be stripped, see wavreader.readPcm.
+        '''
+        try:
+            self.getRing(sampleRate).write(audioData)
+        except Exception as e:
+            log(f'Error playing audio: {e}', warning=True)
+
+    def flush(self):
+        '''
+        Drops all queued audio and waits until every output stream
+        has moved on to silence, which takes at most one buffer period.
+        The streams stay open, so playback can resume instantly.
+        Blocks for up to two buffer periods per stream, so keep it off the GUI thread.
+
+        Returns:
+            float: Seconds it took until the output went silent
+        '''
+        start = time.perf_counter()
+        with self.lock:
+            streams = list(self.streams.items())
+        for sampleRate, (_, ring) in streams:
+            ring.clear()
+        for sampleRate, (_, ring) in streams:
+            bufferPeriod = FRAMES_PER_BUFFER / sampleRate
+            if not ring.waitForReader(timeout=2 * bufferPeriod): # a busy device, counted rather than logged
+                self.slowFlushes += 1
+        return time.perf_counter() - start
+
+    def stop(self):
+        '''
+        Drops all queued audio and aborts the output streams,
+        discarding what the device has buffered as well.
+
+        Returns:
+            float: Seconds it took to stop
+        '''
+        start = time.perf_counter()
+        with self.lock:
+            for stream, ring in self.streams.values():
+                ring.clear()
+                try:
+                    stream.abort_stream() # unlike stop_stream, doesn't play out pending buffers
+                    stream.close()
+                except Exception as e:
+                    log(f'Error closing output stream: {e}', warning=True)
+            self.streams.clear()
+        return time.perf_counter() - start
+
+    def close(self):
+        '''
+        Stops all output streams and releases PyAudio if this player created it.
+        '''
+        self.stop()
+        if self.ownsPyAudio:
+            self.pyAudio.terminate()
@@ -0,0 +1,143 @@
+# ------------------------------------------------------------------------------
+# Response processing stage that sits between the gRPC receive thread and the
+# audio sinks. Responses are handed over through a bounded queue and processed,
+# in order, on a dedicated worker thread so that decoding / DSP never blocks
+# the thread pulling the next message off the wire.
+# ------------------------------------------------------------------------------
+
+import threading, time
+from queue import Queue, Full, Empty
+
+def log(text: str, warning: bool = False):
+    print(f"[ResponseStage] {'[Warning]' if warning else ''} {text}")
+
+class StageTimer:
+    '''
+    Collects per-stage timing samples (in seconds) and summarizes them.
+    '''
+    def __init__(self, maxSamples=1024):
+        '''
+        Args:
+            maxSamples (int): Number of most recent samples kept per stage
+        '''
+        self.maxSamples = maxSamples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        '''
+        Records a timing sample for the given stage.
+        '''
+        with self.lock:
+            stageSamples = self.samples.setdefault(stage, [])
+            stageSamples.append(seconds)
+            if len(stageSamples) > self.maxSamples:
+                del stageSamples[0]
+
+    def summary(self):
+        '''
+        Returns:
+            dict: count / mean / p95 / max in milliseconds for every stage
+        '''
+        with self.lock:
+            result = {}
+            for stage, stageSamples in self.samples.items():
+                ordered = sorted(stageSamples)
+                count = len(ordered)
+                result[stage] = {
+                    'count': count,
+                    'meanMs': sum(ordered) / count * 1000,
+                    'p95Ms': ordered[min(count - 1, int(count * .95))] * 1000,
+                    'maxMs': ordered[-1] * 1000
+                }
+            return result
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+class ResponseStage:
+    '''
+    Bounded, ordered hand-off of Convai responses to a worker thread.
+    The worker calls the given handler with the same arguments that were submitted.
+    '''
+    def __init__(self, handler, maxPending=64):
+        '''
+        Args:
+            handler (callable): Called as handler(text, audio, sampleRate, isFinal) on the worker thread
+            maxPending (int): Maximum number of responses waiting to be processed
+        '''
+        self.handler = handler
+        self.queue = Queue(maxsize=maxPending)
+        self.timer = StageTimer()
+        self.workerThread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        '''
+        Starts the worker thread if it is not already running.
+        '''
+        with self.lock:
+            if self.workerThread and self.workerThread.is_alive():
+                return
+            self.workerThread = threading.Thread(target=self.processLoop, daemon=True)
+            self.workerThread.start()
+
+    def submit(self, text: str, audio: bytes, sampleRate: int, isFinal: bool):
+        '''
+        Queues a response for processing. Only blocks the caller when
+        the stage is maxPending responses behind, which is logged.
+        '''
+        self.start()
+        item = (time.perf_counter(), text, audio, sampleRate, isFinal)
+        try:
+            self.queue.put_nowait(item)
+        except Full:
+            log(f'Processing is {self.queue.maxsize} responses behind, receive thread is waiting', warning=True)
+            waitStart = time.perf_counter()
+            self.queue.put(item)
+            self.timer.add('submitWait', time.perf_counter() - waitStart)
+
+    def processLoop(self):
+        '''
+        Worker loop, processes queued responses in arrival order.
+        '''
+        while True:
+            submitted, text, audio, sampleRate, isFinal = self.queue.get()
+            start = time.perf_counter()
+            self.timer.add('queueWait', start - submitted)
+            try:
+                self.handler(text, audio, sampleRate, isFinal)
+            except Exception as e:
+                log(f'Error processing response: {e}', warning=True)
+            finally:
+                self.timer.add('process', time.perf_counter() - start)
+                self.queue.task_done()
+
+            if isFinal:
+                self.logTimings()
+
+    def flush(self):
+        '''
+        Drops all responses that have not been processed yet.
+
+        Returns:
+            int: Number of dropped responses
+        '''
+        dropped = 0
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+            self.queue.task_done()
+            dropped += 1
+        return dropped
+
+    def logTimings(self):
+        '''
+        Logs the per-stage timing summary.
+        '''
+        for stage, stats in self.timer.summary().items():
+            log(f"{stage}: n={stats['count']} mean={stats['meanMs']:.2f}ms "
+                f"p95={stats['p95Ms']:.2f}ms max={stats['maxMs']:.2f}ms")
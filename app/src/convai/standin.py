@@ -0,0 +1,234 @@
+# ------------------------------------------------------------------------------
+# Local stand-in for the Convai gRPC service, to measure our own overhead
+# without the real endpoint in the way. Run from app/src:
+#   python -m convai.standin [--port 50052] [--wav reply.wav] [--chunk-ms 250,500]
+#                            [--first-delay-ms 300] [--delay-ms 80] [--jitter-ms 40]
+#                            [--fail-rate 0.1] [--fail-after 3]
+# and point the client at it in convai.env:
+#   CHANNEL = localhost:50052
+#   INSECURE = true
+# ------------------------------------------------------------------------------
+
+import argparse, io, math, random, threading, time, uuid, wave
+from concurrent import futures
+import grpc
+from .rpc import service_pb2 as convaiServiceMsg, service_pb2_grpc as convaiService
+
+DEFAULT_SAMPLE_RATE = 22050 # what Convai sends back
+DEFAULT_TEXT = 'Good morrow, gentle friend, what marvel dost thou bring me?'
+
+def log(text: str, warning: bool = False):
+    print(f"[convai stand-in] {'[Warning]' if warning else ''} {text}")
+
+def synthesizeSpeech(seconds: float = 3., sampleRate: int = DEFAULT_SAMPLE_RATE):
+    '''
+    Makes a speech-like 16 bit mono PCM signal: a pitch-gliding buzz with syllable-rate envelope.
+
+    Returns:
+        bytes: The PCM samples
+    '''
+    samples = bytearray()
+    for i in range(int(seconds * sampleRate)):
+        t = i / sampleRate
+        pitch = 120 + 30 * math.sin(2 * math.pi * .5 * t)
+        envelope = .5 + .5 * math.sin(2 * math.pi * 4 * t) # ~4 syllables a second
+        value = envelope * (math.sin(2 * math.pi * pitch * t) + .4 * math.sin(4 * math.pi * pitch * t))
+        samples += int(6000 * value).to_bytes(2, 'little', signed=True)
+    return bytes(samples)
+
+def readWav(path):
+    '''
+    Reads a 16 bit mono WAV file.
+
+    Returns:
+        tuple[bytes, int]: The PCM samples and the sample rate
+    '''
+    with wave.open(path, 'rb') as wavFile:
+        if wavFile.getsampwidth() != 2 or wavFile.getnchannels() != 1:
+            raise ValueError(f'{path} has to be 16 bit mono')
+        return wavFile.readframes(wavFile.getnframes()), wavFile.getframerate()
+
+def toWav(pcm, sampleRate):
+    '''
+    Wraps PCM in a WAV header, the way every Convai audio chunk comes.
+
+    Returns:
+        bytes: The WAV file
+    '''
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wavFile:
+        wavFile.setnchannels(1)
+        wavFile.setsampwidth(2)
+        wavFile.setframerate(sampleRate)
+        wavFile.writeframes(pcm)
+    return buffer.getvalue()
+
+class CallRecord:
+    '''
+    What one GetResponse call sent and when, perf_counter times.
+    '''
+    def __init__(self):
+        self.startTime = time.perf_counter()
+        self.config = None
+        self.audioBytes = 0
+        self.lastRequestTime = None # the client's final write, i.e. the mic release
+        self.firstResponseTime = None
+        self.endTime = None
+        self.chunksSent = 0
+        self.failed = None
+
+    def summary(self):
+        '''
+        Returns:
+            dict: Uploaded audio, chunk count, and the stand-in's own time to first response
+        '''
+        return {
+            'audioBytes': self.audioBytes,
+            'chunksSent': self.chunksSent,
+            'firstResponseMs': (self.firstResponseTime - self.lastRequestTime) * 1000
+                               if self.firstResponseTime and self.lastRequestTime else None,
+            'failed': self.failed
+        }
+
+class ConvaiStandIn(convaiService.ConvaiServiceServicer):
+    '''
+    Answers every GetResponse with the same canned reply, split into WAV chunks.
+    '''
+    def __init__(self, pcm=None, sampleRate=DEFAULT_SAMPLE_RATE, text=DEFAULT_TEXT, chunkMs=(500,),
+                 firstDelayMs=0., delayMs=0., jitterMs=0., failRate=0., failAfter=None, seed=None):
+        '''
+        Args:
+            pcm (bytes): 16 bit mono PCM of the reply, synthesized if not given
+            sampleRate (int): Sample rate of the reply
+            text (str): Reply text, spread over the chunks
+            chunkMs (tuple): Chunk durations in milliseconds, cycled through
+            firstDelayMs (float): Wait after the client's final write before the first chunk
+            delayMs (float): Wait between chunks
+            jitterMs (float): Up to this much is randomly added to every wait
+            failRate (float): Share of calls that fail with UNAVAILABLE
+            failAfter (int): Calls that fail do so after this many chunks, right away if None
+            seed (int): Seed for the jitter and failures, for repeatable runs
+        '''
+        self.pcm = pcm if pcm is not None else synthesizeSpeech(sampleRate=sampleRate)
+        self.sampleRate = sampleRate
+        self.text = text
+        self.chunkMs = tuple(chunkMs)
+        self.firstDelayMs = firstDelayMs
+        self.delayMs = delayMs
+        self.jitterMs = jitterMs
+        self.failRate = failRate
+        self.failAfter = failAfter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def splitReply(self):
+        '''
+        Returns:
+            list[tuple[bytes, str]]: PCM and text of every chunk
+        '''
+        chunks, offset, index = [], 0, 0
+        while offset < len(self.pcm):
+            size = int(self.sampleRate * self.chunkMs[index % len(self.chunkMs)] / 1000) * 2
+            chunks.append(self.pcm[offset:offset + size])
+            offset += size
+            index += 1
+        words = self.text.split()
+        perChunk = -(-len(words) // max(1, len(chunks)))
+        return [(pcm, ' '.join(words[i * perChunk:(i + 1) * perChunk])) for i, pcm in enumerate(chunks)]
+
+    def wait(self, ms, context):
+        with self.lock:
+            ms += self.random.uniform(0, self.jitterMs)
+        if ms > 0:
+            time.sleep(ms / 1000)
+        return context.is_active()
+
+    def GetResponse(self, request_iterator, context):
+        record = CallRecord()
+        with self.lock:
+            self.calls.append(record)
+            willFail = self.random.random() < self.failRate
+
+        for request in request_iterator: # the client closes its side after the final write
+            if request.HasField('get_response_config'):
+                record.config = request.get_response_config
+            elif request.HasField('get_response_data'):
+                record.audioBytes += len(request.get_response_data.audio_data)
+            record.lastRequestTime = time.perf_counter()
+        if record.config is None:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'The first request has to be the GetResponseConfig')
+
+        sessionId = record.config.session_id or uuid.uuid4().hex
+        if willFail and self.failAfter is None:
+            record.failed = 'before the reply'
+            context.abort(grpc.StatusCode.UNAVAILABLE, 'Injected failure')
+
+        chunks = self.splitReply()
+        if not self.wait(self.firstDelayMs, context):
+            return
+        for index, (pcm, text) in enumerate(chunks):
+            if willFail and index == self.failAfter:
+                record.failed = f'after {index} chunks'
+                context.abort(grpc.StatusCode.UNAVAILABLE, 'Injected failure')
+            if index and not self.wait(self.delayMs, context):
+                return
+            if record.firstResponseTime is None:
+                record.firstResponseTime = time.perf_counter()
+            record.chunksSent += 1
+            yield convaiServiceMsg.GetResponseResponse(
+                session_id=sessionId,
+                audio_response=convaiServiceMsg.GetResponseResponse.AudioResponse(
+                    audio_data=toWav(pcm, self.sampleRate),
+                    audio_config=convaiServiceMsg.AudioConfig(sample_rate_hertz=self.sampleRate),
+                    text_data=text,
+                    end_of_response=index == len(chunks) - 1))
+        record.endTime = time.perf_counter()
+        log(f'Answered a call: {record.audioBytes} audio bytes in, {record.chunksSent} chunks out')
+
+def serveStandIn(address='localhost:50052', standIn=None, workers=8):
+    '''
+    Starts the stand-in gRPC server.
+
+    Args:
+        address (str): Address to listen on, port 0 picks a free one
+        standIn (ConvaiStandIn): The servicer, a default one if not given
+        workers (int): Threads handling calls, one per concurrent call
+
+    Returns:
+        tuple[grpc.Server, ConvaiStandIn, int]: The running server, its servicer and the bound port
+    '''
+    standIn = standIn or ConvaiStandIn()
+    grpcServer = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+    convaiService.add_ConvaiServiceServicer_to_server(standIn, grpcServer)
+    port = grpcServer.add_insecure_port(address)
+    grpcServer.start()
+    log(f"Listening on {address.rsplit(':', 1)[0]}:{port}")
+    return grpcServer, standIn, port
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m convai.standin', description='Local stand-in for the Convai gRPC service')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=50052)
+    parser.add_argument('--wav', help='16 bit mono WAV file to reply with, a synthesized voice if not given')
+    parser.add_argument('--text', default=DEFAULT_TEXT, help='reply text')
+    parser.add_argument('--chunk-ms', default='500', help='chunk durations in ms, comma separated ones are cycled through')
+    parser.add_argument('--first-delay-ms', type=float, default=0., help='wait after the final upload before the first chunk')
+    parser.add_argument('--delay-ms', type=float, default=0., help='wait between chunks')
+    parser.add_argument('--jitter-ms', type=float, default=0., help='random extra wait of up to this much')
+    parser.add_argument('--fail-rate', type=float, default=0., help='share of calls that fail with UNAVAILABLE')
+    parser.add_argument('--fail-after', type=int, help='failing calls fail after this many chunks instead of right away')
+    parser.add_argument('--seed', type=int, help='seed for jitter and failures')
+    args = parser.parse_args()
+
+    pcm, sampleRate = readWav(args.wav) if args.wav else (None, DEFAULT_SAMPLE_RATE)
+    standIn = ConvaiStandIn(pcm, sampleRate, args.text, [float(ms) for ms in args.chunk_ms.split(',')],
+                            args.first_delay_ms, args.delay_ms, args.jitter_ms, args.fail_rate, args.fail_after, args.seed)
+    grpcServer, _, _ = serveStandIn(f'{args.host}:{args.port}', standIn)
+    try:
+        grpcServer.wait_for_termination()
+    except KeyboardInterrupt:
+        grpcServer.stop(0)
+
+if __name__ == '__main__':
+    main()
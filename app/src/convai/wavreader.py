@@ -0,0 +1,151 @@
+# ------------------------------------------------------------------------------
+# Minimal, strict RIFF/WAVE reader for the audio chunks streamed back by Convai.
+# Returns a zero-copy view of the PCM payload so that the response path
+# doesn't have to round-trip every chunk through pydub.
+# ------------------------------------------------------------------------------
+
+from struct import unpack_from
+from common import lazyImport
+
+np = lazyImport('numpy') # only needed once samples are touched
+
+PCM_FORMAT = 1
+EXTENSIBLE_FORMAT = 0xFFFE
+STREAMING_SIZES = (0, 0xFFFFFFFF) # placeholder sizes written by streaming encoders
+
+class WavFormatError(ValueError):
+    '''
+    Raised when a chunk claims to be a WAV file but is malformed or not PCM.
+    '''
+
+class WavFormat:
+    '''
+    Format of a PCM payload.
+    '''
+    __slots__ = ('sampleRate', 'channels', 'sampleWidth')
+
+    def __init__(self, sampleRate: int, channels: int = 1, sampleWidth: int = 2):
+        self.sampleRate = sampleRate
+        self.channels = channels
+        self.sampleWidth = sampleWidth
+
+    @property
+    def frameSize(self):
+        return self.channels * self.sampleWidth
+
+    def duration(self, numBytes: int):
+        '''
+        Returns:
+            float: Duration in seconds of numBytes of PCM in this format
+        '''
+        return numBytes / (self.frameSize * self.sampleRate)
+
+    def __repr__(self):
+        return f'WavFormat(sampleRate={self.sampleRate}, channels={self.channels}, sampleWidth={self.sampleWidth})'
+
+def isWav(data) -> bool:
+    '''
+    Checks whether the data starts with a RIFF/WAVE header.
+    '''
+    return len(data) >= 12 and bytes(data[:4]) == b'RIFF' and bytes(data[8:12]) == b'WAVE'
+
+def parseWav(data):
+    '''
+    Parses a RIFF/WAVE buffer without copying the sample data.
+
+    Args:
+        data (bytes | bytearray | memoryview): The complete WAV file
+
+    Returns:
+        tuple[WavFormat, memoryview]: The format and a view of the PCM payload
+
+    Raises:
+        WavFormatError: If the buffer is not a well formed PCM WAV file
+    '''
+    view = memoryview(data)
+    if not isWav(view):
+        raise WavFormatError('Missing RIFF/WAVE header')
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(view):
+        chunkId = bytes(view[offset:offset + 4])
+        chunkSize = unpack_from('<I', view, offset + 4)[0]
+        body = offset + 8
+
+        if chunkId == b'fmt ':
+            if chunkSize < 16 or body + chunkSize > len(view):
+                raise WavFormatError(f'Truncated fmt chunk ({chunkSize} bytes)')
+            formatTag, channels, sampleRate, _, blockAlign, bitsPerSample = unpack_from('<HHIIHH', view, body)
+            if formatTag == EXTENSIBLE_FORMAT and chunkSize >= 40:
+                formatTag = unpack_from('<H', view, body + 24)[0] # sub format GUID starts w the format tag
+            if formatTag != PCM_FORMAT:
+                raise WavFormatError(f'Unsupported WAV format tag: {formatTag}')
+            if channels == 0 or sampleRate == 0 or bitsPerSample % 8 or blockAlign != channels * bitsPerSample // 8:
+                raise WavFormatError('Inconsistent fmt chunk')
+            fmt = WavFormat(sampleRate, channels, bitsPerSample // 8)
+
+        elif chunkId == b'data':
+            if fmt is None:
+                raise WavFormatError('data chunk before fmt chunk')
+            available = len(view) - body
+            if chunkSize in STREAMING_SIZES:
+                chunkSize = available
+            elif chunkSize > available:
+                raise WavFormatError(f'Truncated data chunk: expected {chunkSize} bytes, got {available}')
+            chunkSize -= chunkSize % fmt.frameSize # never hand out a partial frame
+            return fmt, view[body:body + chunkSize]
+
+        offset = body + chunkSize + (chunkSize & 1) # chunks are word aligned
+
+    raise WavFormatError('No data chunk found')
+
+def readPcm(data, sampleRate: int):
+    '''
+    Gets the PCM payload of a Convai audio chunk.
+    Chunks with a RIFF header are parsed, anything else is treated as raw 16 bit mono PCM.
+
+    Args:
+        data (bytes): The received audio chunk
+        sampleRate (int): Sample rate reported alongside the chunk
+
+    Returns:
+        tuple[WavFormat, memoryview]: The format and a view of the PCM payload
+    '''
+    if isWav(data):
+        return parseWav(data)
+    view = memoryview(data)
+    return WavFormat(sampleRate), view[:len(view) - len(view) % 2]
+
+def asSamples(pcm, fmt: WavFormat):
+    '''
+    Read-only NumPy view of 16 bit PCM, no copy is made.
+    '''
+    if fmt.sampleWidth != 2:
+        raise WavFormatError(f'Expected 16 bit samples, got {fmt.sampleWidth * 8} bit')
+    return np.frombuffer(pcm, dtype='<i2')
+
+def fadeEdges(pcm, fmt: WavFormat, fadeMs: int):
+    '''
+    Copies 16 bit PCM and applies a linear fade in/out to its edges,
+    to avoid clicks between consecutive chunks.
+
+    Args:
+        pcm (memoryview): The PCM payload
+        fmt (WavFormat): Format of the payload
+        fadeMs (int): Fade length in milliseconds
+
+    Returns:
+        bytearray: The faded PCM
+    '''
+    out = bytearray(pcm)
+    if fmt.sampleWidth != 2 or not out:
+        return out
+
+    samples = np.frombuffer(out, dtype='<i2').reshape(-1, fmt.channels)
+    fadeLen = min(len(samples) // 2, fmt.sampleRate * fadeMs // 1000)
+    if fadeLen:
+        ramp = np.linspace(0., 1., fadeLen, endpoint=False, dtype=np.float32)[:, None]
+        samples[:fadeLen] = samples[:fadeLen] * ramp
+        samples[-fadeLen:] = samples[-fadeLen:] * ramp[::-1]
+    return out
@@ -1 +1,9 @@
-from .gemini import *
\ No newline at end of file
+# The client's names are loaded on first access, it pulls in requests.
+# That keeps the pure modules (stream, body, helpers) importable on their own,
+# e.g. from gemini.stream import SSEParser
+import importlib, importlib.util
+
+def __getattr__(name):
+    if name.startswith('__') or importlib.util.find_spec(f'{__name__}.{name}') is not None:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'") # submodules are left to the import system
+    return getattr(importlib.import_module('.gemini', __name__), name)
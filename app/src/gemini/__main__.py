@@ -0,0 +1,32 @@
+# -----------------------------------------------------------------------------
+# Command line tools for the gemini package, run from app/src:
+#   python -m gemini warm <imgDir>
+#   python -m gemini batch <imgDir> [--workers 4] [--out results.jsonl]
+# -----------------------------------------------------------------------------
+
+import argparse, sys
+from . import cache, batch
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m gemini', description='Gemini image description tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    warmParser = subparsers.add_parser('warm', help='precompute cached descriptions for a folder of images')
+    warmParser.add_argument('imgDir', help='folder with the images')
+
+    batchParser = subparsers.add_parser('batch', help='describe a folder of images concurrently, resumable')
+    batchParser.add_argument('imgDir', help='folder with the images')
+    batchParser.add_argument('--workers', type=int, default=4, help='maximum concurrent requests')
+    batchParser.add_argument('--out', help='JSONL file the results are appended to')
+    batchParser.add_argument('--checkpoint', help='checkpoint file, defaults to <out>.checkpoint')
+    batchParser.add_argument('--recursive', action='store_true', help='include sub folders')
+
+    args = parser.parse_args()
+    if args.command == 'warm':
+        if cache.warm(args.imgDir)['failed']:
+            sys.exit(1)
+    elif args.command == 'batch':
+        batch.run(args.imgDir, args.workers, args.out, args.checkpoint, args.recursive)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+# -----------------------------------------------------------------------------
+# Headless batch ingestion of a folder of images, run from app/src:
+#   python -m gemini batch <imgDir> [--workers 4] [--out results.jsonl]
+#
+# Images are described through a bounded worker pool whose concurrency adapts
+# to rate limiting (halved on 429 / RESOURCE_EXHAUSTED, grown back on success).
+# Results go to the description cache and optionally to a JSONL file.
+# Finished images are appended to a checkpoint, so an interrupted run resumes.
+# -----------------------------------------------------------------------------
+
+import os, json, time, hashlib, requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import gemini, cache, helpers
+from common import httpclient
+
+def log(text: str, warning: bool = False):
+    print(f"[gemini batch] {'[Warning]' if warning else ''} {text}")
+
+class AdaptiveLimit:
+    '''
+    Additive increase / multiplicative decrease concurrency limit.
+    '''
+    def __init__(self, maxLimit, minBackoff=1., maxBackoff=60.):
+        '''
+        Args:
+            maxLimit (int): Upper bound, the size of the worker pool
+            minBackoff (float): First pause in seconds after being rate limited
+            maxBackoff (float): Longest pause in seconds
+        '''
+        self.maxLimit = maxLimit
+        self.limit = maxLimit
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+        self.backoff = minBackoff
+        self.pauseUntil = 0.
+        self.successes = 0
+
+    def onSuccess(self):
+        self.backoff = self.minBackoff
+        self.successes += 1
+        if self.successes >= self.limit and self.limit < self.maxLimit: # one step per round of successes
+            self.limit += 1
+            self.successes = 0
+
+    def onRateLimited(self, retryAfter=None):
+        self.limit = max(1, self.limit // 2)
+        self.successes = 0
+        delay = retryAfter if retryAfter is not None else self.backoff
+        self.pauseUntil = max(self.pauseUntil, time.monotonic() + delay)
+        self.backoff = min(self.maxBackoff, self.backoff * 2)
+        return delay
+
+    def canStart(self, inFlight):
+        return inFlight < self.limit and time.monotonic() >= self.pauseUntil
+
+class Checkpoint:
+    '''
+    Append-only JSONL record of the images that were described successfully.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)['path'])
+                    except (ValueError, KeyError):
+                        continue # partially written last line
+
+    def add(self, imgPath):
+        self.done.add(imgPath)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'path': imgPath}) + '\n')
+
+def listImages(imgDir, recursive=False):
+    '''
+    Lists the supported images in a folder, sorted for a stable order across runs.
+    '''
+    imgPaths = []
+    for root, dirs, files in os.walk(imgDir):
+        imgPaths += [os.path.abspath(os.path.join(root, name)) for name in files
+                     if name.split('.')[-1].lower() in helpers.SUPPORTED_EXTS]
+        if not recursive:
+            break
+    return sorted(imgPaths)
+
+def describe(imgPath, geminiConfig, descriptions, session):
+    '''
+    Describes one image, reusing the cache.
+
+    Returns:
+        tuple[str, bool]: The description and whether it came from the cache
+    '''
+    key = descriptions.makeKey([cache.hashFile(imgPath)], geminiConfig['prompt'], geminiConfig['model'])
+    cached = descriptions.get(key)
+    if cached is not None:
+        return cached, True
+    text = gemini.requestDescription(imgPath, geminiConfig, session=session)
+    descriptions.put(key, text, model=geminiConfig['model'], source=os.path.basename(imgPath))
+    return text, False
+
+def run(imgDir, workers=4, outPath=None, checkpointPath=None, recursive=False, maxAttempts=5):
+    '''
+    Describes every image in a folder.
+
+    Args:
+        imgDir (str): The folder with the images
+        workers (int): Maximum concurrent requests
+        outPath (str): Optional JSONL file the results are appended to
+        checkpointPath (str): Checkpoint file, derived from outPath or imgDir if None
+        recursive (bool): Whether to include sub folders
+        maxAttempts (int): Attempts per image, rate limited attempts included
+
+    Returns:
+        dict: Counts of described, cached, failed and skipped images
+    '''
+    geminiConfig = dict(gemini.loadGeminiConfig(), stream=False, hedge=False) # duplicates would only eat into the quota
+    descriptions = gemini.getDescriptionCache(geminiConfig)
+    session = httpclient.getSession('gemini-batch', retryStatuses=(500, 502, 503, 504), poolSize=workers,
+                                    respectRetryAfter=False, # 429s are handled by the adaptive limit
+                                    retryPost=True) # offline, a repeated call beats a failed image
+
+    if checkpointPath is None:
+        if outPath:
+            checkpointPath = f'{outPath}.checkpoint'
+        else:
+            dirKey = hashlib.sha1(os.path.abspath(imgDir).encode('utf-8')).hexdigest()[:16]
+            checkpointPath = os.path.join(helpers.cachePath('batch'), f'{dirKey}.checkpoint')
+    checkpoint = Checkpoint(checkpointPath)
+
+    imgPaths = listImages(imgDir, recursive)
+    pending = deque((imgPath, 1) for imgPath in imgPaths if imgPath not in checkpoint.done)
+    counts = {'described': 0, 'cached': 0, 'failed': 0, 'skipped': len(imgPaths) - len(pending)}
+    total = len(pending)
+    log(f'{len(imgPaths)} images, {counts["skipped"]} already done, checkpoint at {checkpointPath}')
+
+    limit = AdaptiveLimit(workers)
+    outFile = open(outPath, 'a', encoding='utf-8') if outPath else None
+    start = time.perf_counter()
+    finished = 0
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            inFlight = {}
+            while pending or inFlight:
+                while pending and limit.canStart(len(inFlight)):
+                    imgPath, attempt = pending.popleft()
+                    future = executor.submit(describe, imgPath, geminiConfig, descriptions, session)
+                    inFlight[future] = (imgPath, attempt, time.perf_counter())
+
+                done, _ = wait(list(inFlight), timeout=.2, return_when=FIRST_COMPLETED) if inFlight else (set(), None)
+                if not inFlight:
+                    time.sleep(.1) # paused after a rate limit
+
+                for future in done:
+                    imgPath, attempt, submitted = inFlight.pop(future)
+                    name = os.path.basename(imgPath)
+                    try:
+                        text, wasCached = future.result()
+                    except gemini.GeminiError as e:
+                        if e.isRateLimited and attempt < maxAttempts:
+                            delay = limit.onRateLimited(e.retryAfter)
+                            pending.append((imgPath, attempt + 1))
+                            log(f'Rate limited on {name}, concurrency now {limit.limit}, pausing {delay:.1f}s', warning=True)
+                            continue
+                        text, wasCached = None, False
+                        error = f'{e.statusCode} - {e.text}'
+                    except (requests.exceptions.RequestException, OSError) as e:
+                        if attempt < maxAttempts:
+                            pending.append((imgPath, attempt + 1))
+                            log(f'Retrying {name}: {e}', warning=True)
+                            continue
+                        text, wasCached = None, False
+                        error = str(e)
+                    except Exception as e: # e.g. a malformed response, fails the image instead of the batch
+                        text, wasCached = None, False
+                        error = f'{type(e).__name__}: {e}'
+
+                    finished += 1
+                    elapsedMs = (time.perf_counter() - submitted) * 1000
+                    if text is None:
+                        counts['failed'] += 1
+                        log(f'[{finished}/{total}] {name} failed: {error}', warning=True)
+                        result = {'path': imgPath, 'error': error}
+                    else:
+                        limit.onSuccess()
+                        counts['cached' if wasCached else 'described'] += 1
+                        checkpoint.add(imgPath)
+                        result = {'path': imgPath, 'text': text, 'model': geminiConfig['model'],
+                                  'cached': wasCached, 'elapsedMs': round(elapsedMs, 1)}
+                        rate = finished / (time.perf_counter() - start)
+                        log(f'[{finished}/{total}] {name} in {elapsedMs:.0f}ms'
+                            f"{' (cached)' if wasCached else ''}, {rate:.2f} img/s, concurrency {limit.limit}")
+
+                    if outFile:
+                        outFile.write(json.dumps(result) + '\n')
+                        outFile.flush()
+    finally:
+        if outFile:
+            outFile.close()
+
+    elapsed = time.perf_counter() - start
+    log(f"Done in {elapsed:.1f}s: {counts['described']} described, {counts['cached']} cached, "
+        f"{counts['failed']} failed, {counts['skipped']} skipped"
+        f"{f', {finished / elapsed:.2f} img/s' if finished and elapsed else ''}")
+    return counts
@@ -0,0 +1,74 @@
+# -----------------------------------------------------------------------------
+# Streaming JSON request bodies for the Gemini uploads.
+# Image data is read through mmap and base64 encoded chunk by chunk while the
+# body is being sent, so an upload never holds the file, its base64 and the
+# JSON string in memory at once. Peak memory is one chunk, whatever the image size.
+# -----------------------------------------------------------------------------
+
+import os, json, mmap, uuid
+from base64 import b64encode
+
+CHUNK_SIZE = 3 * 64 * 1024 # a multiple of 3, so chunks encode without padding in between
+
+class FileData:
+    '''
+    Placeholder for the base64 content of a file inside a JsonBody.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def __len__(self):
+        return 4 * ((self.size + 2) // 3) # base64 length
+
+    def __iter__(self):
+        '''
+        Yields the base64 encoding of the file, one chunk at a time.
+        '''
+        if not self.size:
+            return
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for offset in range(0, self.size, CHUNK_SIZE):
+                yield b64encode(mapped[offset:offset + CHUNK_SIZE])
+
+class JsonBody:
+    '''
+    Iterable request body that serializes an object to JSON,
+    streaming the FileData values found anywhere inside it.
+    Its length is known up front, so the request is sent with a Content-Length,
+    and it can be iterated again when a request is retried.
+    '''
+    def __init__(self, obj):
+        '''
+        Args:
+            obj (dict | list): JSON serializable data, FileData allowed as values
+        '''
+        self.files = []
+        marker = f'@@{uuid.uuid4().hex}@@' # json.dumps leaves it untouched
+        text = json.dumps(self.replaceFiles(obj, marker))
+        self.segments = [segment.encode('utf-8') for segment in text.split(f'"{marker}"')]
+        if len(self.segments) != len(self.files) + 1:
+            raise ValueError('Could not place the file data in the request body')
+
+    def replaceFiles(self, obj, marker):
+        '''
+        Copies obj with every FileData replaced by a quoted marker, remembering the files in order.
+        '''
+        if isinstance(obj, FileData):
+            self.files.append(obj)
+            return marker
+        if isinstance(obj, dict):
+            return {key: self.replaceFiles(value, marker) for key, value in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [self.replaceFiles(value, marker) for value in obj]
+        return obj
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments) + sum(len(file) + 2 for file in self.files)
+
+    def __iter__(self):
+        for segment, file in zip(self.segments, self.files):
+            yield segment + b'"'
+            yield from file
+            yield b'"'
+        yield self.segments[-1]
@@ -0,0 +1,181 @@
+# -----------------------------------------------------------------------------
+# Content addressed on-disk cache for the descriptions generated by Gemini.
+# Entries are keyed by a hash of the image bytes plus the prompt and model,
+# expire after a TTL and are evicted least recently used first past a size cap.
+#
+# Warm up the cache for a folder of images (run from app/src):
+#   python -m gemini warm gemini/imgs
+# -----------------------------------------------------------------------------
+
+import os, json, time, hashlib, threading
+from . import helpers
+
+HASH_BLOCK = 1 << 20 # 1 MB
+
+def log(text: str, warning: bool = False):
+    print(f"[gemini cache] {'[Warning]' if warning else ''} {text}")
+
+def hashFile(path):
+    '''
+    SHA-256 of a file's content, read in blocks.
+
+    Args:
+        path (str): The path to the file
+
+    Returns:
+        str: The hex digest
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class DescriptionCache:
+    '''
+    Stores one small JSON file per description.
+    The file's mtime doubles as the last access time for LRU eviction.
+    '''
+    def __init__(self, path=None, maxBytes=50 * 1024 * 1024, ttlSeconds=30 * 24 * 3600):
+        '''
+        Args:
+            path (str): Cache folder, defaults to the 'descriptions' folder in the app cache
+            maxBytes (int): Size cap of the cache folder
+            ttlSeconds (float): Age after which an entry is no longer used
+        '''
+        self.path = path or helpers.cachePath('descriptions')
+        os.makedirs(self.path, exist_ok=True)
+        self.maxBytes = maxBytes
+        self.ttlSeconds = ttlSeconds
+        self.lock = threading.Lock()
+
+    def makeKey(self, imgHashes, prompt, model):
+        '''
+        Builds the cache key for one or more images described with the given prompt and model.
+
+        Args:
+            imgHashes (list[str]): Content hashes of the images, see hashFile
+            prompt (str): The prompt sent along with the images
+            model (str): The Gemini model
+
+        Returns:
+            str: The key
+        '''
+        return hashlib.sha256('\n'.join([model, prompt, *imgHashes]).encode('utf-8')).hexdigest()
+
+    def entryPath(self, key):
+        return os.path.join(self.path, f'{key}.json')
+
+    def get(self, key):
+        '''
+        Looks up a description.
+
+        Returns:
+            str | None: The description, None if missing or expired
+        '''
+        entryPath = self.entryPath(key)
+        try:
+            with open(entryPath, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if time.time() - entry.get('created', 0) > self.ttlSeconds:
+            self.remove(key)
+            return None
+
+        try:
+            os.utime(entryPath) # mark as recently used
+        except OSError:
+            pass
+        return entry.get('text')
+
+    def put(self, key, text, **meta):
+        '''
+        Stores a description and evicts old entries if the cache got too big.
+
+        Args:
+            key (str): The cache key
+            text (str): The description
+            meta: Extra fields stored alongside, e.g. the model
+        '''
+        entryPath = self.entryPath(key)
+        tmpPath = f'{entryPath}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmpPath, 'w', encoding='utf-8') as f:
+            json.dump({'text': text, 'created': time.time(), **meta}, f)
+        os.replace(tmpPath, entryPath)
+        self.evict()
+
+    def remove(self, key):
+        try:
+            os.remove(self.entryPath(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        '''
+        Removes expired entries, then least recently used ones until the cache fits in maxBytes.
+        '''
+        with self.lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                stat = entry.stat()
+                if now - stat.st_mtime > self.ttlSeconds:
+                    os.remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.maxBytes:
+                    break
+                os.remove(path)
+                total -= size
+
+def warm(imgDir):
+    '''
+    Precomputes descriptions for every supported image in a folder.
+
+    Args:
+        imgDir (str): The folder with the images
+
+    Returns:
+        dict: Counts of described, cached and failed images
+    '''
+    import requests
+    from . import gemini
+
+    geminiConfig = gemini.loadGeminiConfig()
+    descriptions = gemini.getDescriptionCache(geminiConfig)
+    imgPaths = [os.path.join(imgDir, name) for name in sorted(os.listdir(imgDir))
+                if name.split('.')[-1].lower() in helpers.SUPPORTED_EXTS]
+    counts = {'described': 0, 'cached': 0, 'failed': 0}
+    for i, imgPath in enumerate(imgPaths, 1):
+        name = os.path.basename(imgPath)
+        key = descriptions.makeKey([hashFile(imgPath)], geminiConfig['prompt'], geminiConfig['model'])
+        if descriptions.get(key) is not None:
+            counts['cached'] += 1
+            log(f'[{i}/{len(imgPaths)}] {name} already cached')
+            continue
+
+        start = time.perf_counter()
+        try:
+            text = gemini.requestDescription(imgPath, geminiConfig)
+        except gemini.GeminiError as e:
+            counts['failed'] += 1
+            log(f'[{i}/{len(imgPaths)}] {name} failed: {e.statusCode} - {e.text}', warning=True)
+            continue
+        except requests.exceptions.RequestException as e:
+            counts['failed'] += 1
+            log(f'[{i}/{len(imgPaths)}] {name} failed: {e}', warning=True)
+            continue
+        descriptions.put(key, text, model=geminiConfig['model'], source=name)
+        counts['described'] += 1
+        log(f'[{i}/{len(imgPaths)}] {name} in {time.perf_counter() - start:.2f}s')
+
+    log(f"Done: {counts['described']} described, {counts['cached']} already cached, {counts['failed']} failed",
+        warning=counts['failed'] > 0)
+    return counts
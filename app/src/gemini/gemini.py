@@ -3,12 +3,20 @@
 # Using gemini to generate context for shakespeare about an image.
 # -----------------------------------------------------------------------------
 
-import requests, json, os, configparser
-from . import image, helpers
+import requests, os, configparser
+from . import image, helpers, cache, stream, body, hedge
+from common import httpclient, configcache
+
+DEFAULT_MULTI_PROMPT = ('The following {count} images belong to one scene. '
+                        'Treat them as a whole and answer once for all of them.')
+
+def log(text: str, warning: bool = False):
+    print(f"[gemini] {'[Warning]' if warning else ''} {text}")
 
 def loadGeminiConfig():
     '''
     Load the Gemini configuration from the gemini.env file using ConfigParser.
+    The file is only parsed again when it changes.
 
     Returns:
         dict: The Gemini configuration data
@@ -17,64 +25,389 @@ def loadGeminiConfig():
     if not os.path.exists(configPath):
         raise FileNotFoundError('Gemini configuration file not found.')
 
-    config = configparser.ConfigParser()
-    config.read(configPath)
-    
+    return configcache.loadConfig(configPath, parseGeminiConfig)
+
+def parseGeminiConfig(config):
+    '''
+    Picks the Gemini settings out of the parsed gemini.env file.
+
+    Args:
+        config (configparser.ConfigParser): The parsed file
+
+    Returns:
+        dict: The Gemini configuration data
+    '''
     try:        
         geminiConfig = {
             'baseUrl': config.get('GEMINI', 'BASE_URL'),
             'apiKey': config.get('GEMINI', 'API_KEY'),
             'model': config.get('GEMINI', 'MODEL'),
-            'prompt': config.get('GEMINI', 'PROMPT')
+            'prompt': config.get('GEMINI', 'PROMPT'),
+            'maxImageEdge': config.getint('GEMINI', 'MAX_IMAGE_EDGE', fallback=1536),
+            'imageQuality': config.getint('GEMINI', 'IMAGE_QUALITY', fallback=85),
+            'imageFormat': config.get('GEMINI', 'IMAGE_FORMAT', fallback='JPEG'),
+            'preparedCacheMaxMb': config.getfloat('GEMINI', 'PREPARED_CACHE_MAX_MB', fallback=200),
+            'cacheMaxMb': config.getfloat('GEMINI', 'CACHE_MAX_MB', fallback=50),
+            'cacheTtlHours': config.getfloat('GEMINI', 'CACHE_TTL_HOURS', fallback=720),
+            'stream': config.getboolean('GEMINI', 'STREAM', fallback=False),
+            'multiPrompt': config.get('GEMINI', 'MULTI_PROMPT', fallback=DEFAULT_MULTI_PROMPT),
+            'maxRequestMb': config.getfloat('GEMINI', 'MAX_REQUEST_MB', fallback=18),
+            'deadline': config.getfloat('GEMINI', 'DEADLINE_SECONDS', fallback=45),
+            'hedge': config.getboolean('GEMINI', 'HEDGE', fallback=False),
+            'hedgePercentile': config.getfloat('GEMINI', 'HEDGE_PERCENTILE', fallback=95),
+            'hedgeDelay': config.getfloat('GEMINI', 'HEDGE_DELAY_SECONDS', fallback=8),
+            'hedgeMinSamples': config.getint('GEMINI', 'HEDGE_MIN_SAMPLES', fallback=20)
         }
     except configparser.NoOptionError as e:
         raise KeyError(f'Missing configuration key in gemini.env: {e}')
 
     return geminiConfig
 
-def getGeminiResponse(imgPath):
+class GeminiError(Exception):
+    '''
+    Raised when the Gemini API answers with anything but a description.
+    '''
+    def __init__(self, statusCode, text, retryAfter=None):
+        super().__init__(f'{statusCode} - {text}')
+        self.statusCode = statusCode
+        self.text = text
+        self.retryAfter = retryAfter # seconds, if the server asked us to back off
+
+    @property
+    def isRateLimited(self):
+        return self.statusCode == 429 or 'RESOURCE_EXHAUSTED' in str(self.text)
+
+class GeminiCancelled(Exception):
+    '''
+    Raised when a request is cancelled through its cancelEvent.
+    '''
+
+descriptionCache = None
+latencies = {} # 'stream' (time to first text) / 'full' -> hedge.LatencyHistogram
+
+def getDescriptionCache(geminiConfig):
+    '''
+    Get the shared description cache, created on first use.
+    '''
+    global descriptionCache
+    if descriptionCache is None:
+        descriptionCache = cache.DescriptionCache(maxBytes=int(geminiConfig['cacheMaxMb'] * 1024 * 1024),
+                                                  ttlSeconds=geminiConfig['cacheTtlHours'] * 3600)
+    return descriptionCache
+
+def requestDescription(imgPath, geminiConfig, onPartial=None, cancelEvent=None, session=None):
     '''
     Send a POST request to the Gemini API to generate content based on an image.
+    In streaming mode the text is read as server-sent events while it is generated.
 
     Args:
         imgPath (str): The path to the image file.
+        geminiConfig (dict): The Gemini configuration data
+        onPartial (callable): Called with the text received so far, when streaming
+        cancelEvent (threading.Event): Stops reading the stream once set
+        session (requests.Session): Session to use instead of the shared 'gemini' one
 
     Returns:
-        str: The response from the Gemini API
+        str: The text generated by Gemini
+
+    Raises:
+        GeminiError: If Gemini didn't answer with a description
+        GeminiCancelled: If cancelEvent got set while streaming
+        requests.exceptions.RequestException: If the request itself failed
     '''
-    geminiConfig = loadGeminiConfig()
+    imgPart, _ = buildImgPart(imgPath, geminiConfig)
+    return requestContent([{'text': geminiConfig['prompt']}, imgPart], geminiConfig, onPartial, cancelEvent, session)
+
+def requestCombinedDescription(imgPaths, geminiConfig, onPartial=None, cancelEvent=None, session=None):
+    '''
+    Gets one description for several images, sent as multiple inline_data parts
+    of a single request. Only if the images don't fit in MAX_REQUEST_MB together
+    are they split over as few requests as needed, whose answers are joined.
+
+    Args:
+        imgPaths (list[str]): The paths to the image files, in order
+        geminiConfig (dict): The Gemini configuration data
+        onPartial (callable): Called with the text received so far, when streaming
+        cancelEvent (threading.Event): Stops reading the stream once set
+        session (requests.Session): Session to use instead of the shared 'gemini' one
+
+    Returns:
+        str: The combined text generated by Gemini
+
+    Raises:
+        GeminiError: If Gemini didn't answer with a description
+        GeminiCancelled: If cancelEvent got set while streaming
+        requests.exceptions.RequestException: If the request itself failed
+    '''
+    imgParts = [buildImgPart(imgPath, geminiConfig) for imgPath in imgPaths]
+    batches = packImgParts(imgParts, int(geminiConfig['maxRequestMb'] * 1024 * 1024))
+    if len(batches) > 1:
+        log(f'{len(imgPaths)} images split over {len(batches)} requests to stay under '
+            f"{geminiConfig['maxRequestMb']:g} MB each", warning=True)
+
+    texts = []
+    first = 1
+    for batch in batches:
+        prompt = geminiConfig['multiPrompt'].format(count=len(imgPaths))
+        if len(batches) > 1:
+            prompt += f' This request carries images {first} to {first + len(batch) - 1} of {len(imgPaths)}.'
+        parts = [{'text': f"{prompt}\n\n{geminiConfig['prompt']}"}]
+        for i, imgPart in enumerate(batch, first):
+            parts += [{'text': f'Image {i}:'}, imgPart]
+
+        done = ''.join(f'{text}\n\n' for text in texts)
+        partial = (lambda text, done=done: onPartial(done + text)) if onPartial else None
+        texts.append(requestContent(parts, geminiConfig, partial, cancelEvent, session))
+        first += len(batch)
+    return '\n\n'.join(texts)
+
+def buildImgPart(imgPath, geminiConfig):
+    '''
+    Prepares an image for upload and wraps it in an inline_data part.
+    The image data is only read and encoded while the request body is sent.
+
+    Returns:
+        tuple[dict, int]: The part and its size in bytes once encoded
+    '''
+    uploadPath, mimeType, _ = image.ImageHandler.prepareImg(imgPath,
+                                                           geminiConfig['maxImageEdge'],
+                                                           geminiConfig['imageQuality'],
+                                                           geminiConfig['imageFormat'],
+                                                           int(geminiConfig['preparedCacheMaxMb'] * 1024 * 1024))
+    fileData = body.FileData(uploadPath)
+    return {'inline_data': {'mime_type': mimeType, 'data': fileData}}, len(fileData)
+
+def packImgParts(imgParts, maxBytes):
+    '''
+    Splits image parts, in order, into as few batches as possible below maxBytes each.
+    An image too large on its own still gets a batch of its own.
+
+    Args:
+        imgParts (list[tuple[dict, int]]): Parts and their sizes, see buildImgPart
+        maxBytes (int): Budget for the images of one request
+
+    Returns:
+        list[list[dict]]: The batches of parts
+    '''
+    batches = []
+    batch, batchBytes = [], 0
+    for part, size in imgParts:
+        if batch and batchBytes + size > maxBytes:
+            batches.append(batch)
+            batch, batchBytes = [], 0
+        batch.append(part)
+        batchBytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+def requestContent(parts, geminiConfig, onPartial=None, cancelEvent=None, session=None):
+    '''
+    Runs a request within the configured deadline. With hedging on, a duplicate
+    is sent once the request takes longer than the configured percentile of
+    recent latencies (HEDGE_DELAY_SECONDS until there are enough samples),
+    and the first to succeed is used.
+
+    Args:
+        parts (list[dict]): The text and inline_data parts of the request
+        geminiConfig (dict): The Gemini configuration data
+        onPartial (callable): Called with the text received so far, when streaming
+        cancelEvent (threading.Event): Cancels the request once set
+        session (requests.Session): Session to use instead of the shared 'gemini' one
+
+    Returns:
+        str: The text generated by Gemini
+
+    Raises:
+        GeminiCancelled: If cancelEvent got set
+        hedge.DeadlineExceeded: If there was no answer within the deadline, a requests Timeout
+    '''
+    mode = 'stream' if geminiConfig['stream'] else 'full'
+    histogram = latencies.setdefault(mode, hedge.LatencyHistogram())
+
+    hedgeDelay = None
+    if geminiConfig['hedge']:
+        hedgeDelay = geminiConfig['hedgeDelay']
+        if len(histogram) >= geminiConfig['hedgeMinSamples']:
+            hedgeDelay = histogram.percentile(geminiConfig['hedgePercentile'])
+
+    call = hedge.HedgedCall(lambda attemptCancel, attemptPartial:
+                                postContent(parts, geminiConfig, attemptPartial, attemptCancel, session),
+                            geminiConfig['deadline'], hedgeDelay, onPartial, cancelEvent)
+    try:
+        text, latency, attempts = call.run()
+    except hedge.Cancelled:
+        raise GeminiCancelled()
 
-    url = f"{geminiConfig['baseUrl']}/{geminiConfig['model']}:generateContent?key={geminiConfig['apiKey']}"
-    base64Img = image.ImageHandler.encodeImg(imgPath)
+    histogram.add(latency)
+    summary = histogram.summary()
+    log(f"{'First text' if mode == 'stream' else 'Answer'} after {latency * 1000:.0f}ms"
+        f"{f' ({attempts} attempts)' if attempts > 1 else ''}, "
+        f"p50 {summary['p50Ms']:.0f}ms p95 {summary['p95Ms']:.0f}ms p99 {summary['p99Ms']:.0f}ms over {summary['count']}")
+    return text
+
+def postContent(parts, geminiConfig, onPartial=None, cancelEvent=None, session=None):
+    '''
+    Posts a single generateContent (or streamGenerateContent) request with the given parts.
+
+    Args:
+        parts (list[dict]): The text and inline_data parts of the request
+        geminiConfig (dict): The Gemini configuration data
+        onPartial (callable): Called with the text received so far, when streaming
+        cancelEvent (threading.Event): Stops reading the stream once set
+        session (requests.Session): Session to use instead of the shared 'gemini' one
+
+    Returns:
+        str: The text generated by Gemini
+    '''
+    if geminiConfig['stream']:
+        url = f"{geminiConfig['baseUrl']}/{geminiConfig['model']}:streamGenerateContent?alt=sse&key={geminiConfig['apiKey']}"
+    else:
+        url = f"{geminiConfig['baseUrl']}/{geminiConfig['model']}:generateContent?key={geminiConfig['apiKey']}"
 
     headers = {
         'Content-Type': 'application/json'
     }
 
-    data = json.dumps({
+    data = body.JsonBody({ # streamed, so the image is never held in memory as a whole
         'contents': [
             {
-                'parts': [
-                    {'text': geminiConfig['prompt']},
-                    {
-                        'inline_data': {
-                            'mime_type': helpers.determineMimeType(imgPath),
-                            'data': base64Img
-                        }
-                    }
-                ]
+                'parts': parts
             }
         ]
     })
 
-    try:
-        response = requests.post(url, headers=headers, data=data)
+    session = session or httpclient.getSession('gemini')
+    response = session.post(url, headers=headers, data=data, stream=geminiConfig['stream'])
+
+    if response.status_code != 200:
+        raise GeminiError(response.status_code, response.text, parseRetryAfter(response.headers.get('Retry-After')))
 
-        if response.status_code != 200:
-            return f'Error: {response.status_code} - {response.text}'
-        
+    if geminiConfig['stream']:
+        with response:
+            return readStreamedText(response, onPartial, cancelEvent)
+
+    try:
         result = response.json()
         return result['candidates'][0]['content']['parts'][0]['text']
-    
+    except (ValueError, KeyError, IndexError):
+        raise GeminiError(response.status_code, f'Unexpected response: {response.text}')
+
+def parseRetryAfter(value):
+    '''
+    Parses a Retry-After header given in seconds.
+
+    Returns:
+        float | None: The delay in seconds, None if missing or not in seconds
+    '''
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def readStreamedText(response, onPartial=None, cancelEvent=None):
+    '''
+    Assembles the text of a streamGenerateContent response as it arrives.
+
+    Args:
+        response (requests.Response): The streaming response
+        onPartial (callable): Called with the text received so far after every event
+        cancelEvent (threading.Event): Stops reading once set
+
+    Returns:
+        str: The complete text
+    '''
+    parser = stream.SSEParser()
+    texts = []
+
+    def consume(payloads):
+        for payload in payloads:
+            text, error = stream.extractText(payload)
+            if error:
+                raise GeminiError(error.get('code', response.status_code), error.get('message', payload))
+            if text:
+                texts.append(text)
+                if onPartial:
+                    onPartial(''.join(texts))
+
+    for chunk in response.iter_content(chunk_size=None):
+        if cancelEvent and cancelEvent.is_set():
+            raise GeminiCancelled()
+        consume(parser.feed(chunk))
+    consume(parser.close())
+
+    if not texts:
+        raise GeminiError(response.status_code, 'Stream ended without any text')
+    return ''.join(texts)
+
+def getGeminiResponse(imgPath, onPartial=None, cancelEvent=None):
+    '''
+    Gets Gemini's description of an image, from the description cache if
+    the same image was already described with the current prompt and model.
+
+    Args:
+        imgPath (str): The path to the image file.
+        onPartial (callable): Called with the text received so far, when streaming
+        cancelEvent (threading.Event): Stops streaming once set, raising GeminiCancelled
+
+    Returns:
+        str: The response from the Gemini API
+    '''
+    geminiConfig = loadGeminiConfig()
+
+    descriptions = getDescriptionCache(geminiConfig)
+    key = descriptions.makeKey([cache.hashFile(imgPath)], geminiConfig['prompt'], geminiConfig['model'])
+    cached = descriptions.get(key)
+    if cached is not None:
+        if onPartial:
+            onPartial(cached)
+        return cached
+
+    try:
+        text = requestDescription(imgPath, geminiConfig, onPartial, cancelEvent)
+    except GeminiError as e:
+        return f'Error: {e.statusCode} - {e.text}'
+    except requests.exceptions.RequestException as e:
+        return f'Request failed: {str(e)}'
+
+    descriptions.put(key, text, model=geminiConfig['model'], source=os.path.basename(imgPath))
+    return text
+
+def getCombinedResponse(imgPaths, onPartial=None, cancelEvent=None):
+    '''
+    Gets one description for several images of the same scene, from the
+    description cache if the same images were already described together.
+    A single image goes through getGeminiResponse.
+
+    Args:
+        imgPaths (list[str]): The paths to the image files, in order
+        onPartial (callable): Called with the text received so far, when streaming
+        cancelEvent (threading.Event): Stops streaming once set, raising GeminiCancelled
+
+    Returns:
+        str: The response from the Gemini API
+    '''
+    if len(imgPaths) == 1:
+        return getGeminiResponse(imgPaths[0], onPartial, cancelEvent)
+
+    geminiConfig = loadGeminiConfig()
+
+    descriptions = getDescriptionCache(geminiConfig)
+    key = descriptions.makeKey([cache.hashFile(imgPath) for imgPath in imgPaths],
+                               f"{geminiConfig['multiPrompt']}|{geminiConfig['prompt']}", geminiConfig['model'])
+    cached = descriptions.get(key)
+    if cached is not None:
+        if onPartial:
+            onPartial(cached)
+        return cached
+
+    try:
+        text = requestCombinedDescription(imgPaths, geminiConfig, onPartial, cancelEvent)
+    except GeminiError as e:
+        return f'Error: {e.statusCode} - {e.text}'
     except requests.exceptions.RequestException as e:
-        return f'Request failed: {str(e)}'
\ No newline at end of file
+        return f'Request failed: {str(e)}'
+
+    descriptions.put(key, text, model=geminiConfig['model'],
+                     source=', '.join(os.path.basename(imgPath) for imgPath in imgPaths))
+    return text
@@ -0,0 +1,182 @@
+# -----------------------------------------------------------------------------
+# Deadline-bound, hedged calls to the Gemini API.
+# A call that hasn't produced anything after a delay taken from the latency
+# histogram (e.g. its p95) gets a duplicate, and the first one to succeed wins.
+# When streaming, the first attempt to produce text wins and the other one
+# is cancelled, so only the wait for the first byte is ever hedged.
+# -----------------------------------------------------------------------------
+
+import threading, time, requests
+
+def log(text: str, warning: bool = False):
+    print(f"[gemini hedge] {'[Warning]' if warning else ''} {text}")
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    '''
+    Raised when no attempt succeeded within the deadline.
+    '''
+
+class Cancelled(Exception):
+    '''
+    Raised when the caller's cancel event got set.
+    '''
+
+class LatencyHistogram:
+    '''
+    Keeps the most recent latency samples (in seconds) and answers percentiles.
+    '''
+    def __init__(self, maxSamples=512):
+        self.maxSamples = maxSamples
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            if len(self.samples) > self.maxSamples:
+                del self.samples[0]
+
+    def percentile(self, p):
+        '''
+        Returns:
+            float | None: The p-th percentile in seconds, None without samples
+        '''
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def summary(self):
+        '''
+        Returns:
+            dict: Sample count and p50 / p95 / p99 in milliseconds
+        '''
+        result = {'count': len(self)}
+        for p in (50, 95, 99):
+            value = self.percentile(p)
+            result[f'p{p}Ms'] = value * 1000 if value is not None else None
+        return result
+
+class HedgedCall:
+    '''
+    Runs attempt(cancelEvent, onPartial) on daemon threads, hedging and
+    enforcing the deadline from the calling thread.
+    Attempts that lost or were abandoned are told to stop through their cancel event.
+    '''
+    def __init__(self, attempt, deadline, hedgeDelay=None, onPartial=None, cancelEvent=None):
+        '''
+        Args:
+            attempt (callable): Called as attempt(cancelEvent, onPartial), returns the result
+            deadline (float): Seconds until the call gives up
+            hedgeDelay (float): Seconds without any progress after which a duplicate is started, None never hedges
+            onPartial (callable): Receives the partial results of the winning attempt
+            cancelEvent (threading.Event): Cancels the whole call once set
+        '''
+        self.attempt = attempt
+        self.deadline = deadline
+        self.hedgeDelay = hedgeDelay
+        self.onPartial = onPartial
+        self.cancelEvent = cancelEvent
+
+        self.cond = threading.Condition()
+        self.cancelEvents = []
+        self.startTimes = []
+        self.pending = 0
+        self.winner = None
+        self.result = None
+        self.latency = None
+        self.error = None
+        self.streaming = None # attempt that produced partial results first
+        self.firstPartial = None # seconds from its start to its first partial result
+
+    def launch(self):
+        '''
+        Starts another attempt, called with cond held.
+        '''
+        index = len(self.cancelEvents)
+        self.cancelEvents.append(threading.Event())
+        self.startTimes.append(time.perf_counter())
+        self.pending += 1
+        threading.Thread(target=self.runAttempt, args=(index,), daemon=True).start()
+
+    def runAttempt(self, index):
+        try:
+            result, error = self.attempt(self.cancelEvents[index], lambda partial: self.onAttemptPartial(index, partial)), None
+        except Exception as e:
+            result, error = None, e
+        with self.cond:
+            self.pending -= 1
+            if error is None and self.winner is None:
+                self.winner = index
+                self.result = result
+                self.latency = time.perf_counter() - self.startTimes[index]
+            elif error is not None and not self.cancelEvents[index].is_set():
+                self.error = error
+            self.cond.notify_all()
+
+    def onAttemptPartial(self, index, partial):
+        with self.cond:
+            if self.streaming is None:
+                self.streaming = index
+                self.firstPartial = time.perf_counter() - self.startTimes[index]
+                self.cancelOthers(index)
+                self.cond.notify_all()
+            if self.streaming != index:
+                return
+        if self.onPartial:
+            self.onPartial(partial)
+
+    def cancelOthers(self, keep=None):
+        for index, event in enumerate(self.cancelEvents):
+            if index != keep:
+                event.set()
+
+    def run(self):
+        '''
+        Returns:
+            tuple[object, float, int]: The result, the latency of the winning attempt
+                                       (to its first partial result if there was one), and how many attempts ran
+
+        Raises:
+            DeadlineExceeded: If nothing succeeded in time
+            Cancelled: If the caller's cancel event got set
+            Exception: Whatever the last failed attempt raised, once none is left
+        '''
+        start = time.monotonic()
+        deadlineAt = start + self.deadline
+        hedgeAt = start + self.hedgeDelay if self.hedgeDelay is not None else None
+
+        with self.cond:
+            self.launch()
+            while True:
+                if self.winner is not None:
+                    self.cancelOthers(self.winner)
+                    latency = self.firstPartial if self.streaming == self.winner else self.latency
+                    if self.winner:
+                        log(f'Hedged attempt won after {latency * 1000:.0f}ms')
+                    return self.result, latency, len(self.cancelEvents)
+
+                now = time.monotonic()
+                if self.cancelEvent and self.cancelEvent.is_set():
+                    self.cancelOthers()
+                    raise Cancelled()
+                if now >= deadlineAt:
+                    self.cancelOthers()
+                    raise DeadlineExceeded(f'No answer within the {self.deadline:g}s deadline')
+                if not self.pending:
+                    raise self.error or Cancelled()
+
+                if hedgeAt is not None and now >= hedgeAt:
+                    hedgeAt = None
+                    if self.streaming is None: # nothing came back yet
+                        log(f'No answer after {self.hedgeDelay * 1000:.0f}ms, sending a hedged request')
+                        self.launch()
+
+                wakeAt = min(deadlineAt, hedgeAt or deadlineAt)
+                if self.cancelEvent:
+                    wakeAt = min(wakeAt, now + .1) # poll the caller's cancel event
+                self.cond.wait(max(0., wakeAt - now))
@@ -1,9 +1,11 @@
 # ----------------------------------------------------------------------------------
-# Helper functions to load confi, getting current path and determine image mime type
+# Helper functions to load confi, getting current path, cache folders and determine image mime type
 # ----------------------------------------------------------------------------------
 
 import os, json
 
+SUPPORTED_EXTS = ['jpg', 'jpeg', 'png', 'webp', 'heic', 'heif']
+
 def loadConfig(file):
     '''
     Load a JSON configuration file.
@@ -31,6 +33,22 @@ def currPath():
     '''
     return os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
+def cachePath(*parts):
+    '''
+    Get (and create) a folder in the app's on-disk cache.
+    The cache lives in ~/.shakespeare-ai/cache unless SHAKESPEARE_CACHE_DIR is set.
+
+    Args:
+        parts (str): Sub folders inside the cache
+
+    Returns:
+        str: The path of the folder
+    '''
+    root = os.environ.get('SHAKESPEARE_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.shakespeare-ai', 'cache')
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
 def determineMimeType(fileName):
     '''
     Determine the MIME type of an image file based on its extension.
@@ -46,9 +64,7 @@ def determineMimeType(fileName):
     if ext == 'jpg':
         return 'image/jpeg'
 
-    supportedExts = ['jpg', 'jpeg', 'png', 'heic', 'heif']
-    
-    if ext not in supportedExts:
+    if ext not in SUPPORTED_EXTS:
         raise Exception(f'Unsupported file extension: {ext}')
     else:
         return f'image/{ext}'
@@ -1,11 +1,157 @@
-# --------------------------------
+# ---------------------------------------------------------------------
 # Encoding image to base64 string
-# --------------------------------
+# Preparing images for upload: decode, cap the longest edge, re-encode
+# ---------------------------------------------------------------------
 
+import os, time, hashlib, tempfile, threading
 from base64 import b64encode
+from . import helpers
+from common import lazyImport
+
+# without Pillow the original file is uploaded as is, both are loaded on first use
+Image = lazyImport('PIL.Image', optional=True)
+ImageOps = lazyImport('PIL.ImageOps', optional=True)
+pillowHeif = lazyImport('pillow_heif', optional=True)
+heifSupported = pillowHeif is not None
+heifRegistered = False
+
+UPLOAD_FORMATS = {'JPEG': ('jpg', 'image/jpeg'), 'WEBP': ('webp', 'image/webp')}
+PREPARED_MAX_BYTES = 200 * 1024 * 1024 # size cap of the prepared images folder
+STALE_TMP_SECONDS = 3600 # leftovers of a crashed re-encode are removed after this
+evictLock = threading.Lock()
+
+def log(text: str, warning: bool = False):
+    print(f"[gemini] {'[Warning]' if warning else ''} {text}")
 
 class ImageHandler:
     @staticmethod
     def encodeImg(imgPath):
         with open(imgPath, 'rb') as imgFile:
-            return b64encode(imgFile.read()).decode('utf-8')
\ No newline at end of file
+            return b64encode(imgFile.read()).decode('utf-8')
+
+    @staticmethod
+    def registerHeif():
+        '''
+        Lets Pillow open HEIC / HEIF files, done on the first one.
+        '''
+        global heifRegistered
+        if not heifRegistered:
+            pillowHeif.register_heif_opener()
+            heifRegistered = True
+
+    @staticmethod
+    def evictPrepared(path, maxBytes=PREPARED_MAX_BYTES):
+        '''
+        Removes the least recently used prepared images until the folder fits in maxBytes,
+        along with stale temporary files.
+
+        Args:
+            path (str): The prepared images folder
+            maxBytes (int): Size cap of the folder
+        '''
+        exts = tuple(f'.{ext}' for ext, _ in UPLOAD_FORMATS.values())
+        with evictLock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(path):
+                try:
+                    stat = entry.stat()
+                    if entry.name.endswith('.tmp'):
+                        if now - stat.st_mtime > STALE_TMP_SECONDS:
+                            os.remove(entry.path)
+                    elif entry.name.endswith(exts):
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except FileNotFoundError: # removed by another process
+                    pass
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, entryPath in sorted(entries):
+                if total <= maxBytes:
+                    break
+                try:
+                    os.remove(entryPath)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    @staticmethod
+    def prepareImg(imgPath, maxEdge=1536, quality=85, fmt='JPEG', cacheMaxBytes=PREPARED_MAX_BYTES):
+        '''
+        Decodes the image, caps its longest edge and re-encodes it for upload.
+        The result is kept in the cache folder, keyed by the source file and the settings,
+        so an image (HEIC in particular) is only ever converted once.
+        Results that aren't smaller than the original aren't kept.
+
+        Args:
+            imgPath (str): The path to the image file
+            maxEdge (int): Longest edge in pixels of the uploaded image
+            quality (int): JPEG / WebP quality
+            fmt (str): 'JPEG' or 'WEBP', anything else is uploaded as JPEG
+            cacheMaxBytes (int): Size cap of the cache folder, least recently used images are evicted past it
+
+        Returns:
+            tuple[str, str, dict]: Path of the file to upload, its MIME type,
+                                   and stats (original / upload size in bytes, latency in ms)
+        '''
+        start = time.perf_counter()
+        fmt = fmt.upper()
+        if fmt not in UPLOAD_FORMATS:
+            log(f'Unsupported upload format {fmt}, using JPEG', warning=True)
+            fmt = 'JPEG'
+        ext, mimeType = UPLOAD_FORMATS[fmt]
+        stat = os.stat(imgPath)
+        stats = {'originalBytes': stat.st_size, 'uploadBytes': stat.st_size, 'latencyMs': 0., 'cached': False}
+
+        isHeif = imgPath.lower().endswith(('.heic', '.heif'))
+        if Image is None or (isHeif and not heifSupported):
+            return imgPath, helpers.determineMimeType(imgPath), stats
+        if isHeif:
+            ImageHandler.registerHeif()
+
+        key = hashlib.sha1(f'{os.path.abspath(imgPath)}|{stat.st_mtime_ns}|{stat.st_size}|'
+                           f'{maxEdge}|{quality}|{fmt}'.encode()).hexdigest()
+        preparedDir = helpers.cachePath('prepared')
+        preparedPath = os.path.join(preparedDir, f'{key}.{ext}')
+
+        try:
+            os.utime(preparedPath) # mark as recently used
+            stats['cached'] = True
+        except FileNotFoundError:
+            # unique per call, GUI jobs and batch workers can prepare the same image at once
+            fd, tmpPath = tempfile.mkstemp(suffix='.tmp', prefix=f'{key}.', dir=preparedDir)
+            os.close(fd)
+            try:
+                with Image.open(imgPath) as img:
+                    img = ImageOps.exif_transpose(img) # bake in the camera orientation
+                    if img.mode not in ('RGB', 'L'):
+                        img = img.convert('RGB')
+                    img.thumbnail((maxEdge, maxEdge), Image.LANCZOS) # only ever shrinks
+                    img.save(tmpPath, fmt, quality=quality, optimize=True)
+                os.replace(tmpPath, preparedPath)
+            except Exception as e:
+                log(f'Could not prepare {imgPath}, uploading the original: {e}', warning=True)
+                return imgPath, helpers.determineMimeType(imgPath), stats
+            finally:
+                if os.path.exists(tmpPath):
+                    os.remove(tmpPath)
+            ImageHandler.evictPrepared(preparedDir, cacheMaxBytes)
+
+        try:
+            uploadBytes = os.path.getsize(preparedPath)
+        except FileNotFoundError: # evicted right away, the cap is smaller than the image
+            return imgPath, helpers.determineMimeType(imgPath), stats
+        if uploadBytes >= stat.st_size and not isHeif: # re-encoding didn't help, don't keep it
+            try:
+                os.remove(preparedPath)
+            except FileNotFoundError:
+                pass
+            uploadPath, mimeType, uploadBytes = imgPath, helpers.determineMimeType(imgPath), stat.st_size
+        else:
+            uploadPath = preparedPath
+
+        stats['uploadBytes'] = uploadBytes
+        stats['latencyMs'] = (time.perf_counter() - start) * 1000
+        log(f"Prepared {os.path.basename(imgPath)}: {stats['originalBytes'] / 1024:.0f} KB -> "
+            f"{uploadBytes / 1024:.0f} KB (saved {(stats['originalBytes'] - uploadBytes) / 1024:.0f} KB) "
+            f"in {stats['latencyMs']:.1f}ms{' (cached)' if stats['cached'] else ''}")
+        return uploadPath, mimeType, stats
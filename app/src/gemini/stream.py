@@ -0,0 +1,74 @@
+# -----------------------------------------------------------------------------
+# Incremental parser for the server-sent events returned by
+# Gemini's streamGenerateContent?alt=sse endpoint.
+# -----------------------------------------------------------------------------
+
+import json
+
+class SSEParser:
+    '''
+    Turns arbitrary slices of an SSE byte stream into complete event payloads.
+    '''
+    def __init__(self):
+        self.buffer = b''
+        self.dataLines = []
+
+    def feed(self, chunk: bytes):
+        '''
+        Consumes a slice of the stream.
+
+        Args:
+            chunk (bytes): Bytes as they came off the socket
+
+        Returns:
+            list[str]: The data payloads of the events completed by this slice
+        '''
+        self.buffer += chunk
+        events = []
+        while True:
+            end = self.buffer.find(b'\n')
+            if end < 0:
+                break
+            line = self.buffer[:end].rstrip(b'\r').decode('utf-8')
+            self.buffer = self.buffer[end + 1:]
+
+            if not line: # blank line dispatches the event
+                if self.dataLines:
+                    events.append('\n'.join(self.dataLines))
+                    self.dataLines = []
+            elif line.startswith('data:'):
+                self.dataLines.append(line[5:].lstrip(' '))
+            # comments (':') and other fields (event, id, retry) are not used by Gemini
+        return events
+
+    def close(self):
+        '''
+        Flushes an event that wasn't terminated by a blank line.
+
+        Returns:
+            list[str]: The remaining payloads
+        '''
+        events = self.feed(b'\n\n') if self.buffer or self.dataLines else []
+        self.buffer = b''
+        return events
+
+def extractText(payload: str):
+    '''
+    Gets the text generated in one streamed GenerateContentResponse.
+
+    Args:
+        payload (str): JSON payload of an SSE event
+
+    Returns:
+        tuple[str, dict | None]: The text and the error object, if Gemini sent one
+    '''
+    response = json.loads(payload)
+    if 'error' in response:
+        return '', response['error']
+
+    texts = []
+    for candidate in response.get('candidates', []):
+        for part in candidate.get('content', {}).get('parts', []):
+            texts.append(part.get('text', ''))
+        break # only the first candidate is used
+    return ''.join(texts), None
@@ -2,18 +2,31 @@
 # This is the main file of the application. 
 # It creates the pyqt application's main window and starts the application.
 # We're no longer running the application from here as we precompiled the source into an executable.
+# Pass --profile-startup to report import times and the time to first paint, see bench/startup.py
 # --------------------------------------------------------------------------------------------------
+import time
+STARTED = time.perf_counter() # before anything heavy is imported
 import sys
-from PyQt5 import QtWidgets
-from sp import ShakespeareWindow
 
 def main():
     '''
     Main function to start the application.
     '''
+    profiler = None
+    if '--profile-startup' in sys.argv:
+        from bench.startup import StartupProfiler
+        profiler = StartupProfiler.fromArgs(sys.argv, STARTED)
+        profiler.install()
+
+    from PyQt5 import QtWidgets # imported here, so the profiler sees them
+    from sp import ShakespeareWindow
+
     app = QtWidgets.QApplication(sys.argv)
     shakespeareWindow = ShakespeareWindow()
+    if profiler:
+        profiler.mark('windowCreated')
+        profiler.watchFirstPaint(app)
     sys.exit(app.exec_()) # Running application's main event loop
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
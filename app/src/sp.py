@@ -3,9 +3,183 @@
 # ------------------------------------------------------------------------------
 
 from PyQt5 import QtWidgets, QtGui, QtCore
-from convai import convai
-from gemini import gemini
-import os, sys
+from common import lazyImport
+import os, sys, math, threading
+from collections import OrderedDict
+
+# the backends pull in grpc, pyaudio, requests & co, load them on first use
+# instead of before the window shows
+convai = lazyImport('convai')
+gemini = lazyImport('gemini')
+
+# ------------------------------------------------------------------------------
+# Image jobs run on a QThreadPool, off the GUI thread.
+# Each job loads the thumbnail and gets gemini's description,
+# reporting back through queued Qt signals.
+# Every job carries an id, so results of superseded jobs can be ignored.
+# ------------------------------------------------------------------------------
+
+class ThumbnailCache:
+    '''
+    Small thread safe LRU cache of the thumbnails shown in the window,
+    so switching back to an image doesn't decode it again.
+    '''
+    def __init__(self, maxEntries=32):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def makeKey(imgPaths, size):
+        '''
+        Key for a selection of images at a thumbnail size, changes when a file does.
+        '''
+        key = [(size.width(), size.height())]
+        for imgPath in imgPaths:
+            stat = os.stat(imgPath)
+            key.append((os.path.abspath(imgPath), stat.st_mtime_ns, stat.st_size))
+        return tuple(key)
+
+    def get(self, key):
+        with self.lock:
+            img = self.entries.get(key)
+            if img is not None:
+                self.entries.move_to_end(key)
+            return img
+
+    def put(self, key, img):
+        with self.lock:
+            self.entries[key] = img
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+
+thumbnailCache = ThumbnailCache()
+
+def readThumbnail(imgPath, size):
+    '''
+    Decodes an image straight at the size it is shown at, instead of decoding
+    it in full and scaling it down (JPEGs are decoded at a reduced scale).
+
+    Args:
+        imgPath (str): The path to the image file
+        size (QtCore.QSize): Size the image has to fit in
+
+    Returns:
+        QtGui.QImage: The image, null if it couldn't be read
+    '''
+    reader = QtGui.QImageReader(imgPath)
+    reader.setAutoTransform(True) # apply the EXIF orientation
+    fullSize = reader.size()
+    if fullSize.isValid():
+        if reader.transformation() & QtGui.QImageIOHandler.TransformationRotate90:
+            fullSize.transpose()
+        scaledSize = fullSize.scaled(size, QtCore.Qt.KeepAspectRatio)
+        if scaledSize.width() < fullSize.width():
+            if reader.transformation() & QtGui.QImageIOHandler.TransformationRotate90:
+                scaledSize.transpose() # the scaled size applies before the rotation
+            reader.setScaledSize(scaledSize)
+    return reader.read()
+
+class ImageJobSignals(QtCore.QObject):
+    '''
+    Signals emitted by an ImageJob, all carrying the job id.
+    '''
+    progress = QtCore.pyqtSignal(int, str)
+    thumbnailReady = QtCore.pyqtSignal(int, QtGui.QImage)
+    partialText = QtCore.pyqtSignal(int, str)
+    finished = QtCore.pyqtSignal(int, str)
+    failed = QtCore.pyqtSignal(int, str)
+
+class ImageJob(QtCore.QRunnable):
+    '''
+    Processes the selected image(s) on a worker thread.
+    Several images are described together, in a single request, as one scene.
+    '''
+    def __init__(self, jobId, imgPaths, thumbSize):
+        '''
+        Args:
+            jobId (int): Id used to tell this job's results apart from newer ones
+            imgPaths (list[str]): The paths to the image files
+            thumbSize (QtCore.QSize): Size the thumbnail has to fit in
+        '''
+        super().__init__()
+        self.jobId = jobId
+        self.imgPaths = imgPaths
+        self.thumbSize = thumbSize
+        self.signals = ImageJobSignals()
+        self.cancelEvent = threading.Event()
+
+    def cancel(self):
+        '''
+        Cancels the job, it stops at the next checkpoint without emitting results.
+        '''
+        self.cancelEvent.set()
+
+    def isCancelled(self):
+        return self.cancelEvent.is_set()
+
+    def run(self):
+        try:
+            count = len(self.imgPaths)
+            self.signals.progress.emit(self.jobId, 'Loading image...' if count == 1 else f'Loading {count} images...')
+            img = self.loadThumbnail()
+            if img is None:
+                self.signals.failed.emit(self.jobId, 'Could not load the image')
+                return
+            if self.isCancelled():
+                return
+            self.signals.thumbnailReady.emit(self.jobId, img)
+
+            self.signals.progress.emit(self.jobId, 'Shakespeare is looking at the image...' if count == 1
+                                                   else f'Shakespeare is looking at the {count} images...')
+            geminiResponse = gemini.getCombinedResponse(self.imgPaths, self.onPartial, self.cancelEvent)
+            if self.isCancelled():
+                return
+            self.signals.finished.emit(self.jobId, geminiResponse)
+        except gemini.GeminiCancelled:
+            pass
+        except Exception as e:
+            self.signals.failed.emit(self.jobId, str(e))
+
+    def loadThumbnail(self):
+        '''
+        Decodes the image at the thumbnail size, several images are tiled into a grid.
+        Thumbnails are kept in the thumbnail cache.
+
+        Returns:
+            QtGui.QImage | None: The thumbnail, None if an image couldn't be loaded
+        '''
+        key = ThumbnailCache.makeKey(self.imgPaths, self.thumbSize)
+        sheet = thumbnailCache.get(key)
+        if sheet is not None:
+            return sheet
+
+        cols = math.ceil(math.sqrt(len(self.imgPaths)))
+        rows = math.ceil(len(self.imgPaths) / cols)
+        cell = QtCore.QSize(self.thumbSize.width() // cols, self.thumbSize.height() // rows)
+        imgs = [readThumbnail(imgPath, cell) for imgPath in self.imgPaths]
+        if any(img.isNull() for img in imgs):
+            return None
+
+        if len(imgs) == 1:
+            sheet = imgs[0]
+        else:
+            sheet = QtGui.QImage(self.thumbSize, QtGui.QImage.Format_ARGB32)
+            sheet.fill(QtCore.Qt.transparent)
+            painter = QtGui.QPainter(sheet)
+            for i, img in enumerate(imgs):
+                img = img.scaled(cell, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation) # no-op unless upscaling
+                x = (i % cols) * cell.width() + (cell.width() - img.width()) // 2
+                y = (i // cols) * cell.height() + (cell.height() - img.height()) // 2
+                painter.drawImage(x, y, img)
+            painter.end()
+        thumbnailCache.put(key, sheet)
+        return sheet
+
+    def onPartial(self, text):
+        if not self.isCancelled():
+            self.signals.partialText.emit(self.jobId, text)
 
 # ------------------------------------------------------------------------------
 # The ShakespeareWindow class is used to create 
@@ -25,6 +199,11 @@ class ShakespeareWindow(QtWidgets.QMainWindow):
         '''
         super().__init__()
         self.convaiBackend = None
+        self.imgJob = None
+        self.imgJobId = 0
+        self.imgPool = QtCore.QThreadPool(self) # superseded jobs may still be finishing their http calls
+        self.imgPool.setMaxThreadCount(4)
+        self.isPainted = False
         self.initUI()     
 
     def initUI(self):
@@ -44,7 +223,7 @@ class ShakespeareWindow(QtWidgets.QMainWindow):
         self.setWindowTitle('Shakespeare AI')
         basePath = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
         self.setWindowIcon(QtGui.QIcon(os.path.join(basePath, 'misc/sp_logo.png')))
-        self.setFixedSize(400, 500)
+        self.setFixedSize(400, 600)
         self.show()
 
     def initLayouts(self):
@@ -70,7 +249,7 @@ class ShakespeareWindow(QtWidgets.QMainWindow):
         self.btnLayout = QtWidgets.QHBoxLayout()
         self.mainLayout.addLayout(self.btnLayout)
 
-        self.selectImgBtn = QtWidgets.QPushButton('Select Image')
+        self.selectImgBtn = QtWidgets.QPushButton('Select Images')
         self.btnLayout.addWidget(self.selectImgBtn)
         self.selectImgBtn.clicked.connect(self.selectImg)
 
@@ -98,7 +277,13 @@ class ShakespeareWindow(QtWidgets.QMainWindow):
         self.imgLabel.setAlignment(QtCore.Qt.AlignCenter)
         self.imgLabel.setScaledContents(False)
 
+        self.descText = QtWidgets.QPlainTextEdit()
+        self.descText.setReadOnly(True)
+        self.descText.setFixedHeight(90)
+        self.descText.setPlaceholderText("Gemini's take on the image shows up here")
+
         self.imgGb.layout().addWidget(self.imgLabel)
+        self.imgGb.layout().addWidget(self.descText)
         self.mainLayout.addWidget(self.imgGb)
 
     def initStatusBar(self):
@@ -111,34 +296,116 @@ class ShakespeareWindow(QtWidgets.QMainWindow):
 
     def selectImg(self):
         '''
-        Opens a file dialog to select an image.
+        Opens a file dialog to select one or more images,
+        several images are described together as one scene.
         '''
         try:
-            fName, _ = QtWidgets.QFileDialog.getOpenFileName(self, 'Select Image', '',
-                                                        'Images (*.jpg *.jpeg *.png *.heic *.heif)')
-            if fName:
-                self.processImg(fName)
+            fNames, _ = QtWidgets.QFileDialog.getOpenFileNames(self, 'Select Images', '',
+                                                        'Images (*.jpg *.jpeg *.png *.webp *.heic *.heif)')
+            if fNames:
+                self.processImg(fNames)
         except Exception as e:
             print(f"An error occurred while selecting an image: {e}")
 
-    def processImg(self, imgPath):
+    def processImg(self, imgPaths):
         '''
-        Loads, displays the image and gets the response from the gemini backend.
-        Then appends the response generated by gemini to the character's context window.
+        Starts a job that loads, displays the image(s) and gets the response from the gemini backend,
+        showing the text as it streams in.
+        The response of the latest image is then synced to the character's context window.
+        A job still running for a previously selected image is cancelled.
         '''
         try:
-            pixmap = QtGui.QPixmap(imgPath)
-
-            if not pixmap.isNull():
-                pixmap = pixmap.scaled(self.imgLabel.size(), QtCore.Qt.KeepAspectRatio,
-                                    QtCore.Qt.SmoothTransformation)
-                self.imgLabel.setPixmap(pixmap)
-                self.geminiResponse = gemini.getGeminiResponse(imgPath)
-                self.showMsg('Talk to Shakespeare about this image!')
-                convai.appendToCharBackstory(self.geminiResponse)
+            if self.imgJob:
+                self.imgJob.cancel()
+
+            self.imgJobId += 1
+            if isinstance(imgPaths, str):
+                imgPaths = [imgPaths]
+            self.imgJob = ImageJob(self.imgJobId, imgPaths, self.imgLabel.size())
+            self.imgJob.signals.progress.connect(self.onImgJobProgress)
+            self.imgJob.signals.thumbnailReady.connect(self.onThumbnailReady)
+            self.imgJob.signals.partialText.connect(self.showPartialDesc)
+            self.imgJob.signals.finished.connect(self.onImgJobFinished)
+            self.imgJob.signals.failed.connect(self.onImgJobFailed)
+
+            try: # show a thumbnail we already have right away
+                cached = thumbnailCache.get(ThumbnailCache.makeKey(imgPaths, self.imgLabel.size()))
+            except OSError:
+                cached = None
+            if cached is not None:
+                self.imgLabel.setPixmap(QtGui.QPixmap.fromImage(cached))
+
+            self.descText.clear()
+            self.imgPool.start(self.imgJob)
         except Exception as e:
             print(f"An error occurred while processing the image: {e}")
 
+    def isCurrentImgJob(self, jobId):
+        '''
+        Results of jobs that were superseded by a newer selection are ignored.
+        '''
+        return self.imgJob is not None and jobId == self.imgJobId
+
+    def onImgJobProgress(self, jobId, msg):
+        if self.isCurrentImgJob(jobId):
+            self.showMsg(msg)
+
+    def onThumbnailReady(self, jobId, img):
+        if self.isCurrentImgJob(jobId):
+            self.imgLabel.setPixmap(QtGui.QPixmap.fromImage(img))
+
+    def showPartialDesc(self, jobId, text):
+        '''
+        Shows the part of gemini's response received so far.
+        '''
+        if not self.isCurrentImgJob(jobId):
+            return
+        self.descText.setPlainText(text)
+        self.descText.verticalScrollBar().setValue(self.descText.verticalScrollBar().maximum())
+
+    def onImgJobFinished(self, jobId, geminiResponse):
+        if not self.isCurrentImgJob(jobId):
+            return
+        self.geminiResponse = geminiResponse
+        self.descText.setPlainText(geminiResponse)
+        convai.BackstorySync.getInstance().submit(geminiResponse)
+        self.showMsg('Talk to Shakespeare about this image!')
+
+    def onImgJobFailed(self, jobId, error):
+        if self.isCurrentImgJob(jobId):
+            print(f"An error occurred while processing the image: {error}")
+            self.showMsg('Could not process the image, try another one!')
+
+    def paintEvent(self, event):
+        '''
+        Starts the convai backend's warm up once the window was painted for the first time.
+        '''
+        super().paintEvent(event)
+        if not self.isPainted:
+            self.isPainted = True
+            QtCore.QTimer.singleShot(0, self.warmUpConvai)
+
+    def warmUpConvai(self):
+        '''
+        Creates the convai backend and lets it bring up audio, A2F and gRPC
+        in the background, so the first click on "Start Talking" doesn't wait for them.
+        '''
+        try:
+            self.convaiBackend = convai.ConvaiBackend.getInstance()
+            self.connectEventsToConvai()
+            self.convaiBackend.warmUp()
+        except Exception as e:
+            print(f"An error occurred while starting the convai backend: {e}")
+
+    def onConvaiReady(self, results):
+        '''
+        Reports the outcome of the backend warm up.
+        '''
+        if not results.get('audio'):
+            return # errorSignal already told the user
+        self.showMsg('Shakespeare is ready, connected to Audio2Face!' if results.get('a2f')
+                     else 'Shakespeare is ready, Audio2Face not found so audio plays locally')
+
     def onConvaiBtnClick(self):
         '''
         Connects the window to the convai backend upon button click.
@@ -165,6 +432,7 @@ class ShakespeareWindow(QtWidgets.QMainWindow):
         self.convaiBackend.stateChangeSignal.connect(self.handleConvaiStateChange)
         self.convaiBackend.errorSignal.connect(self.showMsg)
         self.convaiBackend.isSendingAudSignal.connect(self.updateStopButtonState)
+        self.convaiBackend.readySignal.connect(self.onConvaiReady)
 
     def handleConvaiStateChange(self, isTalking):
         if isTalking:
@@ -202,6 +470,11 @@ class ShakespeareWindow(QtWidgets.QMainWindow):
         QLabel {
             color: white;
         }
+        QPlainTextEdit {
+            background-color: #282829;
+            color: white;
+            border: 1px solid #555555;
+        }
         QGroupBox {
             border: 1px solid #555555;
             margin-top: 10px;
@@ -0,0 +1,7 @@
+# Run from app/src:
+#   python -m unittest tests
+from .test_jitterbuffer import *
+from .test_wavreader import *
+from .test_ringbuffer import *
+from .test_sseparser import *
+from .test_a2fconnection import *
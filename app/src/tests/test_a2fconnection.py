@@ -0,0 +1,65 @@
+import socket, struct, time, unittest
+from convai.a2fconnection import A2FConnection
+
+SAMPLE_RATE = 100 # 2 bytes per 10ms, coarse enough that the test's own run time doesn't matter
+
+def readFrames(sock):
+    '''
+    Reads what was sent as (sampleRate, pcm) tuples.
+    '''
+    sock.settimeout(.1)
+    data = b''
+    try:
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        pass
+    frames = []
+    while data:
+        length = struct.unpack('>i', data[:4])[0]
+        sampleRate, pcm = data[4:8], data[9:4 + length]
+        frames.append((struct.unpack('>i', sampleRate)[0], pcm))
+        data = data[4 + length:]
+    return frames
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.connection = A2FConnection()
+        self.connection.audSocket, self.server = socket.socketpair()
+
+    def tearDown(self):
+        self.connection.audSocket.close()
+        self.server.close()
+
+    def startUtterance(self, chunks, sentChunks, playedSeconds):
+        self.connection.utterance = [(bytes(range(2 * 20)), SAMPLE_RATE) for _ in range(chunks)] # 200ms each
+        self.connection.sentChunks = sentChunks
+        self.connection.utteranceStart = None if playedSeconds is None else time.perf_counter() - playedSeconds
+
+    def test_trims_what_was_played(self):
+        self.startUtterance(2, 2, .25)
+        interrupted = self.connection.utteranceStart
+        self.connection.replay()
+        self.assertEqual(readFrames(self.server), [(SAMPLE_RATE, bytes(range(10, 40)))])
+        self.assertEqual(self.connection.sentChunks, 1)
+        self.assertGreater(self.connection.utteranceStart, interrupted) # the new server starts playing from here
+
+    def test_never_counts_unsent_audio_as_played(self):
+        self.startUtterance(2, 1, 10.)
+        self.connection.replay()
+        self.assertEqual(readFrames(self.server), [(SAMPLE_RATE, bytes(range(40)))])
+
+    def test_replays_everything_if_nothing_was_sent(self):
+        self.startUtterance(2, 0, None)
+        self.connection.replay()
+        self.assertEqual(len(readFrames(self.server)), 2)
+        self.assertAlmostEqual(self.connection.stats['replayedMs'], 400)
+
+    def test_nothing_left_to_replay(self):
+        self.startUtterance(1, 1, 5.)
+        self.connection.replay()
+        self.assertEqual(readFrames(self.server), [])
+        self.assertEqual(self.connection.utterance, [])
@@ -0,0 +1,48 @@
+import unittest
+from convai.jitterbuffer import JitterBuffer
+
+SAMPLE_RATE = 1000 # 2 bytes per ms
+
+def chunk(ms):
+    return bytes(2 * ms)
+
+class TestJitterBuffer(unittest.TestCase):
+    def setUp(self):
+        self.buffer = JitterBuffer(minStartMs=150, maxTargetMs=1000)
+
+    def test_holds_back_until_the_start_threshold(self):
+        self.buffer.put(chunk(100), SAMPLE_RATE, False)
+        self.assertIsNone(self.buffer.get(timeout=0))
+
+        self.buffer.put(chunk(100), SAMPLE_RATE, False)
+        pcm, sampleRate, isFinal = self.buffer.get(timeout=0)
+        self.assertEqual((len(pcm), sampleRate, isFinal), (200, SAMPLE_RATE, False))
+
+    def test_final_chunk_is_released_below_the_threshold(self):
+        self.buffer.put(chunk(50), SAMPLE_RATE, True)
+        self.assertTrue(self.buffer.get(timeout=0)[2])
+        self.assertEqual(self.buffer.getStats()['utterances'], 1)
+
+    def test_next_utterance_rebuffers_even_with_leftovers(self):
+        self.buffer.put(chunk(200), SAMPLE_RATE, True)
+        self.buffer.put(chunk(50), SAMPLE_RATE, False) # start of the next utterance
+        self.assertTrue(self.buffer.get(timeout=0)[2])
+
+        self.assertIsNone(self.buffer.get(timeout=0))
+        self.buffer.put(chunk(200), SAMPLE_RATE, False)
+        self.assertEqual(len(self.buffer.get(timeout=0)[0]), 100)
+
+    def test_flush_drops_everything(self):
+        for _ in range(3):
+            self.buffer.put(chunk(100), SAMPLE_RATE, False)
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertIsNone(self.buffer.get(timeout=0))
+
+        stats = self.buffer.getStats()
+        self.assertEqual(stats['chunks'], 3)
+        self.assertEqual(stats['depthMs'], 0)
+        self.assertAlmostEqual(stats['maxDepthMs'], 300)
+
+    def test_target_stays_within_its_bounds(self):
+        self.buffer.configure(200, 100)
+        self.assertAlmostEqual(self.buffer.getStats()['targetMs'], 200)
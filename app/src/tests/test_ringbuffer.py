@@ -0,0 +1,40 @@
+import threading, unittest
+from convai.localaudioplayer import RingBuffer
+
+class TestRingBuffer(unittest.TestCase):
+    def test_wraps_around(self):
+        ring = RingBuffer(8)
+        self.assertEqual(ring.write(b'abcdef'), 6)
+        self.assertEqual(ring.read(4), b'abcd')
+        self.assertEqual(ring.write(b'ghijk'), 5) # wraps past the end
+        self.assertEqual(len(ring), 7)
+        self.assertEqual(ring.read(100), b'efghijk')
+        self.assertEqual(ring.read(1), b'')
+
+    def test_write_times_out_when_full(self):
+        ring = RingBuffer(4)
+        self.assertEqual(ring.write(b'abcdef', timeout=.01), 4)
+
+    def test_clear_abandons_a_blocked_write(self):
+        ring = RingBuffer(4)
+        written = []
+        writer = threading.Thread(target=lambda: written.append(ring.write(b'abcdefgh')))
+        writer.start()
+        while len(ring) < 4:
+            pass
+        ring.clear()
+        writer.join(timeout=1)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(written, [4])
+        self.assertEqual(len(ring), 0)
+
+    def test_clear_starts_a_new_generation(self):
+        ring = RingBuffer(8)
+        ring.write(b'abcd')
+        ring.read(2)
+        self.assertTrue(ring.waitForReader(timeout=0))
+
+        ring.clear()
+        self.assertFalse(ring.waitForReader(timeout=0)) # the reader hasn't seen the clear yet
+        self.assertEqual(ring.read(2), b'')
+        self.assertTrue(ring.waitForReader(timeout=0))
@@ -0,0 +1,23 @@
+import unittest
+from gemini.stream import SSEParser
+
+class TestSSEParser(unittest.TestCase):
+    def test_events_split_across_slices(self):
+        parser = SSEParser()
+        self.assertEqual(parser.feed(b'data: {"a"'), [])
+        self.assertEqual(parser.feed(b': 1}\n'), [])
+        self.assertEqual(parser.feed(b'\ndata: 2\n\n'), ['{"a": 1}', '2'])
+
+    def test_multi_line_data_and_crlf(self):
+        parser = SSEParser()
+        self.assertEqual(parser.feed(b'data: first\r\ndata:second\r\n\r\n'), ['first\nsecond'])
+
+    def test_comments_and_other_fields_are_ignored(self):
+        parser = SSEParser()
+        self.assertEqual(parser.feed(b': keep-alive\n\nevent: message\nid: 3\ndata: x\n\n'), ['x'])
+
+    def test_close_flushes_an_unterminated_event(self):
+        parser = SSEParser()
+        self.assertEqual(parser.feed(b'data: last'), [])
+        self.assertEqual(parser.close(), ['last'])
+        self.assertEqual(parser.close(), [])
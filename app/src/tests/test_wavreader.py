@@ -0,0 +1,53 @@
+import struct, unittest
+from convai import wavreader
+from convai.wavreader import WavFormatError
+
+def fmtChunk(formatTag=1, channels=1, sampleRate=22050, bitsPerSample=16, blockAlign=None):
+    blockAlign = channels * bitsPerSample // 8 if blockAlign is None else blockAlign
+    body = struct.pack('<HHIIHH', formatTag, channels, sampleRate, sampleRate * blockAlign, blockAlign, bitsPerSample)
+    return b'fmt ' + struct.pack('<I', len(body)) + body
+
+def dataChunk(pcm, size=None):
+    return b'data' + struct.pack('<I', len(pcm) if size is None else size) + pcm
+
+def riff(*chunks):
+    body = b'WAVE' + b''.join(chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+class TestWavReader(unittest.TestCase):
+    def test_reads_pcm_payload(self):
+        fmt, pcm = wavreader.readPcm(riff(fmtChunk(), dataChunk(b'\x01\x02' * 4)), 16000)
+        self.assertEqual((fmt.sampleRate, fmt.channels, fmt.sampleWidth), (22050, 1, 2))
+        self.assertEqual(bytes(pcm), b'\x01\x02' * 4)
+
+    def test_skips_unknown_and_odd_sized_chunks(self):
+        data = riff(fmtChunk(), b'LIST' + struct.pack('<I', 3) + b'abc\x00', dataChunk(b'\x00\x01'))
+        self.assertEqual(bytes(wavreader.parseWav(data)[1]), b'\x00\x01')
+
+    def test_streaming_size_takes_the_rest(self):
+        data = riff(fmtChunk(), dataChunk(b'\x00' * 10, size=0xFFFFFFFF))
+        self.assertEqual(len(wavreader.parseWav(data)[1]), 10)
+
+    def test_partial_frame_is_dropped(self):
+        data = riff(fmtChunk(channels=2), dataChunk(b'\x00' * 6))
+        self.assertEqual(len(wavreader.parseWav(data)[1]), 4)
+
+    def test_raw_pcm_without_header(self):
+        fmt, pcm = wavreader.readPcm(b'\x00' * 7, 16000)
+        self.assertEqual(fmt.sampleRate, 16000)
+        self.assertEqual(len(pcm), 6)
+
+    def test_malformed_files_raise(self):
+        cases = {
+            'missing header': b'RIFX' + bytes(40),
+            'truncated fmt': riff(b'fmt ' + struct.pack('<I', 16) + bytes(8)),
+            'not pcm': riff(fmtChunk(formatTag=3), dataChunk(b'\x00' * 4)),
+            'inconsistent fmt': riff(fmtChunk(blockAlign=4), dataChunk(b'\x00' * 4)),
+            'data before fmt': riff(dataChunk(b'\x00' * 4), fmtChunk()),
+            'truncated data': riff(fmtChunk(), dataChunk(b'\x00' * 4, size=100)),
+            'no data': riff(fmtChunk())
+        }
+        for name, data in cases.items():
+            with self.subTest(name):
+                with self.assertRaises(WavFormatError):
+                    wavreader.parseWav(data)
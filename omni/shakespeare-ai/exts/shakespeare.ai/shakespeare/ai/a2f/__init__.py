@@ -1 +1,8 @@
+import os, sys
+
+# the generated gRPC modules import each other absolutely, so their directory has to be on the path
+if os.path.dirname(os.path.abspath(__file__)) not in sys.path:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
 from .server import *
+from .aioserver import *
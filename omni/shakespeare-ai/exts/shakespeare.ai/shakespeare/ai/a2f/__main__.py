@@ -0,0 +1,75 @@
+# --------------------------------------------------------------------------------------------------
+# Headless Audio2Face bridge, the same socket server the extension starts, without Omniverse.
+# From shakespeare/ai:
+#   python -m a2f [--host 0.0.0.0] [--audio-port 65432] [--control-port 65433]
+#                 [--a2f-url localhost:50051] [--instance /World/LazyGraph/PlayerStreaming]
+#                 [--mode threads|asyncio] [--standin [--record streams.json]]
+# --standin serves the local Audio2Face stand-in on --a2f-url as well, for load tests without A2F.
+# --------------------------------------------------------------------------------------------------
+
+import argparse, asyncio, signal
+from .server import A2F_URL, A2F_INSTANCE, HOST, AUD_PORT, CNTRL_PORT, startA2FServer, stopA2FServer, log, socketServerSource
+from .aioserver import AioA2FServer
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='Headless Audio2Face socket bridge')
+    parser.add_argument('--host', default=HOST, help='Host the sockets listen on, 0.0.0.0 to accept remote clients')
+    parser.add_argument('--audio-port', type=int, default=AUD_PORT)
+    parser.add_argument('--control-port', type=int, default=CNTRL_PORT)
+    parser.add_argument('--a2f-url', default=A2F_URL, help='gRPC endpoint of Audio2Face')
+    parser.add_argument('--instance', default=A2F_INSTANCE, help='Audio2Face streaming audio player to push to')
+    parser.add_argument('--mode', choices=('threads', 'asyncio'), default='asyncio')
+    parser.add_argument('--standin', action='store_true', help='Serve the Audio2Face stand-in on --a2f-url too')
+    parser.add_argument('--record', help='With --standin, write the received streams to this JSON file on exit')
+    return parser.parse_args(argv)
+
+def runThreads(serverArgs):
+    stopEvent, serverThread = startA2FServer(**serverArgs)
+    signal.signal(signal.SIGTERM, lambda *_: stopEvent.set())
+    try:
+        while not stopEvent.wait(1): # the timeout only lets Ctrl+C through on Windows
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopA2FServer(stopEvent, serverThread)
+
+async def runAsyncio(serverArgs):
+    aioServer = AioA2FServer(**serverArgs)
+    await aioServer.start()
+    stopped = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+    except NotImplementedError: # Windows, Ctrl+C still cancels us
+        pass
+    try:
+        await stopped.wait()
+    finally:
+        await aioServer.stop()
+
+def main(argv=None):
+    args = parseArgs(argv)
+    serverArgs = dict(url=args.a2f_url, instanceName=args.instance, host=args.host,
+                      audPort=args.audio_port, cntrlPort=args.control_port)
+
+    grpcServer = standIn = None
+    if args.standin:
+        from .standin import serveStandIn
+        grpcServer, standIn, _ = serveStandIn(args.a2f_url)
+
+    log(f'Bridging {args.host}:{args.audio_port}/{args.control_port} to {args.a2f_url} ({args.mode})', source=socketServerSource)
+    try:
+        if args.mode == 'asyncio':
+            try:
+                asyncio.run(runAsyncio(serverArgs))
+            except KeyboardInterrupt:
+                pass
+        else:
+            runThreads(serverArgs)
+    finally:
+        if grpcServer:
+            grpcServer.stop(0)
+            standIn.save(args.record)
+
+if __name__ == '__main__':
+    main()
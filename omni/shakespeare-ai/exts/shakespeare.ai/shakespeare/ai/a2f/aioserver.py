@@ -0,0 +1,248 @@
+# --------------------------------------------------------------------------------------------------
+# Audio2Face Socket Server on asyncio
+# Same protocol as server.py, but hosted as coroutines on the event loop it's started from
+# (Kit's loop in the extension) instead of on a handful of Python threads.
+# Nothing competes with Kit's update loop for the GIL, the bridge just runs in between frames.
+# --------------------------------------------------------------------------------------------------
+
+import asyncio, struct, time
+import grpc
+import audio2face_pb2, audio2face_pb2_grpc
+from .server import A2FClient, parseAudMessage, A2F_URL, A2F_INSTANCE, HOST, AUD_PORT, CNTRL_PORT, log, socketServerSource
+
+# --------------------------------------------------------------------------------------------------
+# Audio2Face Client streaming over grpc.aio, the audio processing is shared with A2FClient
+# --------------------------------------------------------------------------------------------------
+
+class AioA2FClient(A2FClient):
+    '''
+    A client for streaming audio data to the Audio2Face server from a coroutine.
+    Has to be used from the event loop it was created on.
+    '''
+    def __init__(self, url, instanceName):
+        super().__init__(url, instanceName)
+        self.streamTask = None
+        self.dataEvent = asyncio.Event() # set whenever audio is appended, so the stream never polls
+
+    def createStub(self):
+        self.channel = grpc.aio.insecure_channel(self.url)
+        self.stub = audio2face_pb2_grpc.Audio2FaceStub(self.channel)
+
+    def appendAudData(self, audData, sampleRate):
+        super().appendAudData(audData, sampleRate)
+        self.dataEvent.set()
+
+    def startStreaming(self):
+        '''
+        Starts the audio streaming task.
+        '''
+        if self.isStreaming:
+            return
+        self.isStreaming = True
+        self.stopEvent.clear()
+        self.streamTask = asyncio.ensure_future(self.streamAud())
+
+    async def streamAud(self):
+        '''
+        Streams audio data to the Audio2Face server in chunks.
+        '''
+        async def generateAudChunks():
+            '''
+            To yield audio chunks to the server.
+            '''
+            yield self.startMarker()
+
+            while not self.stopEvent.is_set():
+                with self.lock:
+                    audChunk = self.takeChunk()
+
+                if audChunk:
+                    yield audio2face_pb2.PushAudioStreamRequest(audio_data=self.toA2FAudio(audChunk))
+                    await asyncio.sleep(self.chunkDuration - .1)
+                else:
+                    self.dataEvent.clear()
+                    await self.dataEvent.wait()
+
+            yield audio2face_pb2.PushAudioStreamRequest(audio_data=b'') # end marker
+
+        try:
+            response = await self.stub.PushAudioStream(generateAudChunks())
+            if response.success:
+                log('Audio stream completed successfully')
+            else:
+                log(f'Error in audio stream: {response.message}', warning=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f'Error during audio streaming: {e}', warning=True)
+        finally:
+            self.isStreaming = False
+
+    def stopStreaming(self):
+        '''
+        Stops the audio stream and clears the accumulated audio buffer.
+        The stream sends its end marker on the next loop iteration.
+        '''
+        if not self.isStreaming:
+            return
+
+        log('Stopping audio stream...')
+        self.stopEvent.set()
+        self.dataEvent.set()
+        self.isStreaming = False
+        self.accAud.clear()
+        log('Audio stream stopped')
+
+    async def close(self):
+        '''
+        Stops streaming and closes the channel.
+        '''
+        self.stopStreaming()
+        if self.streamTask and not self.streamTask.done():
+            try:
+                await asyncio.wait_for(self.streamTask, timeout=1)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+        await self.channel.close()
+
+# --------------------------------------------------------------------------------------------------
+# The socket server itself
+# --------------------------------------------------------------------------------------------------
+
+class AioA2FServer:
+    '''
+    The Audio2Face socket server, as coroutines on the running event loop.
+    '''
+    def __init__(self, url=A2F_URL, instanceName=A2F_INSTANCE,
+                 host=HOST, audPort=AUD_PORT, cntrlPort=CNTRL_PORT):
+        '''
+        Args:
+            url (str): The URL of the Audio2Face server
+            instanceName (str): The name of Audio2Face instance to stream audio to
+            host (str): Host the sockets listen on
+            audPort (int): Port of the audio socket
+            cntrlPort (int): Port of the control socket
+        '''
+        self.url = url
+        self.instanceName = instanceName
+        self.host = host
+        self.audPort = audPort
+        self.cntrlPort = cntrlPort
+        self.a2fClient = None
+        self.servers = []
+        self.clientTasks = set()
+
+    async def start(self):
+        '''
+        Creates the Audio2Face client and starts listening on both sockets.
+        '''
+        self.a2fClient = AioA2FClient(self.url, self.instanceName)
+        self.servers = [
+            await asyncio.start_server(self.handleAudClient, self.host, self.audPort, reuse_address=True),
+            await asyncio.start_server(self.handleCntrlClient, self.host, self.cntrlPort, reuse_address=True)
+        ]
+        log(f'Waiting for an audio connection on {self.host}:{self.audPort}', source=socketServerSource)
+        log(f'Waiting for a control connection on {self.host}:{self.cntrlPort}', source=socketServerSource)
+
+    def close(self):
+        '''
+        Stops listening and cancels every client without waiting for them.
+        '''
+        for listenServer in self.servers:
+            listenServer.close()
+        for task in self.clientTasks:
+            task.cancel()
+        if self.a2fClient:
+            self.a2fClient.stopStreaming()
+
+    async def stop(self):
+        '''
+        Stops the server and waits for it to wind down.
+
+        Returns:
+            float: Seconds it took the server to stop
+        '''
+        start = time.perf_counter()
+        log('Stopping server...', source=socketServerSource)
+        self.close()
+        for listenServer in self.servers:
+            await listenServer.wait_closed()
+        await asyncio.gather(*self.clientTasks, return_exceptions=True)
+        if self.a2fClient:
+            await self.a2fClient.close()
+        self.servers = []
+        log('Server stopped', source=socketServerSource)
+        return time.perf_counter() - start
+
+    def trackClient(self):
+        task = asyncio.current_task()
+        self.clientTasks.add(task)
+        task.add_done_callback(self.clientTasks.discard)
+
+    async def handleCntrlClient(self, reader, writer):
+        '''
+        Handles comms with the control client.
+
+        Args:
+            reader (asyncio.StreamReader): Reads from the control connection
+            writer (asyncio.StreamWriter): Writes to the control connection
+        '''
+        self.trackClient()
+        log(f"Control connection established with {writer.get_extra_info('peername')}", source=socketServerSource)
+        try:
+            while True:
+                data = await reader.readexactly(4)
+                if data == b'stop': # hax
+                    log('Received stop command', source=socketServerSource)
+                    if self.a2fClient.isStreaming:
+                        self.a2fClient.stopStreaming()
+                    writer.write(b'stopped')
+                elif data == b'ping': # heartbeat, the client measures the round trip time
+                    writer.write(b'pong')
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            log(f'Control client error: {e}', warning=True, source=socketServerSource)
+        finally:
+            writer.close()
+
+    async def handleAudClient(self, reader, writer):
+        '''
+        Handles comms with the audio client.
+
+        Args:
+            reader (asyncio.StreamReader): Reads from the audio connection
+            writer (asyncio.StreamWriter): Writes to the audio connection
+        '''
+        self.trackClient()
+        log(f"Audio connection established with {writer.get_extra_info('peername')}", source=socketServerSource)
+        try:
+            while True:
+                try:
+                    msgLenData = await reader.readexactly(4) # read message length
+                except asyncio.IncompleteReadError:
+                    log('Client disconnected', source=socketServerSource)
+                    break
+                msgLen = struct.unpack('>i', msgLenData)[0]
+
+                log(f'Receiving message of length: {msgLen}', source=socketServerSource)
+
+                try:
+                    data = await reader.readexactly(msgLen)
+                except asyncio.IncompleteReadError:
+                    log('Connection closed before receiving complete message', source=socketServerSource)
+                    break
+
+                sr, audData = parseAudMessage(data)
+
+                log(f'Received audio data: length={len(audData)}, sr={sr}', source=socketServerSource)
+
+                self.a2fClient.appendAudData(audData, sr)
+
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            log(f'Error receiving audio data: {e}', warning=True, source=socketServerSource)
+        finally:
+            writer.close()
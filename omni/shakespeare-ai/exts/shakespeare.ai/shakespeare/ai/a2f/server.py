@@ -2,7 +2,7 @@
 # Audio2Face Socket Server
 # --------------------------------------------------------------------------------------------------
 
-import grpc, struct, socket, threading, time
+import grpc, struct, socket, select, threading, time
 import audio2face_pb2, audio2face_pb2_grpc
 import numpy as np
 from pydub import AudioSegment
@@ -29,8 +29,7 @@ class A2FClient:
         '''
         self.url = url
         self.instanceName = instanceName
-        self.channel = grpc.insecure_channel(url)
-        self.stub = audio2face_pb2_grpc.Audio2FaceStub(self.channel)
+        self.createStub()
         self.channels = 1
         self.sampleWidth = 2 
         self.accAud = bytearray() # using bytearray to avoid memory fragmentation
@@ -41,6 +40,13 @@ class A2FClient:
         self.chunkDuration = .3
         self.stopEvent = threading.Event()
 
+    def createStub(self):
+        '''
+        Creates the gRPC channel and stub to the Audio2Face server.
+        '''
+        self.channel = grpc.insecure_channel(self.url)
+        self.stub = audio2face_pb2_grpc.Audio2FaceStub(self.channel)
+
     def appendAudData(self, audData, sampleRate):
         '''
         Appends audio data to the accumulated audio buffer and starts streaming if not already streaming.
@@ -50,24 +56,70 @@ class A2FClient:
             sampleRate (int): The sample rate of the audio data, 44100 Hz in our case
         '''
         with self.lock:
-            if self.sampleRate is None:
-                self.sampleRate = sampleRate
-            elif self.sampleRate != sampleRate:
-                log(f'Sample rate changed from {self.sampleRate} to {sampleRate}', warning=True)
-                self.sampleRate = sampleRate
-
-            audSegment = AudioSegment(
-                data=audData,
-                sample_width=self.sampleWidth,
-                frame_rate=sampleRate,
-                channels=self.channels
-            )
-            audSegment = audSegment.fade_in(25).fade_out(25) # fade in and out 
-            self.accAud += audSegment.raw_data               # to avoid clicks between chunks
+            self.accumulate(audData, sampleRate)
 
         if not self.isStreaming:
             self.startStreaming()
 
+    def accumulate(self, audData, sampleRate):
+        '''
+        Fades a chunk in and out and appends it to the accumulated audio, called with lock held.
+
+        Args:
+            audData (bytes): The audio data to append
+            sampleRate (int): The sample rate of the audio data
+        '''
+        if self.sampleRate is None:
+            self.sampleRate = sampleRate
+        elif self.sampleRate != sampleRate:
+            log(f'Sample rate changed from {self.sampleRate} to {sampleRate}', warning=True)
+            self.sampleRate = sampleRate
+
+        audSegment = AudioSegment(
+            data=audData,
+            sample_width=self.sampleWidth,
+            frame_rate=sampleRate,
+            channels=self.channels
+        )
+        audSegment = audSegment.fade_in(25).fade_out(25) # fade in and out 
+        self.accAud += audSegment.raw_data               # to avoid clicks between chunks
+
+    def takeChunk(self):
+        '''
+        Takes the next chunkDuration seconds off the accumulated audio, called with lock held.
+
+        Returns:
+            bytearray | None: The chunk, None if there isn't enough audio yet
+        '''
+        chunkSize = int(self.sampleRate * 2 * self.chunkDuration) # 2 bytes per sample
+        if len(self.accAud) < chunkSize:
+            return None
+        audChunk = self.accAud[:chunkSize] 
+        self.accAud = self.accAud[chunkSize:]
+        return audChunk
+
+    @staticmethod
+    def toA2FAudio(audChunk):
+        '''
+        Converts 16 bit PCM to the float32 samples Audio2Face expects.
+
+        Returns:
+            bytes: The converted samples
+        '''
+        return (np.frombuffer(audChunk, dtype=np.int16).astype(np.float32) / 32768.0).tobytes()
+
+    def startMarker(self):
+        '''
+        Returns:
+            audio2face_pb2.PushAudioStreamRequest: The request that opens a stream
+        '''
+        startMarker = audio2face_pb2.PushAudioRequestStart(
+            samplerate=self.sampleRate,
+            instance_name=self.instanceName,
+            block_until_playback_is_finished=False,
+        )
+        return audio2face_pb2.PushAudioStreamRequest(start_marker=startMarker)
+
     def startStreaming(self):
         '''
         Starts the audio streaming thread.        
@@ -90,25 +142,14 @@ class A2FClient:
             '''
             To yield audio chunks to the server.            
             '''
-            startMarker = audio2face_pb2.PushAudioRequestStart(
-                samplerate=self.sampleRate,
-                instance_name=self.instanceName,
-                block_until_playback_is_finished=False,
-            )
-            yield audio2face_pb2.PushAudioStreamRequest(start_marker=startMarker)           
+            yield self.startMarker()
 
             while not self.stopEvent.is_set():
                 with self.lock:
-                    chunkSize = int(self.sampleRate * 2 * self.chunkDuration) # 2 bytes per sample
-                    if len(self.accAud) >= chunkSize:
-                        audChunk = self.accAud[:chunkSize] 
-                        self.accAud = self.accAud[chunkSize:]
-                    else:
-                        audChunk = None
+                    audChunk = self.takeChunk()
 
                 if audChunk:
-                    audNp = np.frombuffer(audChunk, dtype=np.int16).astype(np.float32) / 32768.0
-                    yield audio2face_pb2.PushAudioStreamRequest(audio_data=audNp.tobytes())
+                    yield audio2face_pb2.PushAudioStreamRequest(audio_data=self.toA2FAudio(audChunk))
                     time.sleep(self.chunkDuration - .1)
                 else:
                     time.sleep(.01)
@@ -149,104 +190,183 @@ class A2FClient:
 # Main function calls for the Audio2Face socket server
 # --------------------------------------------------------------------------------------------------
 
+A2F_URL = 'localhost:50051' # gRPC endpoint of Audio2Face
+A2F_INSTANCE = '/World/LazyGraph/PlayerStreaming' # streaming audio player to push the audio to
 HOST = 'localhost'
 AUD_PORT = 65432 # audio socket port from the backend
 CNTRL_PORT = 65433 # control socket port from the backend
 BUFFER_SIZE = 4194304  # 4MB
+JOIN_TIMEOUT = 1 # seconds to wait for the server threads once they've been woken up
 
 socketServerSource = 'Audio2Face Socket Server'
 
-def runA2FServer(stopEvent):
+class StopSignal:
+    '''
+    A threading.Event that can also be waited on with select.
+    Setting it writes a byte to a socket pair, so the server threads can block on
+    their sockets without timeouts and still wake up the moment the server stops.
+    '''
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.readSocket, self.writeSocket = socket.socketpair() # sockets, so select works on Windows too
+
+    def set(self):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            try:
+                self.writeSocket.send(b'x') # never read, so it stays readable for every waiter
+            except OSError:
+                pass
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+    def fileno(self):
+        return self.readSocket.fileno()
+
+    def close(self):
+        self.readSocket.close()
+        self.writeSocket.close()
+
+def waitReadable(sock, stopEvent):
+    '''
+    Blocks until the socket has something to read or the server is stopped.
+
+    Args:
+        sock (socket.socket): The socket to wait on
+        stopEvent (StopSignal): The event to stop the server
+
+    Returns:
+        bool: True if the socket is readable, False if the server is stopping
+    '''
+    try:
+        readable, _, _ = select.select([sock, stopEvent], [], [])
+    except (ValueError, OSError): # the stop signal or the socket got closed, either way we're done
+        return False
+    return sock in readable and not stopEvent.is_set()
+
+def recvExactly(conn, length, stopEvent):
+    '''
+    Reads exactly length bytes from the connection.
+
+    Returns:
+        bytearray | None: The data, None if the connection closed or the server is stopping
+    '''
+    data = bytearray()
+    while len(data) < length:
+        if not waitReadable(conn, stopEvent):
+            return None
+        chunk = conn.recv(min(BUFFER_SIZE, length - len(data))) # read data in chunks
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return data
+
+def openListenSocket(host, port):
+    '''
+    Opens a listening socket on the given host and port.
+    '''
+    listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # rebind right away after a restart
+    listenSocket.bind((host, port))
+    listenSocket.listen(1)
+    return listenSocket
+
+def runA2FServer(stopEvent, url=A2F_URL, instanceName=A2F_INSTANCE, host=HOST, audPort=AUD_PORT, cntrlPort=CNTRL_PORT):
     '''
     Main function to run the Audio2Face socket server.
 
     Args:
-        stopEvent (threading.Event): The event to stop the server
+        stopEvent (StopSignal): The event to stop the server
+        url (str): The URL of the Audio2Face server
+        instanceName (str): The name of Audio2Face instance to stream audio to
+        host (str): Host the sockets listen on
+        audPort (int): Port of the audio socket
+        cntrlPort (int): Port of the control socket
     '''
-    a2fClient = A2FClient('localhost:50051', '/World/LazyGraph/PlayerStreaming')
-    
-    audSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    audSocket.bind((HOST, AUD_PORT))
-    audSocket.listen(1)
-    audSocket.settimeout(1)
-    log(f'Waiting for an audio connection on {HOST}:{AUD_PORT}', source=socketServerSource)
-
-    cntrlSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    cntrlSocket.bind((HOST, CNTRL_PORT))
-    cntrlSocket.listen(1)
-    cntrlSocket.settimeout(1)
-    log(f'Waiting for a control connection on {HOST}:{CNTRL_PORT}', source=socketServerSource)
-
-    audThread = threading.Thread(target=handleAudioSocket, args=(audSocket, a2fClient, stopEvent))
-    cntrlThread = threading.Thread(target=handleCntrlSocket, args=(cntrlSocket, a2fClient, stopEvent))
+    a2fClient = A2FClient(url, instanceName)
+    clientThreads = []
+
+    audSocket = openListenSocket(host, audPort)
+    log(f'Waiting for an audio connection on {host}:{audPort}', source=socketServerSource)
+
+    cntrlSocket = openListenSocket(host, cntrlPort)
+    log(f'Waiting for a control connection on {host}:{cntrlPort}', source=socketServerSource)
+
+    audThread = threading.Thread(target=acceptLoop, args=(audSocket, handleAudClient, 'Audio', a2fClient, stopEvent, clientThreads))
+    cntrlThread = threading.Thread(target=acceptLoop, args=(cntrlSocket, handleCntrlClient, 'Control', a2fClient, stopEvent, clientThreads))
     
     try:
         audThread.start()
         cntrlThread.start()
-
-        while not stopEvent.is_set():
-            time.sleep(0.1)
+        stopEvent.wait() # no polling, set by stopA2FServer
 
     except Exception as e:
         log(f'Error in main server loop: {e}', warning=True, source=socketServerSource)
 
     finally:
         log('Stopping server...', source=socketServerSource)
-        
+        stopEvent.set()
+
         if a2fClient.isStreaming:
             a2fClient.stopStreaming()
 
-        stopEvent.set()
-
-        audThread.join(timeout=-0)
-        cntrlThread.join(timeout=0)
+        threads = [audThread, cntrlThread] + clientThreads
+        for thread in threads: # all of them woke up on stopEvent
+            if thread.is_alive():
+                thread.join(timeout=JOIN_TIMEOUT)
 
         audSocket.close()
         cntrlSocket.close()
+        stillRunning = sum(1 for thread in threads if thread.is_alive())
+        if stillRunning: # they'd select on a closed socket pair otherwise
+            log(f'{stillRunning} server threads did not stop in time, leaving the stop signal open', warning=True, source=socketServerSource)
+        else:
+            stopEvent.close()
 
         log('Server stopped', source=socketServerSource)
 
-def handleCntrlSocket(cntrlSocket, a2fClient, stopEvent):
+def acceptLoop(listenSocket, handler, name, a2fClient, stopEvent, clientThreads):
     '''
-    Handles the control socket connection.
+    Accepts connections on a listening socket and hands each one to its own thread.
 
     Args:
-        cntrlSocket (socket.socket): The control socket meant for stopping the audio stream
+        listenSocket (socket.socket): The audio or control listening socket
+        handler (callable): handleAudClient or handleCntrlClient
+        name (str): Name of the socket for the logs
         a2fClient (A2FClient): The Audio2Face client defined above
-        stopEvent (threading.Event): The event to stop the server
+        stopEvent (StopSignal): The event to stop the server
+        clientThreads (list): Collects the client threads, so they can be joined on stop
     '''
-    while not stopEvent.is_set():
+    while waitReadable(listenSocket, stopEvent): # loops until stopEvent is set
         try:
-            conn, addr = cntrlSocket.accept()
-            log(f'Control connection established with {addr}', source=socketServerSource)
-            cntrlThread = threading.Thread(target=handleCntrlClient, args=(conn, a2fClient, stopEvent))
-            cntrlThread.start()
-        except socket.timeout:
-            continue
+            conn, addr = listenSocket.accept()
+            log(f'{name} connection established with {addr}', source=socketServerSource)
+            clientThread = threading.Thread(target=handler, args=(conn, a2fClient, stopEvent))
+            clientThread.start()
+            clientThreads[:] = [thread for thread in clientThreads if thread.is_alive()] + [clientThread]
         except Exception as e:
-            log(f'Control socket error: {e}', warning=True, source=socketServerSource)
+            log(f'{name} socket error: {e}', warning=True, source=socketServerSource)
             break
 
-def handleAudioSocket(audSocket, a2fClient, stopEvent):
+def parseAudMessage(data):
     '''
-    Handles the audio socket connection.
+    Splits an audio message into its sample rate and audio data.
 
     Args:
-        audSocket (socket.socket): The audio socket meant for streaming audio data
-        a2fClient (A2FClient): The Audio2Face client defined above
-        stopEvent (threading.Event): The event to stop the server
+        data (bytes): The message after its length header, sample rate|audio data
+
+    Returns:
+        tuple[int, bytes]: The sample rate and the audio data
     '''
-    while not stopEvent.is_set(): # loops until stopEvent is set
-        try:
-            conn, addr = audSocket.accept()
-            log(f'Audio connection established with {addr}', source=socketServerSource)
-            clientThread = threading.Thread(target=handleAudClient, args=(conn, a2fClient, stopEvent))
-            clientThread.start()
-        except socket.timeout:
-            continue
-        except Exception as e:
-            log(f'Audio socket error: {e}', warning=True, source=socketServerSource)
-            break
+    srBytes, audData = data.split(b'|', 1) # split audio data from sample rate
+    return struct.unpack('>i', srBytes)[0], audData
 
 def handleCntrlClient(conn, a2fClient, stopEvent):
     '''
@@ -255,11 +375,11 @@ def handleCntrlClient(conn, a2fClient, stopEvent):
     Args:
         conn (socket.socket): The control socket connection
         a2fClient (A2FClient): The Audio2Face client defined above
-        stopEvent (threading.Event): The event to stop the server
+        stopEvent (StopSignal): The event to stop the server
     '''
     try:
-        while not stopEvent.is_set():
-            data = conn.recv(4)
+        while True:
+            data = recvExactly(conn, 4, stopEvent)
             if not data:
                 break
             if data == b'stop': # hax
@@ -267,8 +387,12 @@ def handleCntrlClient(conn, a2fClient, stopEvent):
                 if a2fClient.isStreaming:
                     a2fClient.stopStreaming()
                 conn.sendall(b'stopped') 
+            elif data == b'ping': # heartbeat, the client measures the round trip time
+                conn.sendall(b'pong')
     except Exception as e:
         log(f'Control client error: {e}', warning=True, source=socketServerSource)
+    finally:
+        conn.close()
 
 def handleAudClient(conn, a2fClient, stopEvent):
     '''
@@ -277,11 +401,11 @@ def handleAudClient(conn, a2fClient, stopEvent):
     Args:
         conn (socket.socket): The audio socket connection
         a2fClient (A2FClient): The Audio2Face client defined above
-        stopEvent (threading.Event): The event to stop the server
+        stopEvent (StopSignal): The event to stop the server
     '''
     try:
-        while not stopEvent.is_set():
-            msgLenData = conn.recv(4) # read message length
+        while True:
+            msgLenData = recvExactly(conn, 4, stopEvent) # read message length
             if not msgLenData:
                 log('Client disconnected', source=socketServerSource)
                 break
@@ -289,22 +413,12 @@ def handleAudClient(conn, a2fClient, stopEvent):
 
             log(f'Receiving message of length: {msgLen}', source=socketServerSource)
 
-            data = bytearray()
-            bytesRec = 0
-            while bytesRec < msgLen:
-                chunk = conn.recv(min(BUFFER_SIZE, msgLen - bytesRec)) # read data in chunks
-                if not chunk:
-                    log('Connection closed before receiving complete message', source=socketServerSource)
-                    return
-                data.extend(chunk)
-                bytesRec += len(chunk)
-
-            if bytesRec != msgLen:
-                log(f'Received incomplete message! Expected {msgLen} bytes, got {bytesRec}', warning=True, source=socketServerSource)
-                continue
+            data = recvExactly(conn, msgLen, stopEvent)
+            if data is None:
+                log('Connection closed before receiving complete message', source=socketServerSource)
+                return
 
-            srBytes, audData = data.split(b'|', 1) # split audio data from sample rate
-            sr = struct.unpack('>i', srBytes)[0]
+            sr, audData = parseAudMessage(data)
 
             log(f'Received audio data: length={len(audData)}, sr={sr}', source=socketServerSource)
 
@@ -315,20 +429,32 @@ def handleAudClient(conn, a2fClient, stopEvent):
     finally:
         conn.close()
 
-def startA2FServer():
+def startA2FServer(**kwargs):
     '''
     Meant to start the Audio2Face server in a separate thread.
+
+    Args:
+        **kwargs: Passed on to runA2FServer (url, instanceName, host, audPort, cntrlPort)
+
+    Returns:
+        tuple[StopSignal, threading.Thread]: The event to stop the server and its thread
     '''
-    stopEvent = threading.Event()
-    serverThread = threading.Thread(target=runA2FServer, args=(stopEvent,))
+    stopEvent = StopSignal()
+    serverThread = threading.Thread(target=runA2FServer, args=(stopEvent,), kwargs=kwargs)
     serverThread.start()
     return stopEvent, serverThread
 
-def stopA2FServer(stopEvent, serverThread):
+def stopA2FServer(stopEvent, serverThread, timeout=5):
     '''
     Stops the Audio2Face server.
+    Every server thread is woken up right away, so this usually takes a few milliseconds.
+
+    Returns:
+        float: Seconds it took the server to stop
     '''
+    start = time.perf_counter()
     stopEvent.set()
-    serverThread.join(timeout=5) 
+    serverThread.join(timeout=timeout) 
     if serverThread.is_alive():
-        log('Server thread did not stop in time. Forcing shutdown.', warning=True, source=socketServerSource)
\ No newline at end of file
+        log('Server thread did not stop in time. Forcing shutdown.', warning=True, source=socketServerSource)
+    return time.perf_counter() - start
@@ -0,0 +1,178 @@
+# --------------------------------------------------------------------------------------------------
+# Local stand-in for the Audio2Face gRPC server.
+# Implements PushAudioStream / PushAudio, keeping the received samples and when they arrived,
+# so the bridge can be run and load tested without Omniverse. From shakespeare/ai:
+#   python -m a2f.standin [--port 50051] [--record streams.json] [--save-dir wavs]
+# --------------------------------------------------------------------------------------------------
+
+import argparse, json, os, threading, time, wave
+from concurrent import futures
+import grpc
+import numpy as np
+import audio2face_pb2, audio2face_pb2_grpc
+from .server import log
+
+standInSource = 'Audio2Face Stand-in'
+
+class StreamRecord:
+    '''
+    What one PushAudioStream / PushAudio call delivered, and when.
+    '''
+    def __init__(self, instanceName, sampleRate, startTime):
+        self.instanceName = instanceName
+        self.sampleRate = sampleRate
+        self.startTime = startTime # perf_counter time the start marker arrived
+        self.arrivals = [] # (seconds since start, samples) per audio message
+        self.chunks = [] # float32 samples per audio message
+        self.endTime = None
+
+    @property
+    def sampleCount(self):
+        return sum(samples for _, samples in self.arrivals)
+
+    def add(self, audioData):
+        samples = np.frombuffer(audioData, dtype=np.float32)
+        self.arrivals.append((time.perf_counter() - self.startTime, len(samples)))
+        self.chunks.append(samples)
+
+    def samples(self):
+        '''
+        Returns:
+            np.ndarray: All received samples as float32
+        '''
+        return np.concatenate(self.chunks) if self.chunks else np.zeros(0, dtype=np.float32)
+
+    def summary(self):
+        '''
+        Returns:
+            dict: Audio duration, wall time, first audio latency and the longest gap between messages.
+                  startTime is the raw perf_counter time, comparable with other processes' on the same machine
+        '''
+        audioSeconds = self.sampleCount / self.sampleRate if self.sampleRate else 0.
+        wallSeconds = (self.endTime or time.perf_counter()) - self.startTime
+        gaps = [later[0] - earlier[0] for earlier, later in zip(self.arrivals, self.arrivals[1:])]
+        return {
+            'instanceName': self.instanceName,
+            'startTime': self.startTime,
+            'sampleRate': self.sampleRate,
+            'messages': len(self.arrivals),
+            'samples': self.sampleCount,
+            'audioSeconds': audioSeconds,
+            'wallSeconds': wallSeconds,
+            'firstAudioMs': self.arrivals[0][0] * 1000 if self.arrivals else None,
+            'maxGapMs': max(gaps) * 1000 if gaps else None,
+            'arrivals': [{'ms': seconds * 1000, 'samples': samples} for seconds, samples in self.arrivals]
+        }
+
+class A2FStandIn(audio2face_pb2_grpc.Audio2FaceServicer):
+    '''
+    Records everything pushed to it instead of animating a face.
+    '''
+    def __init__(self, onStreamStart=None, onAudio=None):
+        '''
+        Args:
+            onStreamStart (callable): Called with the StreamRecord when a stream starts
+            onAudio (callable): Called with the StreamRecord after every audio message
+        '''
+        self.streams = []
+        self.lock = threading.Lock()
+        self.onStreamStart = onStreamStart
+        self.onAudio = onAudio
+
+    def startRecord(self, instanceName, sampleRate):
+        record = StreamRecord(instanceName, sampleRate, time.perf_counter())
+        with self.lock:
+            self.streams.append(record)
+        if self.onStreamStart:
+            self.onStreamStart(record)
+        return record
+
+    def PushAudioStream(self, request_iterator, context):
+        record = None
+        for request in request_iterator:
+            if request.HasField('start_marker'):
+                marker = request.start_marker
+                record = self.startRecord(marker.instance_name, marker.samplerate)
+            elif record is None:
+                return audio2face_pb2.PushAudioStreamResponse(success=False, message='Audio before the start marker')
+            elif request.audio_data: # the bridge ends its streams with an empty message
+                record.add(request.audio_data)
+                if self.onAudio:
+                    self.onAudio(record)
+        if record is None:
+            return audio2face_pb2.PushAudioStreamResponse(success=False, message='No start marker')
+        record.endTime = time.perf_counter()
+        summary = record.summary()
+        log(f"Stream done: {summary['audioSeconds']:.2f}s of audio in {summary['wallSeconds']:.2f}s, "
+            f"{summary['messages']} messages", source=standInSource)
+        return audio2face_pb2.PushAudioStreamResponse(success=True, message='')
+
+    def PushAudio(self, request, context):
+        record = self.startRecord(request.instance_name, request.samplerate)
+        record.add(request.audio_data)
+        record.endTime = time.perf_counter()
+        if self.onAudio:
+            self.onAudio(record)
+        return audio2face_pb2.PushAudioResponse(success=True, message='')
+
+    def save(self, recordPath=None, saveDir=None):
+        '''
+        Writes the stream summaries as JSON and / or the received audio as 16 bit WAV files.
+
+        Args:
+            recordPath (str): JSON file for the summaries
+            saveDir (str): Directory for one WAV file per stream
+        '''
+        with self.lock:
+            streams = list(self.streams)
+        if recordPath:
+            with open(recordPath, 'w', encoding='utf-8') as f:
+                json.dump([record.summary() for record in streams], f, indent=2)
+        if saveDir:
+            os.makedirs(saveDir, exist_ok=True)
+            for index, record in enumerate(streams):
+                with wave.open(os.path.join(saveDir, f'stream{index:03d}.wav'), 'wb') as wavFile:
+                    wavFile.setnchannels(1)
+                    wavFile.setsampwidth(2)
+                    wavFile.setframerate(record.sampleRate or 44100)
+                    wavFile.writeframes((np.clip(record.samples(), -1, 1) * 32767).astype(np.int16).tobytes())
+
+def serveStandIn(address='localhost:50051', standIn=None, workers=8):
+    '''
+    Starts the stand-in gRPC server.
+
+    Args:
+        address (str): Address to listen on, port 0 picks a free one
+        standIn (A2FStandIn): The servicer, a new one if not given
+        workers (int): Threads handling calls, one per concurrent stream
+
+    Returns:
+        tuple[grpc.Server, A2FStandIn, int]: The running server, its servicer and the bound port
+    '''
+    standIn = standIn or A2FStandIn()
+    grpcServer = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+    audio2face_pb2_grpc.add_Audio2FaceServicer_to_server(standIn, grpcServer)
+    port = grpcServer.add_insecure_port(address)
+    grpcServer.start()
+    log(f"Listening on {address.rsplit(':', 1)[0]}:{port}", source=standInSource)
+    return grpcServer, standIn, port
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Audio2Face gRPC server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=50051)
+    parser.add_argument('--record', help='Write the received streams with their timing to this JSON file on exit')
+    parser.add_argument('--save-dir', help='Write the received audio of every stream to this directory on exit')
+    args = parser.parse_args()
+
+    grpcServer, standIn, _ = serveStandIn(f'{args.host}:{args.port}')
+    try:
+        grpcServer.wait_for_termination()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        grpcServer.stop(0)
+        standIn.save(args.record, args.save_dir)
+
+if __name__ == '__main__':
+    main()
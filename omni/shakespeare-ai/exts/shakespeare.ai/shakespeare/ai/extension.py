@@ -2,13 +2,74 @@
 # Extension for the Shakespeare AI project, which manages the server connection and project launch.
 # ---------------------------------------------------------------------------------------------------
 
-import omni.ext, omni.usd, omni.kit.app, os, asyncio, subprocess, psutil, carb.events
+import omni.ext, omni.usd, omni.kit.app, os, sys, shutil, asyncio, subprocess, psutil, time, carb.events, carb.settings
 import omni.ui as ui
-from .a2f import server
+from .a2f import server, aioserver
+from . import frametime
 
 def log(text: str, warning: bool = False):                             # attaching a tag w the print statement,
     print(f"[Shakespeare AI] {'[Warning]' if warning else ''} {text}") # to easily find it in the console
 
+CLOSE_TIMEOUT = 5 # seconds the conversation window gets to exit before it's killed
+SETTINGS_PATH = '/exts/shakespeare.ai/'
+BRIDGE_MODES = ('threads', 'asyncio', 'subprocess') # where the A2F bridge runs: its own threads, Kit's event loop or its own process
+BRIDGE_START_TIMEOUT = 1 # seconds the bridge process has to stay up to count as started
+
+async def waitForExit(process: subprocess.Popen):
+    '''
+    Waits for a child process to exit without polling it.
+    On Linux the loop watches a pidfd, which becomes readable when the process exits.
+    Elsewhere a worker thread blocks in wait(), which the OS wakes up on exit.
+
+    Args:
+        process (subprocess.Popen): The process to wait for
+
+    Returns:
+        int: The exit code of the process
+    '''
+    loop = asyncio.get_event_loop()
+    if hasattr(os, 'pidfd_open') and process.poll() is None:
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except OSError: # older kernel
+            pidfd = None
+        if pidfd is not None:
+            exited = loop.create_future()
+            try:
+                loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+            except NotImplementedError: # the loop can't watch file descriptors
+                os.close(pidfd)
+            else:
+                try:
+                    await exited
+                finally:
+                    loop.remove_reader(pidfd)
+                    os.close(pidfd)
+                return process.wait() # reaps it right away, it already exited
+    return await loop.run_in_executor(None, process.wait)
+
+def findBridgePython(configured: str = ''):
+    '''
+    Finds the Python interpreter to run the bridge process on.
+    Inside Kit sys.executable is the Kit binary, so it looks for the Python bundled with Kit,
+    whose prefix the embedded interpreter runs from.
+
+    Args:
+        configured (str): The bridgePython setting, a path or a command on PATH, used as is if set
+
+    Returns:
+        str: Path to the interpreter, None if there is none
+    '''
+    if configured:
+        return shutil.which(configured)
+    candidates = []
+    if os.path.basename(sys.executable).lower().startswith('python'): # running outside of Kit
+        candidates.append(sys.executable)
+    for prefix in dict.fromkeys((sys.prefix, sys.base_prefix)):
+        candidates += [os.path.join(prefix, 'python.exe'), os.path.join(prefix, 'bin', 'python3'),
+                       os.path.join(prefix, 'python3'), os.path.join(prefix, 'bin', 'python')]
+    return next((path for path in candidates if os.path.isfile(path)), None)
+
 # ---------------------------------------------------------------------------------------------------
 # Main extension class derrived from omni.ext.IExt, which is the main entry point for the extension
 # ---------------------------------------------------------------------------------------------------
@@ -27,11 +88,19 @@ class ShakespeareProjectExtension(omni.ext.IExt):
             - stopEvent: event to stop the server
             - serverThread: thread to run the server
             - convoProcess: process to run the conversation window            
+            - monitorTask: task waiting for the conversation window to exit
+            - serverTask: task starting or stopping the server on a serverBtn click
+            - aioServer: the server when it runs on Kit's event loop instead of threads
+            - bridgeProcess: the server when it runs as its own process
         '''
         super().__init__()
         self.stopEvent = None
         self.serverThread = None
         self.convoProcess = None
+        self.monitorTask = None
+        self.serverTask = None
+        self.aioServer = None
+        self.bridgeProcess = None
 
     def on_startup(self, ext_id):
         '''
@@ -43,6 +112,13 @@ class ShakespeareProjectExtension(omni.ext.IExt):
         '''
         log('Startup')
         self.extId = ext_id    
+        settings = carb.settings.get_settings()
+        self.bridgeMode = settings.get(SETTINGS_PATH + 'bridgeMode') or 'threads'
+        if self.bridgeMode not in BRIDGE_MODES:
+            log(f'Unknown bridge mode {self.bridgeMode}, using threads', warning=True)
+            self.bridgeMode = 'threads'
+        self.measureFrameTime = bool(settings.get(SETTINGS_PATH + 'measureFrameTime'))
+        self.bridgePython = settings.get(SETTINGS_PATH + 'bridgePython') or ''
         self.initUI()
         self.registerShutDownListener()
 
@@ -51,6 +127,8 @@ class ShakespeareProjectExtension(omni.ext.IExt):
         Initializes the UI with the following components:
             - openProjectBtn: button to open the project
             - serverBtn: button to connect to the conversation window server            
+            - measureBtn: button to measure the frame time impact of the bridge modes,
+                          only there with the measureFrameTime setting
         '''
         self._window = ui.Window('Shakespeare AI Server', width=225, height=125)
         with self._window.frame:
@@ -58,6 +136,8 @@ class ShakespeareProjectExtension(omni.ext.IExt):
                 ui.Spacer(height=10)
                 self.openProjectBtn = ui.Button('Open Project', clicked_fn=self.onOpenProjectBtnClick, height=30)
                 self.serverBtn = ui.Button('Connect to Server', clicked_fn=self.onServerBtnClick, height=30)
+                if self.measureFrameTime:
+                    self.measureBtn = ui.Button('Measure Bridge Modes', clicked_fn=self.onMeasureBtnClick, height=30)
                 ui.Spacer(height=10)
 
     def onOpenProjectBtnClick(self):
@@ -73,15 +153,98 @@ class ShakespeareProjectExtension(omni.ext.IExt):
         '''
         Bound to the serverBtn click event, 
         it connects to the conversation window server when clicked.
+        Clicks while the server is still starting or stopping are ignored.
         '''
-        try:
-            if not self.stopEvent:
-                self.stopEvent, self.serverThread = server.startA2FServer()
-                self.serverBtn.text = 'Disconnect from Server'
-                log('Connected to server')
-                self.openConversationWindow()
+        if self.serverTask and not self.serverTask.done():
+            log('The server is still starting or stopping', warning=True)
+            return
+        if not self.isServerRunning:
+            self.serverTask = asyncio.ensure_future(self.startServerAsync())
+        else:
+            self.serverTask = asyncio.ensure_future(self.stopServerAsync())
+
+    def onMeasureBtnClick(self):
+        '''
+        Bound to the measureBtn click event, it runs the frame time measurement of each bridge mode.
+        '''
+        if self.isServerRunning or (self.serverTask and not self.serverTask.done()):
+            log('Disconnect from the server before measuring', warning=True)
+            return
+        asyncio.ensure_future(frametime.measureBridgeModes(self.startBridge, self.stopBridge))
+
+    @property
+    def isServerRunning(self):
+        return self.stopEvent is not None or self.aioServer is not None or self.bridgeProcess is not None
+
+    async def startBridge(self, mode):
+        '''
+        Starts the A2F bridge, on its own threads, as coroutines on Kit's event loop
+        or as a headless bridge process (python -m a2f) that doesn't share Kit's GIL at all.
+
+        Args:
+            mode (str): One of BRIDGE_MODES
+        '''
+        if mode == 'asyncio':
+            self.aioServer = aioserver.AioA2FServer()
+            try:
+                await self.aioServer.start()
+            except Exception:
+                self.aioServer = None
+                raise
+        elif mode == 'subprocess':
+            python = findBridgePython(self.bridgePython)
+            if python is None:
+                raise RuntimeError(f'No Python interpreter for the bridge process, set {SETTINGS_PATH}bridgePython')
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path)) # Kit's packages
+            process = subprocess.Popen([python, '-m', 'a2f', '--mode', 'asyncio'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+            try:
+                exitCode = await asyncio.wait_for(waitForExit(process), timeout=BRIDGE_START_TIMEOUT)
+            except asyncio.TimeoutError: # still running, it started
+                self.bridgeProcess = process
+                log(f'Started the bridge process with PID: {process.pid} on {python}')
             else:
-                asyncio.ensure_future(self.stopServerAsync()) 
+                raise RuntimeError(f'The bridge process ({python} -m a2f) exited right away with code {exitCode}, '
+                                   'see its output above')
+        else:
+            self.stopEvent, self.serverThread = server.startA2FServer()
+
+    async def stopBridge(self):
+        '''
+        Stops the A2F bridge in whichever mode it runs, without blocking the Kit UI.
+
+        Returns:
+            float: Seconds it took the bridge to stop
+        '''
+        if self.aioServer:
+            aioServer, self.aioServer = self.aioServer, None
+            return await aioServer.stop()
+        if self.bridgeProcess:
+            process, self.bridgeProcess = self.bridgeProcess, None
+            start = time.perf_counter()
+            process.terminate()
+            try:
+                await asyncio.wait_for(waitForExit(process), timeout=CLOSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                log('Bridge process did not stop in time, killing it', warning=True)
+                process.kill()
+            return time.perf_counter() - start
+        if self.stopEvent and self.serverThread:
+            stopEvent, serverThread = self.stopEvent, self.serverThread
+            self.stopEvent = None
+            self.serverThread = None
+            return await asyncio.get_event_loop().run_in_executor(None, server.stopA2FServer, stopEvent, serverThread)
+        return 0.
+
+    async def startServerAsync(self):
+        '''
+        Starts the server and opens the conversation window.
+        '''
+        try:
+            await self.startBridge(self.bridgeMode)
+            self.serverBtn.text = 'Disconnect from Server'
+            log(f'Connected to server ({self.bridgeMode} bridge)')
+            self.openConversationWindow()
         except Exception as e:
             log(f'Error with server connection: {e}', warning=True)
 
@@ -96,41 +259,90 @@ class ShakespeareProjectExtension(omni.ext.IExt):
             exePath = os.path.normpath(os.path.join(rootPath, 'app', 'build', 'Shakespeare AI.exe'))
             self.convoProcess = subprocess.Popen([exePath])
             log(f'Opened conversation window with PID: {self.convoProcess.pid}')
-            asyncio.ensure_future(self.monitorConversationWindow())
+            self.monitorTask = asyncio.ensure_future(self.monitorConversationWindow(self.convoProcess))
         except Exception as e:
             log(f'Error opening conversation window: {e}', warning=True)
 
+    def terminateConversationWindow(self):
+        '''
+        Asks the conversation window process and its children to terminate, without waiting.
+
+        Returns:
+            tuple[subprocess.Popen, list]: The process and its child processes, None if it wasn't running
+        '''
+        process, self.convoProcess = self.convoProcess, None
+        if process is None:
+            return None
+        try:
+            children = psutil.Process(process.pid).children(recursive=True)
+            for child in children:
+                child.terminate()
+            process.terminate()
+            return process, children
+        except psutil.NoSuchProcess:
+            log('Conversation window process not found', warning=True)
+        except Exception as e:
+            log(f'Error closing conversation window: {e}', warning=True)
+        return None
+
     def closeConversationWindow(self):
         '''
         Closes the conversation window process if it is running.
         We first terminate the process and its children, 
         then wait for up to 5 seconds for the process to close.
+        Blocks, so only used when Kit is shutting down anyway.
         '''
-        if self.convoProcess:
+        terminated = self.terminateConversationWindow()
+        if terminated:
+            process, children = terminated
             try:
-                process = psutil.Process(self.convoProcess.pid)
-                for child in process.children(recursive=True):
-                    child.terminate()
-                process.terminate()
-                process.wait(timeout=5) 
-                log(f'Closed conversation window with PID: {self.convoProcess.pid}')
-            except psutil.NoSuchProcess:
-                log('Conversation window process not found', warning=True)
+                process.wait(timeout=CLOSE_TIMEOUT)
+                psutil.wait_procs(children, timeout=CLOSE_TIMEOUT)
+                log(f'Closed conversation window with PID: {process.pid}')
             except Exception as e:
                 log(f'Error closing conversation window: {e}', warning=True)
-            finally:
-                self.convoProcess = None
 
-    async def monitorConversationWindow(self):
+    async def closeConversationWindowAsync(self):
         '''
-        Uses asyncio to monitor the conversation window process.
+        Closes the conversation window process if it is running,
+        waiting for it to exit without blocking the Kit UI. Killed if it doesn't in time.
         '''
-        while True:
-            await asyncio.sleep(1)
-            if self.convoProcess is None or self.convoProcess.poll() is not None:
-                log('Conversation window closed')
-                await self.stopServerAsync()
-                break
+        if self.monitorTask and self.monitorTask is not asyncio.current_task():
+            self.monitorTask.cancel() # we're the ones closing it
+        self.monitorTask = None
+
+        terminated = self.terminateConversationWindow()
+        if not terminated:
+            return
+        process, children = terminated
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(waitForExit(process), timeout=CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            log(f'Conversation window did not close in {CLOSE_TIMEOUT}s, killing it', warning=True)
+            process.kill()
+        for child in children: # usually already gone along with the window
+            try:
+                child.kill()
+            except psutil.NoSuchProcess:
+                pass
+        log(f'Closed conversation window with PID: {process.pid} in {(time.perf_counter() - start) * 1000:.0f}ms')
+
+    async def monitorConversationWindow(self, process):
+        '''
+        Stops the server as soon as the conversation window exits.
+
+        Args:
+            process (subprocess.Popen): The conversation window process
+        '''
+        try:
+            await waitForExit(process)
+        except asyncio.CancelledError:
+            return
+        if process is self.convoProcess: # not closed by us
+            log('Conversation window closed')
+            self.convoProcess = None
+            await self.stopServerAsync()
 
     def normalizePath(self, path):
         '''
@@ -177,14 +389,13 @@ class ShakespeareProjectExtension(omni.ext.IExt):
         '''
         Asynchronously stops the server, 
         updates the UI, and closes the conversation window.        
+        The Kit UI never waits for the server to stop.
         '''
-        if self.stopEvent and self.serverThread:
-            server.stopA2FServer(self.stopEvent, self.serverThread)
-            self.stopEvent = None
-            self.serverThread = None
+        if self.isServerRunning:
             self.serverBtn.text = 'Connect to Server'
-            log('Disconnected from server')
-            self.closeConversationWindow()
+            elapsed = await self.stopBridge()
+            log(f'Disconnected from server in {elapsed * 1000:.0f}ms')
+            await self.closeConversationWindowAsync()
 
     def openShakespeareStage(self):
         stagePath = self.getShakespeareStageFilePath()
@@ -227,7 +438,23 @@ class ShakespeareProjectExtension(omni.ext.IExt):
         log('Shutdown')
         if hasattr(self, 'shutdownStub'):
             self.shutdownStub = None
-        if self.stopEvent:
-            asyncio.get_event_loop().run_until_complete(self.stopServerAsync())        
+        if self.monitorTask:
+            self.monitorTask.cancel()
+            self.monitorTask = None
+        if self.serverTask:
+            self.serverTask.cancel()
+            self.serverTask = None
+        if self.isServerRunning: # stops in milliseconds, fine to do synchronously here
+            if self.aioServer:
+                self.aioServer.close()
+                self.aioServer = None
+            elif self.bridgeProcess:
+                self.bridgeProcess.terminate()
+                self.bridgeProcess = None
+            else:
+                server.stopA2FServer(self.stopEvent, self.serverThread)
+                self.stopEvent = None
+                self.serverThread = None
+            self.closeConversationWindow()
         if self._window:
             self._window.destroy()
\ No newline at end of file
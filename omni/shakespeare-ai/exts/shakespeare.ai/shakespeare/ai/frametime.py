@@ -0,0 +1,133 @@
+# ---------------------------------------------------------------------------------------------------
+# Frame time measurement, to see what hosting the A2F bridge costs Kit's update loop.
+# Enabled with the /exts/shakespeare.ai/measureFrameTime setting, which adds a button to the window
+# that runs each bridge mode for a while with synthetic speech going through it.
+# ---------------------------------------------------------------------------------------------------
+
+import omni.kit.app, asyncio, math, struct, time
+from .a2f import server
+
+def log(text: str, warning: bool = False):
+    print(f"[Shakespeare AI] {'[Warning]' if warning else ''} {text}")
+
+class FrameTimeProbe:
+    '''
+    Records the time between Kit update events.
+    '''
+    def __init__(self):
+        self.frameTimes = []
+        self.lastFrame = None
+        self.subscription = None
+
+    def start(self):
+        self.frameTimes = []
+        self.lastFrame = None
+        stream = omni.kit.app.get_app().get_update_event_stream()
+        self.subscription = stream.create_subscription_to_pop(self.onUpdate, name='SPAIFrameTimeProbe')
+
+    def stop(self):
+        if self.subscription:
+            self.subscription.unsubscribe() # the subscription and onUpdate keep each other alive otherwise
+            self.subscription = None
+
+    def onUpdate(self, e):
+        now = time.perf_counter()
+        if self.lastFrame is not None:
+            self.frameTimes.append(now - self.lastFrame)
+        self.lastFrame = now
+
+    def summary(self):
+        '''
+        Returns:
+            dict: Frame count, p50 / p95 / p99 / max frame time in milliseconds,
+                  and the number of hitches (frames taking over twice the median)
+        '''
+        if not self.frameTimes:
+            return {'frames': 0}
+        ordered = sorted(self.frameTimes)
+        percentile = lambda p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000
+        median = percentile(50)
+        return {
+            'frames': len(ordered),
+            'p50Ms': median,
+            'p95Ms': percentile(95),
+            'p99Ms': percentile(99),
+            'maxMs': ordered[-1] * 1000,
+            'hitches': sum(1 for frameTime in ordered if frameTime * 1000 > 2 * median)
+        }
+
+async def feedSyntheticSpeech(seconds, port=server.AUD_PORT, sampleRate=44100, chunkSeconds=.1):
+    '''
+    Sends a tone to the bridge's audio socket in real time, the way the conversation window does.
+
+    Args:
+        seconds (float): How long to keep sending
+        port (int): The audio socket port
+        sampleRate (int): Sample rate of the tone
+        chunkSeconds (float): Length of each chunk
+    '''
+    samples = int(sampleRate * chunkSeconds)
+    pcm = b''.join(struct.pack('<h', int(8000 * math.sin(2 * math.pi * 220 * i / sampleRate))) for i in range(samples))
+    message = struct.pack('>i', sampleRate) + b'|' + pcm
+    frame = struct.pack('>i', len(message)) + message
+
+    for attempt in range(50): # a bridge process needs a moment to start listening
+        try:
+            _, writer = await asyncio.open_connection(server.HOST, port)
+            break
+        except OSError:
+            if attempt == 49:
+                raise
+            await asyncio.sleep(.1)
+    try:
+        start = time.perf_counter()
+        sent = 0
+        while time.perf_counter() - start < seconds:
+            writer.write(frame)
+            await writer.drain()
+            sent += 1
+            await asyncio.sleep(max(0., start + sent * chunkSeconds - time.perf_counter()))
+    finally:
+        writer.close()
+
+async def measureBridgeModes(startBridge, stopBridge, modes=('idle', 'threads', 'asyncio', 'subprocess'), seconds=10.):
+    '''
+    Runs every bridge mode for a while with synthetic speech going through it,
+    and reports the frame times Kit had meanwhile.
+
+    Args:
+        startBridge (callable): Coroutine function starting the bridge in the given mode
+        stopBridge (callable): Coroutine function stopping it again
+        modes (tuple): Modes to measure, 'idle' measures Kit without any bridge
+        seconds (float): How long each mode is measured
+
+    Returns:
+        dict: Mode -> FrameTimeProbe.summary()
+    '''
+    probe = FrameTimeProbe()
+    results = {}
+    for mode in modes:
+        if mode != 'idle':
+            await startBridge(mode)
+        probe.start()
+        try:
+            if mode == 'idle':
+                await asyncio.sleep(seconds)
+            else:
+                await feedSyntheticSpeech(seconds)
+        except Exception as e:
+            log(f'Measuring {mode} failed: {e}', warning=True)
+        finally:
+            probe.stop()
+            if mode != 'idle':
+                await stopBridge()
+        results[mode] = probe.summary()
+
+    log(f"{'mode':<10} {'frames':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'hitches':>8}")
+    for mode, stats in results.items():
+        if not stats['frames']:
+            log(f'{mode:<10} no frames recorded', warning=True)
+            continue
+        log(f"{mode:<10} {stats['frames']:>7} {stats['p50Ms']:>8.2f} {stats['p95Ms']:>8.2f} "
+            f"{stats['p99Ms']:>8.2f} {stats['maxMs']:>8.2f} {stats['hitches']:>8}")
+    return results